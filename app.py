@@ -7,19 +7,39 @@ import os
 import sys
 import json
 import time
+import uuid
+import random
 import base64
+import hmac
+import hashlib
+import socket
+import sqlite3
+import urllib.parse
+import math
+import bisect
+import array
+import struct
+import collections
+import contextlib
 import asyncio
 import logging
 import concurrent.futures
 import traceback
+import argparse
+import signal
+import tempfile
 from threading import Thread, Lock
 from typing import Dict, Any, Optional, List
 
 # Flask imports
-from flask import Flask, jsonify, render_template_string, request
+from flask import Flask, Response, jsonify, render_template_string, request
 from flask_cors import CORS
 from flask_sock import Sock
 
+# Retry/backoff helpers shared with gemvoice.py
+from resilience import CircuitBreaker, CircuitOpenError, backoff_delay, retry_async
+from clients import ClientRegistry
+
 # Google Gemini imports
 from google import genai
 try:
@@ -28,6 +48,41 @@ try:
 except ImportError:
     TYPES_AVAILABLE = False
 
+# Starlette powers the optional ASGI server mode (create_asgi_app)
+try:
+    import jinja2
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse
+    from starlette.routing import Route, WebSocketRoute
+    STARLETTE_AVAILABLE = True
+except ImportError:
+    STARLETTE_AVAILABLE = False
+
+# NumPy speeds up the PCM analysis; pure-Python fallbacks are used without it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# opuslib enables the Opus codec on /audio-stream. It raises a plain
+# Exception when the libopus shared library itself is missing.
+try:
+    import opuslib
+    OPUS_AVAILABLE = True
+except Exception:
+    OPUS_AVAILABLE = False
+
+# OpenTelemetry is optional; sampled latency traces can also be exported to it
+try:
+    from opentelemetry import trace as otel_trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
 # WebSocket handling
 import websockets
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
@@ -41,9 +96,13 @@ logger = logging.getLogger(__name__)
 
 # ==== Configuration Settings ====
 
-# API Key should be set as an environment variable
+# API Key should be set as an environment variable. GEMINI_API_KEYS takes a
+# comma-separated list; sessions are spread round-robin across the keys.
 API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
+API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+if not API_KEYS and API_KEY:
+    API_KEYS = [API_KEY]
+if not API_KEYS:
     logger.warning("No GEMINI_API_KEY found in environment variables!")
 
 # Audio settings
@@ -57,9 +116,103 @@ MODEL = "models/gemini-2.0-flash-live-001"
 # Connection settings
 CONNECTION_TIMEOUT = 30.0
 MAX_RETRIES = 3
-RETRY_DELAY = 1.0
+RETRY_DELAY = 1.0  # base delay; doubles per attempt, with full jitter
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 10.0))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))  # consecutive connect failures
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30.0))  # seconds before a half-open probe
+# Seconds a stopping session gets to cancel its tasks and close the Gemini connection
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 2.0))
+
+# Session resumption: reconnect to Gemini when the upstream drops mid-call.
+# Off by default: it turns on input and output transcription for every
+# session (the history replayed when no resumption handle is usable), which
+# Gemini bills and streams alongside the audio.
+SESSION_RESUME = os.getenv("SESSION_RESUME", "0") == "1"
+RESUME_MAX_ATTEMPTS = int(os.getenv("RESUME_MAX_ATTEMPTS", 5))
+RESUME_HISTORY_TURNS = int(os.getenv("RESUME_HISTORY_TURNS", 20))  # transcript turns kept for replay
+RESUME_TURN_CHARS = int(os.getenv("RESUME_TURN_CHARS", 1000))  # tail of each turn that is replayed
 PORT = int(os.getenv("PORT", 5000))
 
+# Session settings
+MAX_CONCURRENT_SESSIONS = int(os.getenv("MAX_CONCURRENT_SESSIONS", 5))
+# Seconds a session may go without a caller attached (never connected, or
+# its WebSocket dropped) before it is ended and its slot freed; 0 disables
+ORPHAN_TIMEOUT = float(os.getenv("ORPHAN_TIMEOUT", 60.0))
+EVENT_LOOP_WORKERS = max(1, int(os.getenv("EVENT_LOOP_WORKERS", 1)))
+
+# Connection pre-warming: keep this many Gemini live connections open and
+# ready to hand to new sessions (0 disables the pool)
+PREWARM_SESSIONS = int(os.getenv("PREWARM_SESSIONS", 0))
+PREWARM_MAX_IDLE = float(os.getenv("PREWARM_MAX_IDLE", 240.0))  # seconds before a warm connection is recycled
+PREWARM_HEALTH_INTERVAL = float(os.getenv("PREWARM_HEALTH_INTERVAL", 30.0))  # seconds between pings
+
+# Horizontal scaling: each worker has an id (encoded in session tokens) and,
+# when several workers run, a URL other workers can redirect clients to.
+# SESSION_REGISTRY is "memory" (single worker) or "sqlite:///path/to/file.db".
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_URL = os.getenv("WORKER_URL")
+SESSION_REGISTRY = os.getenv("SESSION_REGISTRY", "memory")
+SESSION_SECRET = os.getenv("SESSION_SECRET") or os.urandom(16).hex()  # share it across workers
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 30.0))  # seconds a stopping worker waits for calls to end
+
+# Output fan-out settings
+SUBSCRIBER_BUFFER_SIZE = int(os.getenv("SUBSCRIBER_BUFFER_SIZE", 50))  # messages per client
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 32))  # threads for blocking socket sends
+SEND_TIMEOUT = float(os.getenv("SEND_TIMEOUT", 10.0))  # seconds one send may stall before the client is dropped (0 = never)
+MONITOR_TOKEN = os.getenv("MONITOR_TOKEN")  # enables ?mode=monitor listen-in when set
+
+# Latency tracing: the fraction of inbound chunks and model turns that are
+# stamped, and where finished traces go ("log", "otel" or "both")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.0))
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "log")
+
+# Queue backpressure policies
+QUEUE_POLICY_BLOCK = "block"
+QUEUE_POLICY_DROP_OLDEST = "drop_oldest"
+QUEUE_POLICY_COALESCE = "coalesce"
+QUEUE_POLICIES = (QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_COALESCE)
+
+BARGE_IN_OFF = "off"
+BARGE_IN_SERVER = "server"
+BARGE_IN_VAD = "vad"
+BARGE_IN_MODES = (BARGE_IN_OFF, BARGE_IN_SERVER, BARGE_IN_VAD)
+
+# Why a session is paused
+PAUSE_CLIENT = "client"
+PAUSE_IDLE = "idle"
+
+# Per-session defaults; /start_voice can override them with "options"
+SESSION_DEFAULTS = {
+    # Client audio waiting to be sent to Gemini
+    "out_queue_size": int(os.getenv("OUT_QUEUE_SIZE", 50)),
+    "out_queue_policy": os.getenv("OUT_QUEUE_POLICY", QUEUE_POLICY_COALESCE),
+    # Gemini audio waiting to be fanned out to clients
+    "in_queue_size": int(os.getenv("IN_QUEUE_SIZE", 100)),
+    "in_queue_policy": os.getenv("IN_QUEUE_POLICY", QUEUE_POLICY_BLOCK),
+    # Upstream batching: queued PCM is merged into frames of this many ms
+    # before session.send, waiting at most upstream_max_wait_ms for more
+    # audio. 0 sends every chunk as it arrives.
+    "upstream_frame_ms": int(os.getenv("UPSTREAM_FRAME_MS", 40)),
+    "upstream_max_wait_ms": int(os.getenv("UPSTREAM_MAX_WAIT_MS", 20)),
+    # Server-side voice activity detection: "off", "drop" silent chunks,
+    # or "thin" them to one in vad_thin_every
+    "vad_mode": os.getenv("VAD_MODE", "off"),
+    "vad_energy_threshold": float(os.getenv("VAD_ENERGY_THRESHOLD", 300.0)),
+    "vad_preroll_ms": int(os.getenv("VAD_PREROLL_MS", 300)),
+    "vad_hangover_ms": int(os.getenv("VAD_HANGOVER_MS", 1000)),
+    "vad_thin_every": int(os.getenv("VAD_THIN_EVERY", 10)),
+    # Barge-in: when the caller talks over the model, its queued audio is
+    # dropped and clients are told to flush playback. "server" reacts to
+    # Gemini's interruption signal; "vad" also to barge_in_min_speech_ms of
+    # continuous speech heard by the local detector (even with vad_mode off).
+    "barge_in": os.getenv("BARGE_IN", BARGE_IN_SERVER),
+    "barge_in_min_speech_ms": int(os.getenv("BARGE_IN_MIN_SPEECH_MS", 200)),
+    # Seconds without audio in either direction before the session is
+    # parked: Gemini stays connected, but buffers are released and nothing
+    # is sent upstream until the next audio frame. 0 (the default) disables.
+    "idle_suspend_s": float(os.getenv("IDLE_SUSPEND_SECONDS", 0.0)),
+}
+
 # Vercel compatibility check
 IN_VERCEL = 'VERCEL' in os.environ or 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
 
@@ -193,12 +346,17 @@ HOME_PAGE_TEMPLATE = """
     
     <div class="endpoint">
         <span class="method">POST</span> <code>{{ base_url }}/start_voice</code>
-        <p>Initiates a new voice session with the AI and returns WebSocket connection details.</p>
+        <p>Initiates a new voice session with the AI and returns WebSocket connection details. Each call creates an independent session; up to {{ max_sessions }} sessions can run concurrently. When the server keeps pre-warmed Gemini connections (<code>PREWARM_SESSIONS</code>), a new session takes one of them and skips the connection handshake. A session with no caller connected to <code>/audio-stream</code> for <code>ORPHAN_TIMEOUT</code> seconds (default 60) is ended, whether the caller never connected or its WebSocket dropped.</p>
+        <p>An optional JSON body <code>{"options": {...}}</code> tunes the session, e.g. <code>out_queue_size</code>/<code>in_queue_size</code> and <code>out_queue_policy</code>/<code>in_queue_policy</code> (<code>block</code>, <code>drop_oldest</code> or <code>coalesce</code>), and <code>upstream_frame_ms</code>/<code>upstream_max_wait_ms</code> to batch small microphone chunks into larger upstream frames at the cost of a bounded delay (<code>upstream_frame_ms: 0</code> disables batching). <code>vad_mode</code> (<code>off</code>, <code>drop</code> or <code>thin</code>) enables server-side voice activity detection so long silences are not streamed to the model.</p>
+        <p>When several server workers run behind a load balancer, use the returned <code>websocket.url</code> as is, or pass the <code>session_token</code> wherever a <code>session_id</code> is accepted. A request that reaches the wrong worker is redirected to the session's owner: HTTP endpoints answer <code>307</code>, and <code>/audio-stream</code> sends <code>{"type": "control", "command": "redirect", "url": "..."}</code> before closing.</p>
         <h3>Response:</h3>
         <pre>{
   "status": "started",
+  "session_id": "3f2b9c...",
+  "session_token": "dzEvM2YyYjlj....6a1f...",
+  "worker_id": "web-1",
   "websocket": {
-    "url": "wss://swatantra-ai.onrender.com/audio-stream",
+    "url": "wss://swatantra-ai.onrender.com/audio-stream?session_id=3f2b9c...&session_token=dzEvM2YyYjlj....6a1f...",
     "protocol": "audio-stream"
   }
 }</pre>
@@ -206,23 +364,43 @@ HOME_PAGE_TEMPLATE = """
     
     <div class="endpoint">
         <span class="method">POST</span> <code>{{ base_url }}/terminate_voice</code>
-        <p>Terminates an active voice session and cleans up all resources.</p>
+        <p>Terminates an active voice session and cleans up all resources. Pass the <code>session_id</code> returned by <code>/start_voice</code> in the JSON body.</p>
+        <h3>Response:</h3>
+        <pre>{
+  "status": "terminated",
+  "session_id": "3f2b9c..."
+}</pre>
+    </div>
+    
+    <div class="endpoint">
+        <span class="method">POST</span> <code>{{ base_url }}/pause_voice</code> and <code>{{ base_url }}/resume_voice</code>
+        <p>Parks a session without closing its Gemini connection, and wakes it again without a new handshake. While paused nothing is sent to Gemini, queued audio is released and connected clients get <code>{"type": "control", "command": "paused", "reason": "client"}</code>; audio they send is ignored until <code>/resume_voice</code>, after which they get <code>{"type": "control", "command": "resumed"}</code>. <code>/stop_voice</code> is an alias of <code>/pause_voice</code>. <code>/resume_voice</code> answers <code>"status": "running"</code> for a session that was not paused. Sessions with no audio in either direction for <code>idle_suspend_s</code> seconds (an <code>options</code> value; 0, the default, disables it) are paused the same way with <code>"reason": "idle"</code> and resume on their next audio frame.</p>
         <h3>Response:</h3>
         <pre>{
-  "status": "terminated"
+  "status": "paused",
+  "session_id": "3f2b9c..."
 }</pre>
     </div>
     
     <div class="endpoint">
         <span class="method">GET</span> <code>{{ base_url }}/status</code>
-        <p>Gets the current API status and version information.</p>
+        <p>Gets the current API status and version information, including queue depth and drop counters and the state of the pre-warmed connection pool and the upstream circuit breaker. Add <code>?session_id=...</code> for the details of a single session.</p>
         <h3>Response:</h3>
         <pre>{
   "status": "ok",
   "vercel": false,
-  "version": "1.0.0"
+  "version": "1.0.0",
+  "sessions": {
+    "active": 1,
+    "max": 5
+  }
 }</pre>
     </div>
+    
+    <div class="endpoint">
+        <span class="method">GET</span> <code>{{ base_url }}/metrics</code>
+        <p>Prometheus metrics for the serving process: active sessions, WebSocket clients, Gemini connect latency and time-to-first-audio histograms, audio bytes and chunks per direction, queue depths, and errors by stage and type. When running several workers, scrape each worker's own port.</p>
+    </div>
 
     <h2>Using the API</h2>
     <p>The typical workflow for using this API is:</p>
@@ -242,6 +420,27 @@ HOME_PAGE_TEMPLATE = """
         <li><strong>Encoding:</strong> Base64 for WebSocket transmission</li>
     </ul>
 
+    <h3>Binary Protocol</h3>
+    <p>Clients can avoid the base64/JSON overhead by connecting with <code>?protocol=binary</code> (or sending <code>{"type": "control", "command": "hello", "protocol": "binary"}</code>). Audio then travels as binary WebSocket frames with a 6-byte header followed by raw 16-bit PCM:</p>
+    <ul>
+        <li><strong>Byte 0:</strong> frame type (<code>1</code> = audio)</li>
+        <li><strong>Byte 1:</strong> flags (reserved, <code>0</code>)</li>
+        <li><strong>Bytes 2-5:</strong> sequence number, unsigned big-endian</li>
+    </ul>
+    <p>Control messages remain JSON text frames. The server confirms the protocol with a <code>hello</code> control message describing the output audio format.</p>
+
+    <h3>Output Framing</h3>
+    <p>By default JSON clients receive every chunk as a complete WAV file. With <code>?framing=stream</code> (the default for the binary protocol) chunks carry raw PCM instead: the server sends a <code>{"type": "control", "command": "format", ...}</code> message once at the start of each model turn and <code>{"type": "control", "command": "turn_complete"}</code> when it ends. Binary clients that need per-chunk WAV can ask for <code>framing=wav</code>.</p>
+    <p>When the caller talks over the model, the server drops the rest of the model's reply and sends <code>{"type": "control", "command": "flush", "turn": N, "reason": "server"}</code>: stop playback and discard any audio already buffered for that turn. By default this follows Gemini's own interruption signal; start the session with <code>"options": {"barge_in": "vad"}</code> to also react to the server's local speech detection, or <code>"off"</code> to disable it.</p>
+    <p>To save bandwidth, clients can also negotiate a compressed codec with <code>?codec=</code> or <code>"codec"</code> in the hello message. It is used in both directions and implies <code>framing=stream</code>: <code>mulaw</code> (G.711, half the size of PCM), <code>adpcm</code> (IMA ADPCM, a quarter; every chunk starts with a 4-byte header of predictor, step index and padding flag) and, where the server has libopus, <code>opus</code> (20 ms packets, each behind a 2-byte big-endian length). The hello reply lists the codecs available. JSON audio messages carry the codec in <code>format</code>, e.g. <code>audio/mulaw</code>.</p>
+    <p>Audio sent to the server may be at any rate from 8 to 192 kHz, in up to 8 interleaved channels, as 16-bit integers or 32-bit floats; the server downmixes and resamples it to 16 kHz mono 16-bit before it goes to Gemini. Describe it with mime type parameters, either per JSON message (<code>"format": "audio/pcm;rate=48000;channels=2;encoding=f32le"</code>) or once for the connection with <code>?input_format=</code> or <code>"input_format"</code> in the hello message (e.g. <code>rate=44100</code>), which also applies to binary frames.</p>
+
+    <h3>Listen-in Mode</h3>
+    <p>When the server is started with a <code>MONITOR_TOKEN</code>, an extra client can follow a session's replies by connecting to <code>/audio-stream?session_id=...&amp;mode=monitor&amp;token=...</code>. Monitors receive the same output as the caller but cannot send audio. Every client has its own bounded send buffer, so a slow connection only drops its own oldest audio, and a connection whose socket accepts nothing for <code>SEND_TIMEOUT</code> seconds is closed.</p>
+
+    <h3>Dropped Connections</h3>
+    <p>When the server runs with <code>SESSION_RESUME=1</code> and its connection to Gemini drops mid-conversation, your WebSocket stays open while the server reconnects in the background. Audio you send during the gap is buffered and delivered once the session is back. The conversation continues where it left off: the server uses Gemini's session resumption, or replays a transcript of the recent turns when resumption isn't possible. A model turn that was cut off ends with a normal <code>turn_complete</code>. Resumption turns on Gemini's input and output transcription for every session, so it is off by default; without it a dropped connection ends the session.</p>
+
     <h2>Code Examples</h2>
     
     <div class="tabs">
@@ -255,6 +454,7 @@ HOME_PAGE_TEMPLATE = """
         <pre>// API endpoint
 const API_URL = 'https://swatantra-ai.onrender.com';
 let websocket = null;
+let sessionId = null;
 
 // Step 1: Start a voice session
 async function startSession() {
@@ -262,6 +462,7 @@ async function startSession() {
     method: 'POST'
   });
   const data = await response.json();
+  sessionId = data.session_id;
   
   // Step 2: Connect to the WebSocket with the returned URL
   websocket = new WebSocket(data.websocket.url);
@@ -287,7 +488,9 @@ async function endSession() {
   if (websocket) websocket.close();
   
   await fetch(`${API_URL}/terminate_voice`, {
-    method: 'POST'
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ session_id: sessionId })
   });
   console.log('Session ended');
 }</pre>
@@ -312,7 +515,7 @@ def start_session():
     # Step 2: Connect to WebSocket
     ws = websocket.create_connection(ws_url)
     print("Connected to Dr. Swatantra AI")
-    return ws
+    return ws, data["session_id"]
 
 # Step 3: Send audio data
 def send_audio(ws, audio_data):
@@ -338,9 +541,9 @@ def receive_response(ws):
     return None
 
 # Step 5: End the session
-def end_session(ws):
+def end_session(ws, session_id):
     ws.close()
-    requests.post(f"{API_URL}/terminate_voice")
+    requests.post(f"{API_URL}/terminate_voice", json={"session_id": session_id})
     print("Session ended")</pre>
     </div>
     
@@ -353,7 +556,9 @@ curl -X GET https://swatantra-ai.onrender.com/status
 curl -X POST https://swatantra-ai.onrender.com/start_voice
 
 # Terminate a voice session
-curl -X POST https://swatantra-ai.onrender.com/terminate_voice</pre>
+curl -X POST https://swatantra-ai.onrender.com/terminate_voice \\
+     -H "Content-Type: application/json" \\
+     -d '{"session_id": "3f2b9c..."}'</pre>
         <p>Note: cURL can only be used for the HTTP endpoints, not for the WebSocket connections which require a WebSocket client.</p>
     </div>
     
@@ -364,13 +569,14 @@ curl -X POST https://swatantra-ai.onrender.com/terminate_voice</pre>
         <li><strong>400 Bad Request:</strong> Missing or invalid parameters</li>
         <li><strong>401 Unauthorized:</strong> Authentication failed or required</li>
         <li><strong>500 Internal Server Error:</strong> Server-side error</li>
+        <li><strong>503 Service Unavailable:</strong> The Gemini API is failing and new sessions are paused; retry after the <code>Retry-After</code> header</li>
     </ul>
 
     <h2>Rate Limits</h2>
     <p>The API has the following rate limits:</p>
     <ul>
         <li>Maximum of 30 requests per minute per client</li>
-        <li>Maximum of 5 concurrent voice sessions per API key</li>
+        <li>Maximum of {{ max_sessions }} concurrent voice sessions per server (HTTP 429 once reached)</li>
     </ul>
     
     <footer>
@@ -409,38 +615,415 @@ async def run_in_thread(func, *args, **kwargs):
     with concurrent.futures.ThreadPoolExecutor() as pool:
         return await loop.run_in_executor(pool, lambda: func(*args, **kwargs))
 
+# RIFF/WAVE header for 16-bit PCM: RIFF chunk, fmt chunk, data chunk
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
 def create_wav_header(data_length, sample_rate=24000, channels=1, sample_width=2):
     """Create a WAV header for raw audio data."""
-    # RIFF header
-    header = bytearray()
-    header.extend(b'RIFF')
-    header.extend((data_length + 36).to_bytes(4, 'little'))  # 36 + data_length
-    header.extend(b'WAVE')
-    
-    # fmt chunk
-    header.extend(b'fmt ')
-    header.extend((16).to_bytes(4, 'little'))  # Chunk size: 16 for PCM
-    header.extend((1).to_bytes(2, 'little'))   # Audio format: 1 for PCM
-    header.extend(channels.to_bytes(2, 'little'))  # Channels
-    header.extend(sample_rate.to_bytes(4, 'little'))  # Sample rate
-    
-    # Byte rate: SampleRate * NumChannels * BitsPerSample/8
-    byte_rate = sample_rate * channels * sample_width
-    header.extend(byte_rate.to_bytes(4, 'little'))
-    
-    # Block align: NumChannels * BitsPerSample/8
-    block_align = channels * sample_width
-    header.extend(block_align.to_bytes(2, 'little'))
-    
-    # Bits per sample
-    bits_per_sample = sample_width * 8
-    header.extend(bits_per_sample.to_bytes(2, 'little'))
-    
-    # Data chunk
-    header.extend(b'data')
-    header.extend(data_length.to_bytes(4, 'little'))
-    
-    return header
+    return WAV_HEADER.pack(
+        b'RIFF', data_length + 36, b'WAVE',
+        b'fmt ', 16, 1,  # fmt chunk size and audio format (1 = PCM)
+        channels, sample_rate,
+        sample_rate * channels * sample_width,  # byte rate
+        channels * sample_width,  # block align
+        sample_width * 8,  # bits per sample
+        b'data', data_length
+    )
+
+
+class WavHeaderTemplate:
+    """
+    WAV headers for one audio format, built once per chunk length.
+
+    Model audio arrives in a handful of chunk sizes, so nearly every chunk
+    gets an already-built header from the cache. The cache holds at most
+    ``max_cached`` lengths; others are built on each call.
+    """
+
+    max_cached = 64
+
+    def __init__(self, sample_rate=RECEIVE_SAMPLE_RATE, channels=1, sample_width=2):
+        self._format = (sample_rate, channels, sample_width)
+        self._headers: Dict[int, bytes] = {}
+
+    def header(self, data_length: int) -> bytes:
+        header = self._headers.get(data_length)
+        if header is None:
+            header = create_wav_header(data_length, *self._format)
+            if len(self._headers) < self.max_cached:
+                self._headers[data_length] = header
+        return header
+
+
+# ==== WebSocket Wire Protocol ====
+
+# Clients pick a protocol with ``?protocol=`` on /audio-stream or a
+# ``{"type": "control", "command": "hello", "protocol": ...}`` message.
+# "json" is the original format: base64 audio inside JSON text frames.
+# "binary" sends audio as binary frames behind a fixed 6-byte header:
+#   byte 0     frame type (FRAME_TYPE_*)
+#   byte 1     flags, reserved (0)
+#   bytes 2-5  sequence number, unsigned big-endian
+# Control messages stay JSON text frames in both protocols.
+#
+# Independently, ``?framing=`` (or ``"framing"`` in hello) picks how audio
+# chunks are framed. "wav" wraps every chunk in its own WAV header, as the
+# original JSON protocol did. "stream" sends raw PCM and announces the
+# format with a ``format`` control message once per model turn, followed
+# by ``turn_complete`` when the turn ends.
+PROTOCOL_JSON = "json"
+PROTOCOL_BINARY = "binary"
+PROTOCOLS = (PROTOCOL_JSON, PROTOCOL_BINARY)
+
+# ``?mode=monitor`` attaches a listen-in client that receives the session's
+# output but cannot send audio. It needs ``token=<MONITOR_TOKEN>``.
+ROLE_CALLER = "caller"
+ROLE_MONITOR = "monitor"
+
+FRAMING_WAV = "wav"
+FRAMING_STREAM = "stream"
+FRAMINGS = (FRAMING_WAV, FRAMING_STREAM)
+DEFAULT_FRAMING = {PROTOCOL_JSON: FRAMING_WAV, PROTOCOL_BINARY: FRAMING_STREAM}
+
+OUTPUT_AUDIO_FORMAT = {
+    "format": "audio/pcm",
+    "sample_rate": RECEIVE_SAMPLE_RATE,
+    "channels": CHANNELS,
+    "sample_width": 2,
+}
+
+
+
+FRAME_HEADER = struct.Struct("!BBI")
+FRAME_TYPE_AUDIO = 0x01
+
+
+def pack_frame(frame_type: int, seq: int, *payloads: bytes, flags: int = 0) -> bytes:
+    """
+    Prefix one or more payload buffers with the binary frame header.
+
+    The pieces are gathered with a single join, so each payload is copied
+    exactly once into the outgoing frame.
+    """
+    return b"".join((FRAME_HEADER.pack(frame_type, flags, seq & 0xFFFFFFFF), *payloads))
+
+
+def parse_frame(frame: bytes):
+    """Split a binary frame into (frame_type, flags, seq, payload view)."""
+    if len(frame) < FRAME_HEADER.size:
+        raise ValueError(f"Binary frame shorter than the {FRAME_HEADER.size}-byte header")
+    frame_type, flags, seq = FRAME_HEADER.unpack_from(frame)
+    return frame_type, flags, seq, memoryview(frame)[FRAME_HEADER.size:]
+
+
+# ==== Audio Codecs ====
+
+# Clients may also pick a codec with ``?codec=`` or ``"codec"`` in hello.
+# It applies in both directions; Gemini itself always gets and sends PCM,
+# so AudioLoop decodes inbound chunks on ingest and encodes model audio
+# once per codec in play_audio. Any codec other than "pcm" implies the
+# "stream" framing.
+#   "pcm"   16-bit little-endian PCM (the default)
+#   "mulaw" G.711 mu-law, 8 bits per sample
+#   "adpcm" IMA ADPCM, 4 bits per sample, low nibble first. Each chunk
+#           starts with a 4-byte header (predictor int16 LE, step index,
+#           1 if the last nibble is padding) so it decodes on its own.
+#   "opus"  Opus in 20 ms packets, when opuslib is installed. A chunk
+#           holds one or more packets, each behind a 2-byte big-endian
+#           length.
+# Inbound JSON audio may name its codec in "format" (e.g. "audio/mulaw").
+CODEC_PCM = "pcm"
+CODEC_MULAW = "mulaw"
+CODEC_ADPCM = "adpcm"
+CODEC_OPUS = "opus"
+CODEC_MIME_TYPES = {
+    CODEC_PCM: "audio/pcm",
+    CODEC_MULAW: "audio/mulaw",
+    CODEC_ADPCM: "audio/adpcm",
+    CODEC_OPUS: "audio/opus",
+}
+CODECS = tuple(codec for codec in CODEC_MIME_TYPES if codec != CODEC_OPUS or OPUS_AVAILABLE)
+MIME_CODECS = {mime: codec for codec, mime in CODEC_MIME_TYPES.items()}
+MIME_CODECS["audio/x-mulaw"] = CODEC_MULAW
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 8159
+ADPCM_HEADER = struct.Struct("<hBB")
+ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+ADPCM_INDEX_STEPS = (-1, -1, -1, -1, 2, 4, 6, 8)
+OPUS_FRAME_MS = 20
+OPUS_LENGTH = struct.Struct("!H")
+
+
+def codec_for_mime_type(mime_type) -> Optional[str]:
+    """The codec named by a mime type such as ``audio/mulaw;rate=16000``, or None if unknown."""
+    return MIME_CODECS.get(str(mime_type).split(";", 1)[0].strip().lower())
+
+
+def _pcm_samples(pcm: bytes) -> array.array:
+    samples = array.array("h")
+    samples.frombytes(pcm[:len(pcm) & ~1])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def _mulaw_encode_sample(sample: int) -> int:
+    # The G.711 reference works on 14-bit samples
+    sample >>= 2
+    mask = 0x7F if sample < 0 else 0xFF
+    sample = min(abs(sample), MULAW_CLIP) + (MULAW_BIAS >> 2)
+    exponent = sample.bit_length() - 6
+    if exponent > 7:
+        return 0x7F ^ mask
+    exponent = max(0, exponent)
+    return ((exponent << 4) | ((sample >> (exponent + 1)) & 0x0F)) ^ mask
+
+
+def _mulaw_decode_sample(byte: int) -> int:
+    byte = ~byte & 0xFF
+    sample = (((byte & 0x0F) << 3) + MULAW_BIAS) << ((byte >> 4) & 0x07)
+    return MULAW_BIAS - sample if byte & 0x80 else sample - MULAW_BIAS
+
+
+_mulaw_tables = None
+
+
+def mulaw_tables():
+    """(encode, decode) lookup tables, built on first use."""
+    global _mulaw_tables
+    if _mulaw_tables is None:
+        # Indexed by the sample as an unsigned 16-bit value
+        encode = bytes(_mulaw_encode_sample(i - 65536 if i >= 32768 else i) for i in range(65536))
+        decode = array.array("h", (_mulaw_decode_sample(byte) for byte in range(256)))
+        if NUMPY_AVAILABLE:
+            _mulaw_tables = (np.frombuffer(encode, dtype=np.uint8), np.array(decode, dtype="<i2"))
+        else:
+            if sys.byteorder == "big":
+                decode.byteswap()
+            _mulaw_tables = (encode, [decode[i:i + 1].tobytes() for i in range(256)])
+    return _mulaw_tables
+
+
+def mulaw_encode(pcm: bytes) -> bytes:
+    encode, _ = mulaw_tables()
+    if NUMPY_AVAILABLE:
+        return encode[np.frombuffer(pcm, dtype="<u2", count=len(pcm) // 2)].tobytes()
+    samples = array.array("H", _pcm_samples(pcm).tobytes())
+    return bytes(map(encode.__getitem__, samples))
+
+
+def mulaw_decode(data: bytes) -> bytes:
+    _, decode = mulaw_tables()
+    if NUMPY_AVAILABLE:
+        return decode[np.frombuffer(data, dtype=np.uint8)].tobytes()
+    return b"".join(map(decode.__getitem__, data))
+
+
+def adpcm_decode(data: bytes) -> bytes:
+    """Decode one self-contained IMA ADPCM chunk (header plus nibbles) to PCM."""
+    if len(data) < ADPCM_HEADER.size:
+        raise ValueError("ADPCM chunk shorter than its header")
+    predictor, index, padded = ADPCM_HEADER.unpack_from(data)
+    index = min(index, 88)
+    steps, index_steps = ADPCM_STEPS, ADPCM_INDEX_STEPS
+    samples = array.array("h")
+    append = samples.append
+    for byte in memoryview(data)[ADPCM_HEADER.size:]:
+        for nibble in (byte & 0x0F, byte >> 4):
+            step = steps[index]
+            delta = step >> 3
+            if nibble & 4:
+                delta += step
+            if nibble & 2:
+                delta += step >> 1
+            if nibble & 1:
+                delta += step >> 2
+            if nibble & 8:
+                predictor -= delta
+                if predictor < -32768:
+                    predictor = -32768
+            else:
+                predictor += delta
+                if predictor > 32767:
+                    predictor = 32767
+            index += index_steps[nibble & 7]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            append(predictor)
+    if padded and samples:
+        samples.pop()
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+class PcmCodec:
+    """
+    Passthrough codec, and the interface of the others.
+
+    One instance per session and codec holds the streaming state:
+    ``encode`` is fed model audio in order and ``flush`` is called at the
+    end of each model turn; ``decode`` is fed the caller's chunks.
+    """
+
+    name = CODEC_PCM
+
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def flush(self) -> bytes:
+        return b""
+
+    def reset(self):
+        """Forget encoder input held back from a turn that was cut off."""
+
+    def decode(self, data: bytes) -> bytes:
+        return data
+
+
+class MulawCodec(PcmCodec):
+    name = CODEC_MULAW
+
+    def encode(self, pcm: bytes) -> bytes:
+        return mulaw_encode(pcm)
+
+    def decode(self, data: bytes) -> bytes:
+        return mulaw_decode(data)
+
+
+class AdpcmCodec(PcmCodec):
+    """IMA ADPCM; the encoder's predictor and step index carry over between chunks."""
+
+    name = CODEC_ADPCM
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, pcm: bytes) -> bytes:
+        samples = _pcm_samples(pcm)
+        predictor, index = self.predictor, self.index
+        steps, index_steps = ADPCM_STEPS, ADPCM_INDEX_STEPS
+        header = ADPCM_HEADER.pack(predictor, index, len(samples) & 1)
+        out = bytearray((len(samples) + 1) // 2)
+        for i, sample in enumerate(samples):
+            step = steps[index]
+            diff = sample - predictor
+            nibble = 0
+            if diff < 0:
+                nibble = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                nibble |= 4
+                diff -= step
+                delta += step
+            if diff >= step >> 1:
+                nibble |= 2
+                diff -= step >> 1
+                delta += step >> 1
+            if diff >= step >> 2:
+                nibble |= 1
+                delta += step >> 2
+            if nibble & 8:
+                predictor -= delta
+                if predictor < -32768:
+                    predictor = -32768
+            else:
+                predictor += delta
+                if predictor > 32767:
+                    predictor = 32767
+            index += index_steps[nibble & 7]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            out[i >> 1] |= nibble << 4 if i & 1 else nibble
+        self.predictor, self.index = predictor, index
+        return header + out
+
+    def decode(self, data: bytes) -> bytes:
+        return adpcm_decode(data)
+
+
+class OpusCodec(PcmCodec):
+    """
+    Opus via opuslib. Model audio is cut into 20 ms frames; a partial frame
+    waits for the next chunk and is padded with silence by ``flush``.
+    """
+
+    name = CODEC_OPUS
+
+    def __init__(self, encode_rate: int = RECEIVE_SAMPLE_RATE, decode_rate: int = SEND_SAMPLE_RATE):
+        self._encoder = opuslib.Encoder(encode_rate, CHANNELS, opuslib.APPLICATION_VOIP)
+        self._decoder = opuslib.Decoder(decode_rate, CHANNELS)
+        self._frame_samples = encode_rate * OPUS_FRAME_MS // 1000
+        self._frame_bytes = self._frame_samples * 2 * CHANNELS
+        self._max_decode_samples = decode_rate * 120 // 1000  # longest Opus packet
+        self._pending = bytearray()
+
+    def _packets(self, final: bool) -> bytes:
+        if final and self._pending:
+            self._pending.extend(bytes(-len(self._pending) % self._frame_bytes))
+        out = []
+        while len(self._pending) >= self._frame_bytes:
+            packet = self._encoder.encode(bytes(self._pending[:self._frame_bytes]), self._frame_samples)
+            del self._pending[:self._frame_bytes]
+            out.append(OPUS_LENGTH.pack(len(packet)))
+            out.append(packet)
+        return b"".join(out)
+
+    def encode(self, pcm: bytes) -> bytes:
+        self._pending.extend(pcm)
+        return self._packets(final=False)
+
+    def flush(self) -> bytes:
+        return self._packets(final=True)
+
+    def reset(self):
+        self._pending.clear()
+
+    def decode(self, data: bytes) -> bytes:
+        view = memoryview(data)
+        out = []
+        while view:
+            if len(view) < OPUS_LENGTH.size:
+                raise ValueError("Truncated Opus packet length")
+            (length,) = OPUS_LENGTH.unpack_from(view)
+            packet = view[OPUS_LENGTH.size:OPUS_LENGTH.size + length]
+            if len(packet) < length:
+                raise ValueError("Truncated Opus packet")
+            out.append(self._decoder.decode(bytes(packet), self._max_decode_samples))
+            view = view[OPUS_LENGTH.size + length:]
+        return b"".join(out)
+
+
+CODEC_CLASSES = {codec.name: codec for codec in (PcmCodec, MulawCodec, AdpcmCodec, OpusCodec)}
+
+
+def create_codec(name: str) -> PcmCodec:
+    """A fresh codec instance with its own streaming state."""
+    if name not in CODECS:
+        raise ValueError(f"codec must be one of {', '.join(CODECS)}")
+    return CODEC_CLASSES[name]()
+
+
+def output_audio_format(codec: str = CODEC_PCM) -> Dict[str, Any]:
+    """OUTPUT_AUDIO_FORMAT as seen by a client that negotiated ``codec``."""
+    if codec == CODEC_PCM:
+        return OUTPUT_AUDIO_FORMAT
+    return dict(OUTPUT_AUDIO_FORMAT, format=CODEC_MIME_TYPES[codec], codec=codec)
 
 
 # ==== Gemini Configuration ====
@@ -462,6 +1045,12 @@ def get_live_connect_config(voice_name="Puck"):
                 role="user"
             ),
         )
+        if SESSION_RESUME:
+            # Resumption handles let a dropped session continue server-side;
+            # transcripts give us a history to replay when no handle is usable
+            live_connect_config.session_resumption = types.SessionResumptionConfig()
+            live_connect_config.input_audio_transcription = types.AudioTranscriptionConfig()
+            live_connect_config.output_audio_transcription = types.AudioTranscriptionConfig()
     else:
         # Fallback to dictionary structure if types not available
         live_connect_config = {
@@ -476,12 +1065,18 @@ def get_live_connect_config(voice_name="Puck"):
                 "role": "user"
             }
         }
+        if SESSION_RESUME:
+            live_connect_config.update({
+                "session_resumption": {},
+                "input_audio_transcription": {},
+                "output_audio_transcription": {},
+            })
 
     # Return a complete config compatible with our processor.py
     return {
         "model": MODEL,
         "live_connect_config": live_connect_config,
-        "history": [],
+        "history": [],  # prior turns as {"role": "user"|"model", "text": ...}, replayed on connect
         "generation_config": {
             "temperature": 0.7,
             "top_p": 0.95,
@@ -509,283 +1104,3094 @@ def get_live_connect_config(voice_name="Puck"):
     }
 
 
-# ==== Audio Processing Class ====
+upstream_circuit = CircuitBreaker(
+    "gemini-live",
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT,
+)
 
-class AudioLoop:
+
+# ==== Session Options and Queues ====
+
+def resolve_session_options(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Handles real-time audio streaming with the Gemini API.
-    
-    This class manages sending audio data to the Gemini API and 
-    receiving responses, handling the two-way communication.
+    Merge per-session overrides into SESSION_DEFAULTS.
+
+    Unknown keys and values that cannot be converted to the default's type
+    raise ValueError, so a bad request fails before a session is created.
     """
-    
-    def __init__(self, client):
-        """Initialize the AudioLoop with a Gemini client."""
-        self.client = client
-        self.session = None
-        self.is_running = False
-        self.audio_in_queue = asyncio.Queue()
-        self.out_queue = asyncio.Queue()
-        self._processing_task = None
-        
-        # Check if we're running in a serverless environment
-        self.is_serverless = os.environ.get('VERCEL') == '1'
+    options = dict(SESSION_DEFAULTS)
+    for key, value in (overrides or {}).items():
+        if key not in SESSION_DEFAULTS:
+            raise ValueError(f"Unknown session option: {key}")
+        try:
+            options[key] = type(SESSION_DEFAULTS[key])(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for session option {key}: {value!r}")
 
-    async def connect_with_retry(self, config: Dict[str, Any], max_retries: int = 3) -> bool:
-        """Attempt to connect to the Gemini API with retries."""
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                logger.info(f"Connecting to Gemini API (attempt {retry_count + 1})")
-                
-                # Use the live.connect approach
-                self._session_ctx = self.client.aio.live.connect(
-                    model=config["model"],
-                    config=config["live_connect_config"]
-                )
-                
-                # Enter the context
-                self.session = await self._session_ctx.__aenter__()
-                self.is_running = True
-                
-                logger.info("Successfully connected to Gemini API")
-                return True
-                
-            except Exception as e:
-                logger.error(f"Connection attempt {retry_count + 1} failed: {str(e)}")
-                retry_count += 1
-                await asyncio.sleep(1)  # Wait before retrying
-        
-        logger.error("Failed to connect to Gemini API after maximum retries")
-        return False
-    
-    async def stop(self):
-        """Stop all audio processing and close connections."""
-        logger.info("Stopping audio processing")
-        self.is_running = False
-        
-        # Give tasks time to notice the running flag change
-        await asyncio.sleep(0.5)
-        
-        if hasattr(self, '_session_ctx') and self._session_ctx and self.session:
-            try:
-                logger.info("Closing Gemini API session")
-                # Use the context manager exit method to properly close the session
-                await self._session_ctx.__aexit__(None, None, None)
-                logger.info("Gemini API session closed successfully")
-            except Exception as e:
-                logger.error(f"Error closing session: {str(e)}")
-            finally:
-                self.session = None
-                self._session_ctx = None
+    for key in ("out_queue_policy", "in_queue_policy"):
+        if options[key] not in QUEUE_POLICIES:
+            raise ValueError(f"{key} must be one of {', '.join(QUEUE_POLICIES)}")
+    if options["vad_mode"] not in VAD_MODES:
+        raise ValueError(f"vad_mode must be one of {', '.join(VAD_MODES)}")
+    if options["barge_in"] not in BARGE_IN_MODES:
+        raise ValueError(f"barge_in must be one of {', '.join(BARGE_IN_MODES)}")
+    return options
 
-        self._clear_queues()
-        logger.info("Audio processing stopped completely")
 
-    def _clear_queues(self):
-        """Clear any pending items from queues."""
-        for queue in [self.audio_in_queue, self.out_queue]:
-            if queue:
-                while not queue.empty():
-                    try:
-                        queue.get_nowait()
-                    except:
-                        pass
+def _is_audio_item(item) -> bool:
+    return isinstance(item, (bytes, bytearray, dict))
 
-    async def send_realtime(self):
-        """Send audio data from the out_queue to the Gemini API in real-time."""
-        try:
-            if not self.session or not self.is_running:
-                raise ValueError("Session not initialized or not running")
-            
-            while self.is_running:
-                if not self.out_queue.empty():
-                    content = await self.out_queue.get()
-                    
-                    if content:
-                        # Send the audio content to the Gemini API using the proper method
-                        await self.session.send(input=content)
-                
-                await asyncio.sleep(0.01)  # Small sleep to prevent CPU hogging
-                
-        except Exception as e:
-            logger.error(f"Error in send_realtime: {str(e)}")
-            self.is_running = False
 
-    async def receive_audio(self):
-        """Receive audio responses from the Gemini API and put them in the audio_in_queue."""
-        try:
-            if not self.session or not self.is_running:
-                raise ValueError("Session not initialized or not running")
-            
-            # Continuously receive responses while the loop is running
-            while self.is_running:
-                try:
-                    # Use the turn-based approach
-                    turn = self.session.receive()
-                    async for response in turn:
-                        if data := response.data:
-                            await self.audio_in_queue.put(data)
-                except asyncio.CancelledError:
-                    logger.info("Receive audio operation cancelled")
-                    break
-                except Exception as e:
-                    logger.error(f"Error receiving audio response: {str(e)}")
-                    if "timeout" in str(e).lower():
-                        await asyncio.sleep(1)  # Brief pause before retry
-                        continue
-                    break
-                
-                await asyncio.sleep(0.01)  # Small sleep to prevent CPU hogging
-                
-        except Exception as e:
-            logger.error(f"Error in receive_audio: {str(e)}")
-            self.is_running = False
+def _mergeable(item) -> bool:
+    """Whether a queue item is a PCM chunk that can be concatenated with another of its format."""
+    return (isinstance(item, dict) and str(item.get("mime_type", "")).startswith("audio/pcm")
+            and isinstance(item.get("data"), bytes))
 
-    async def listen_audio(self):
-        """Process audio input from WebSocket clients."""
-        # In serverless mode, we just keep the task alive
-        if self.is_serverless:
-            logger.info("Audio capture handled via WebSocket connections")
-            while self.is_running:
-                await asyncio.sleep(0.5)  # Keep the task alive
-            return
-            
-        try:
-            # Keep the method running while the audio loop is active
-            while self.is_running:
-                # Audio data is passed to self.out_queue by the WebSocket handler
-                await asyncio.sleep(0.5)  # Just sleep to keep the task alive
-                
-        except asyncio.CancelledError:
-            logger.info("Listen audio task cancelled")
-        except Exception as e:
-            logger.error(f"Error in listen_audio: {str(e)}")
 
-    async def play_audio(self):
-        """Stream audio responses to connected WebSocket clients."""
-        try:
-            logger.info("Starting audio playback via WebSockets")
-            
-            # Get access to active WebSocket clients from the global variable
-            global ws_clients
-            
-            while self.is_running:
-                if not self.audio_in_queue.empty():
-                    audio_data = await self.audio_in_queue.get()
-                    
-                    if audio_data and ws_clients:
-                        try:
-                            # Add WAV header to the raw audio data
-                            sample_rate = RECEIVE_SAMPLE_RATE
-                            channels = 1  # Mono
-                            sample_width = 2  # 16-bit audio
-                            
-                            # Create WAV header
-                            wav_header = create_wav_header(
-                                len(audio_data), 
-                                sample_rate=sample_rate,
-                                channels=channels, 
-                                sample_width=sample_width
-                            )
-                            
-                            # Combine header with audio data
-                            wav_data = wav_header + audio_data
-                            
-                            # Send the audio data to all connected clients
-                            encoded_audio = base64.b64encode(wav_data).decode('utf-8');
-                            message = json.dumps({
-                                "type": "audio",
-                                "format": "audio/wav",
-                                "data": encoded_audio
-                            })
-                            
-                            # Send to all connected clients
-                            for ws in list(ws_clients):
-                                try:
-                                    ws.send(message)
-                                except Exception as e:
-                                    logger.error(f"Error sending audio to client: {str(e)}")
-                        
-                        except Exception as e:
-                            logger.error(f"Error preparing audio data: {str(e)}")
-                
-                await asyncio.sleep(0.01)  # Small sleep to prevent CPU hogging
-                
-        except Exception as e:
-            logger.error(f"Error in play_audio: {str(e)}")
-            logger.error(traceback.format_exc())
+def _merge_audio_items(last, item):
+    """Concatenate two adjacent PCM queue items, or return None if they can't be merged."""
+    if isinstance(last, (bytes, bytearray)) and isinstance(item, (bytes, bytearray)):
+        return last + item
+    if _mergeable(last) and _mergeable(item) and last["mime_type"] == item["mime_type"]:
+        return dict(last, data=last["data"] + item["data"])
+    return None
 
-    async def run(self, config):
-        """Start the main audio processing loop."""
-        try:
-            await self.connect_with_retry(config)
-            if not self.session:
-                raise Exception("Failed to establish session")
 
-            # Create tasks
-            tasks = [
-                asyncio.create_task(self.send_realtime()),
-                asyncio.create_task(self.listen_audio()),
-                asyncio.create_task(self.receive_audio()),
+def pcm_bytes_per_ms(mime_type: str) -> float:
+    """Bytes per millisecond of 16-bit mono PCM, honouring a ``rate=`` parameter."""
+    rate = SEND_SAMPLE_RATE
+    for param in str(mime_type).split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key == "rate" and value.isdigit():
+            rate = int(value)
+    return rate * 2 / 1000
+
+
+def _item_size(item) -> int:
+    if isinstance(item, dict):
+        item = item.get("data") or b""
+    return len(item) if isinstance(item, (bytes, bytearray)) else 0
+
+
+class AudioQueue(asyncio.Queue):
+    """
+    An asyncio.Queue with a policy for what happens when it is full.
+
+    - ``block``: producers wait (plain asyncio.Queue behaviour)
+    - ``drop_oldest``: the oldest audio item is discarded to make room
+    - ``coalesce``: the new PCM chunk is appended to the newest queued one,
+      up to ``coalesce_max_bytes``; past that the oldest item is dropped
+
+    Depth, high-water mark and drop/coalesce counters are kept for tuning.
+    """
+
+    def __init__(self, maxsize: int = 0, policy: str = QUEUE_POLICY_BLOCK,
+                 coalesce_max_bytes: int = 64 * 1024):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    async def put(self, item):
+        if self.policy == QUEUE_POLICY_BLOCK:
+            await super().put(item)
+        else:
+            self.put_nowait(item)
+
+    def put_nowait(self, item):
+        if self.full() and self.policy != QUEUE_POLICY_BLOCK:
+            if self.policy == QUEUE_POLICY_COALESCE and self._coalesce(item):
+                return
+            self._drop_oldest()
+        super().put_nowait(item)
+        self.high_water = max(self.high_water, self.qsize())
+
+    def _coalesce(self, item) -> bool:
+        if not self._queue:
+            return False
+        last = self._queue[-1]
+        if _item_size(last) + _item_size(item) > self.coalesce_max_bytes:
+            return False
+        merged = _merge_audio_items(last, item)
+        if merged is None:
+            return False
+        self._queue[-1] = merged
+        self.coalesced += 1
+        return True
+
+    def _drop_oldest(self):
+        # Prefer discarding audio over markers such as TURN_COMPLETE
+        for i, queued in enumerate(self._queue):
+            if _is_audio_item(queued):
+                del self._queue[i]
+                break
+        else:
+            self._queue.popleft()
+        self._unfinished_tasks -= 1
+        self.dropped += 1
+
+    def clear(self):
+        """Discard everything queued, waking any blocked producers."""
+        while not self.empty():
+            self.get_nowait()
+            self.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "high_water": self.high_water,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+# ==== Voice Activity Detection ====
+
+VAD_OFF = "off"
+VAD_DROP = "drop"
+VAD_THIN = "thin"
+VAD_MODES = (VAD_OFF, VAD_DROP, VAD_THIN)
+
+
+def pcm_energy_and_zcr(data: bytes):
+    """Return (RMS energy, zero-crossing rate) of a 16-bit little-endian PCM chunk."""
+    count = len(data) // 2
+    if count == 0:
+        return 0.0, 0.0
+
+    if NUMPY_AVAILABLE:
+        # Zero-copy int16 view over the chunk
+        samples = np.frombuffer(data, dtype="<i2", count=count)
+        rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float32))))
+        crossings = int(np.count_nonzero(np.diff(np.signbit(samples))))
+    else:
+        samples = array.array("h")
+        samples.frombytes(bytes(data[:count * 2]))
+        if sys.byteorder == "big":
+            samples.byteswap()
+        rms = math.sqrt(sum(s * s for s in samples) / count)
+        crossings = sum(1 for a, b in zip(samples, samples[1:]) if (a < 0) != (b < 0))
+
+    return rms, crossings / count
+
+
+class VoiceActivityDetector:
+    """
+    Drops (or thins out) silent PCM chunks before they are sent upstream.
+
+    A chunk counts as speech when its RMS energy clears the threshold and
+    its zero-crossing rate is below ``zcr_max`` (broadband hiss crosses
+    zero far more often than voiced speech). The threshold adapts to the
+    caller's noise floor.
+
+    - The last ``preroll_ms`` of silence is kept and sent ahead of the
+      first speech chunk, so onsets aren't clipped.
+    - ``hangover_ms`` of audio after speech is always forwarded, so Gemini
+      still hears the pause that ends a turn.
+    - In ``thin`` mode, one of every ``thin_every`` silent chunks is still
+      sent; ``drop`` mode sends none.
+
+    With ``track_speech`` chunks are classified even in ``off`` mode, so
+    ``speech_ms`` (the length of the current run of speech) is available
+    for barge-in and ``last_speech_at`` for latency traces; nothing is
+    dropped.
+    """
+
+    def __init__(self, mode: str = VAD_DROP, energy_threshold: float = 300.0,
+                 zcr_max: float = 0.35, preroll_ms: int = 300, hangover_ms: int = 1000,
+                 thin_every: int = 10, track_speech: bool = False):
+        if mode not in VAD_MODES:
+            raise ValueError(f"vad_mode must be one of {', '.join(VAD_MODES)}")
+        self.mode = mode
+        self.energy_threshold = energy_threshold
+        self.zcr_max = zcr_max
+        self.preroll_ms = preroll_ms
+        self.hangover_ms = hangover_ms
+        self.thin_every = max(1, thin_every)
+        self.track_speech = track_speech
+        self.noise_floor = 0.0
+        self.in_speech = False
+        self._since_speech_ms = float("inf")
+        self._preroll = collections.deque()
+        self._preroll_ms = 0.0
+        self._silent_run = 0
+        self.chunks_in = 0
+        self.chunks_out = 0
+        self.last_speech_at: Optional[float] = None
+        self.speech_started_at: Optional[float] = None
+        self.speech_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != VAD_OFF
+
+    def is_speech(self, data: bytes) -> bool:
+        rms, zcr = pcm_energy_and_zcr(data)
+        threshold = max(self.energy_threshold, self.noise_floor * 3)
+        speech = rms >= threshold and zcr <= self.zcr_max
+        if not speech:
+            # Track the background level from non-speech chunks only
+            self.noise_floor = rms if self.noise_floor == 0 else 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+    def process(self, item: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Return the queue items to forward for one inbound chunk."""
+        data = item.get("data")
+        if (not (self.enabled or self.track_speech) or not isinstance(data, (bytes, bytearray))
+                or not str(item.get("mime_type", "")).startswith("audio/pcm")):
+            return [item]
+
+        self.chunks_in += 1
+        duration_ms = len(data) / pcm_bytes_per_ms(item.get("mime_type"))
+        speech = self.is_speech(data)
+        if not speech:
+            self.speech_ms = 0.0
+        elif not self.in_speech:
+            self.speech_started_at = time.perf_counter()
+            self.speech_ms = duration_ms
+        else:
+            self.speech_ms += duration_ms
+
+        if not self.enabled:
+            # Only classifying, for barge-in
+            self.in_speech = speech
+            if speech:
+                self.last_speech_at = time.perf_counter()
+            self.chunks_out += 1
+            return [item]
+
+        if speech:
+            forwarded = list(self._preroll) + [item]
+            self._preroll.clear()
+            self._preroll_ms = 0.0
+            self.in_speech = True
+            self.last_speech_at = time.perf_counter()
+            self._since_speech_ms = 0.0
+            self._silent_run = 0
+        else:
+            self.in_speech = False
+            self._since_speech_ms += duration_ms
+            self._silent_run += 1
+            if self._since_speech_ms <= self.hangover_ms:
+                forwarded = [item]
+            elif self.mode == VAD_THIN and self._silent_run % self.thin_every == 0:
+                forwarded = [item]
+            else:
+                self._buffer_preroll(item, duration_ms)
+                forwarded = []
+
+        self.chunks_out += len(forwarded)
+        return forwarded
+
+    def clear(self):
+        """Forget buffered preroll and the current run of speech, e.g. when the session is paused."""
+        self._preroll.clear()
+        self._preroll_ms = 0.0
+        self.in_speech = False
+        self.speech_ms = 0.0
+
+    def _buffer_preroll(self, item: Dict[str, Any], duration_ms: float):
+        self._preroll.append(item)
+        self._preroll_ms += duration_ms
+        while len(self._preroll) > 1 and self._preroll_ms > self.preroll_ms:
+            dropped = self._preroll.popleft()
+            self._preroll_ms -= len(dropped["data"]) / pcm_bytes_per_ms(dropped.get("mime_type"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "chunks_in": self.chunks_in,
+            "chunks_out": self.chunks_out,
+            "noise_floor": round(self.noise_floor, 1),
+        }
+
+
+# ==== Input Normalization ====
+
+# Gemini wants 16 kHz mono 16-bit PCM. Clients that capture something
+# else describe it with mime type parameters, e.g.
+# "audio/pcm;rate=48000;channels=2;encoding=f32le", and each session's
+# InputNormalizer converts their audio before the VAD sees it: channels
+# are averaged, float samples scaled to int16 and the rate changed with a
+# polyphase FIR filter whose history carries over between chunks.
+# Without NumPy only downmixing and sample conversion are done and the
+# rate is passed on in the mime type for Gemini to resample.
+INPUT_ENCODING_S16 = "s16le"
+INPUT_ENCODING_F32 = "f32le"
+INPUT_ENCODINGS = {
+    "s16le": INPUT_ENCODING_S16, "s16": INPUT_ENCODING_S16, "int16": INPUT_ENCODING_S16,
+    "f32le": INPUT_ENCODING_F32, "f32": INPUT_ENCODING_F32, "float32": INPUT_ENCODING_F32,
+}
+INPUT_SAMPLE_BYTES = {INPUT_ENCODING_S16: 2, INPUT_ENCODING_F32: 4}
+INPUT_MIN_RATE = 8000
+INPUT_MAX_RATE = 192000
+INPUT_MAX_CHANNELS = 8
+# Filter length (taps per side, per unit of the larger resampling factor)
+# and Kaiser window shape, as in scipy.signal.resample_poly
+RESAMPLE_HALF_TAPS = 10
+RESAMPLE_KAISER_BETA = 5.0
+
+_pcm_formats: Dict[str, tuple] = {}
+
+
+def parse_pcm_format(mime_type: str) -> tuple:
+    """
+    ``(rate, channels, encoding)`` from the parameters of a PCM mime type.
+
+    Raises ValueError for values the normalizer can't handle. Results are
+    cached, since a client sends the same mime type with every chunk.
+    """
+    parsed = _pcm_formats.get(mime_type)
+    if parsed is not None:
+        return parsed
+    rate, channels, encoding = SEND_SAMPLE_RATE, CHANNELS, INPUT_ENCODING_S16
+    for param in str(mime_type).split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        key, value = key.strip().lower(), value.strip().lower()
+        if key == "rate":
+            rate = int(value)
+        elif key == "channels":
+            channels = int(value)
+        elif key == "encoding":
+            if value not in INPUT_ENCODINGS:
+                raise ValueError(f"encoding must be one of {', '.join(INPUT_ENCODINGS)}")
+            encoding = INPUT_ENCODINGS[value]
+    if not INPUT_MIN_RATE <= rate <= INPUT_MAX_RATE:
+        raise ValueError(f"rate must be between {INPUT_MIN_RATE} and {INPUT_MAX_RATE}")
+    if not 1 <= channels <= INPUT_MAX_CHANNELS:
+        raise ValueError(f"channels must be between 1 and {INPUT_MAX_CHANNELS}")
+    if len(_pcm_formats) >= 256:
+        _pcm_formats.clear()
+    parsed = _pcm_formats[mime_type] = (rate, channels, encoding)
+    return parsed
+
+
+_resample_banks: Dict[tuple, Any] = {}
+
+
+def resample_bank(up: int, down: int):
+    """
+    The polyphase filter bank for resampling by ``up / down``, shared by all sessions.
+
+    Row ``p`` holds the taps of phase ``p`` in reverse, so an output sample
+    is the dot product of a row with a window of input in time order.
+    """
+    bank = _resample_banks.get((up, down))
+    if bank is None:
+        factor = max(up, down)
+        half = RESAMPLE_HALF_TAPS * factor
+        taps = np.sinc(np.arange(-half, half + 1) / factor) * np.kaiser(2 * half + 1, RESAMPLE_KAISER_BETA)
+        # Unit gain at DC for every phase
+        taps *= up / taps.sum()
+        per_phase = -(-len(taps) // up)
+        taps = np.concatenate((taps, np.zeros(per_phase * up - len(taps))))
+        bank = np.ascontiguousarray(taps.reshape(per_phase, up).T[:, ::-1], dtype=np.float32)
+        _resample_banks[(up, down)] = bank
+    return bank
+
+
+class InputNormalizer:
+    """
+    Converts one session's inbound PCM to 16 kHz mono int16.
+
+    Holds the state that has to survive chunk boundaries: the bytes of an
+    incomplete sample frame, and the resampler's input history and phase.
+    The state is reset when the client's format changes. Audio already in
+    the target format is passed through untouched.
+    """
+
+    def __init__(self, rate: int = SEND_SAMPLE_RATE):
+        self.rate = rate
+        self._format = (rate, CHANNELS, INPUT_ENCODING_S16)
+        self._partial = b""
+        self._bank = None
+        self._ratio = (1, 1)
+        self._history = None
+        self._phase = 0
+        self.chunks = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _reset(self, fmt: tuple):
+        self._format = fmt
+        self._partial = b""
+        self._bank = self._history = None
+        self._phase = 0
+        rate = fmt[0]
+        if NUMPY_AVAILABLE and rate != self.rate:
+            common = math.gcd(self.rate, rate)
+            self._ratio = (self.rate // common, rate // common)
+            self._bank = resample_bank(*self._ratio)
+            self._history = np.zeros(self._bank.shape[1] - 1, dtype=np.float32)
+
+    def process(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Return ``item`` in the target format, or None while too little audio
+        has arrived to produce any. Raises ValueError for unsupported formats.
+        """
+        mime_type = item.get("mime_type", "audio/pcm")
+        data = item.get("data")
+        if not isinstance(data, (bytes, bytearray)) or not str(mime_type).startswith("audio/pcm"):
+            return item
+        fmt = parse_pcm_format(mime_type)
+        if fmt != self._format:
+            self._reset(fmt)
+        rate, channels, encoding = fmt
+        if (rate == self.rate and channels == CHANNELS and encoding == INPUT_ENCODING_S16
+                and not self._partial and not len(data) & 1):
+            return item
+
+        if self._partial:
+            data = self._partial + data
+        frame_bytes = channels * INPUT_SAMPLE_BYTES[encoding]
+        usable = len(data) - len(data) % frame_bytes
+        self._partial = bytes(data[usable:])
+        if not usable:
+            return None
+        view = memoryview(data)[:usable]
+        if NUMPY_AVAILABLE:
+            pcm = self._convert_numpy(view, channels, encoding, rate != self.rate)
+            rate = self.rate
+        else:
+            pcm = self._convert_python(view, channels, encoding)
+        self.chunks += 1
+        self.bytes_in += usable
+        self.bytes_out += len(pcm)
+        if not pcm:
+            return None
+        return dict(item, data=pcm, mime_type="audio/pcm" if rate == SEND_SAMPLE_RATE else f"audio/pcm;rate={rate}")
+
+    def clear(self):
+        """Forget input carried over between chunks, e.g. when the session is paused."""
+        self._reset(self._format)
+
+    def _convert_numpy(self, view: memoryview, channels: int, encoding: str, resample: bool) -> bytes:
+        # Zero-copy view over the client's bytes; only the output is allocated
+        samples = np.frombuffer(view, dtype="<f4" if encoding == INPUT_ENCODING_F32 else "<i2")
+        if encoding == INPUT_ENCODING_F32:
+            # NaN or inf would be an undefined int16 cast, and would poison
+            # the resampler's history for the rest of the stream
+            samples = np.clip(np.nan_to_num(samples, nan=0.0, posinf=1.0, neginf=-1.0), -1.0, 1.0)
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+        if encoding == INPUT_ENCODING_F32:
+            samples = samples * np.float32(32767)
+        if resample:
+            samples = self._resample(samples.astype(np.float32, copy=False))
+        if samples.dtype != np.int16:
+            samples = np.clip(np.rint(samples), -32768, 32767).astype("<i2")
+        return samples.tobytes()
+
+    def _resample(self, samples):
+        bank, (up, down) = self._bank, self._ratio
+        buffered = np.concatenate((self._history, samples))
+        span = len(samples) * up
+        # Output times on the upsampled grid that fall inside this chunk
+        times = np.arange(self._phase, span, down)
+        self._phase += len(times) * down - span
+        self._history = buffered[len(buffered) - len(self._history):]
+        if not len(times):
+            return np.zeros(0, dtype=np.float32)
+        windows = np.lib.stride_tricks.sliding_window_view(buffered, bank.shape[1])[times // up]
+        return np.einsum("ij,ij->i", windows, bank[times % up])
+
+    @staticmethod
+    def _convert_python(view: memoryview, channels: int, encoding: str) -> bytes:
+        samples = array.array("f" if encoding == INPUT_ENCODING_F32 else "h")
+        samples.frombytes(view)
+        if sys.byteorder == "big":
+            samples.byteswap()
+        if encoding == INPUT_ENCODING_F32:
+            samples = [max(-1.0, min(1.0, s)) if s == s else 0.0 for s in samples]
+        if channels > 1:
+            samples = [sum(samples[i:i + channels]) / channels for i in range(0, len(samples), channels)]
+        if encoding == INPUT_ENCODING_F32:
+            samples = [s * 32767 for s in samples]
+        out = array.array("h", (max(-32768, min(32767, round(s))) for s in samples))
+        if sys.byteorder == "big":
+            out.byteswap()
+        return out.tobytes()
+
+    def stats(self) -> Dict[str, Any]:
+        rate, channels, encoding = self._format
+        return {
+            "rate": rate,
+            "channels": channels,
+            "encoding": encoding,
+            "chunks": self.chunks,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+# ==== Metrics ====
+
+class Counter:
+    """A monotonically increasing Prometheus counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self._counts):
+                self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield f"{self.name}_bucket", {"le": repr(float(bound))}, cumulative
+        yield f"{self.name}_bucket", {"le": "+Inf"}, count
+        yield f"{self.name}_sum", {}, total
+        yield f"{self.name}_count", {}, count
+
+
+class Gauge:
+    """A value read at scrape time from a callback returning a number or {label_values: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.labels = labels
+
+    def samples(self):
+        value = self.read()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for label_values, number in sorted(value.items()):
+            yield self.name, dict(zip(self.labels, label_values)), number
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process, rendered in the Prometheus text format.
+
+    Counters and histograms are updated in place on the audio path, which
+    costs one uncontended lock per update. Gauges are computed only when
+    /metrics is scraped. Each worker process reports its own numbers.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics = MetricsRegistry()
+CONNECT_SECONDS = metrics.add(Histogram(
+    "voice_gemini_connect_seconds", "Time to open a Gemini live connection.",
+    (0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+))
+FIRST_AUDIO_SECONDS = metrics.add(Histogram(
+    "voice_time_to_first_audio_seconds", "Time from session start to the first audio sent to clients.",
+    (0.25, 0.5, 1, 2, 5, 10, 30, 60),
+))
+AUDIO_BYTES = metrics.add(Counter(
+    "voice_audio_bytes_total", "PCM bytes moved, by direction.", ("direction",),
+))
+AUDIO_CHUNKS = metrics.add(Counter(
+    "voice_audio_chunks_total", "Audio chunks moved, by direction.", ("direction",),
+))
+CLIENT_AUDIO_BYTES = metrics.add(Counter(
+    "voice_client_audio_bytes_total", "Encoded audio bytes to and from clients, by direction and codec.",
+    ("direction", "codec"),
+))
+BARGE_INS = metrics.add(Counter(
+    "voice_barge_ins_total", "Model replies cut off because the caller spoke, by what noticed it.", ("source",),
+))
+BARGE_IN_DISCARDED_BYTES = metrics.add(Counter(
+    "voice_barge_in_discarded_bytes_total",
+    "Model audio thrown away on barge-in: PCM still queued, encoded audio in client buffers, "
+    "or PCM of the cut-off turn still arriving from the model.",
+    ("stage",),
+))
+BARGE_IN_SECONDS = metrics.add(Histogram(
+    "voice_barge_in_seconds",
+    "Time from the caller starting to talk over the model (or the interruption being noticed) "
+    "until clients were told to flush.",
+    (0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+))
+SESSION_PAUSES = metrics.add(Counter(
+    "voice_session_pauses_total", "Sessions parked with their Gemini connection kept open, by reason.",
+    ("reason",),
+))
+ERRORS = metrics.add(Counter(
+    "voice_errors_total", "Errors on the audio path, by stage and exception type.", ("stage", "type"),
+))
+
+
+def _queue_depths() -> Dict[tuple, int]:
+    depths = {("out_queue",): 0, ("audio_in_queue",): 0}
+    for session in session_manager.sessions():
+        depths[("out_queue",)] += session.audio_loop.out_queue.qsize()
+        depths[("audio_in_queue",)] += session.audio_loop.audio_in_queue.qsize()
+    return depths
+
+
+metrics.add(Gauge("voice_sessions_active", "Voice sessions running in this process.",
+                  lambda: len(session_manager)))
+metrics.add(Gauge("voice_sessions_paused", "Voice sessions parked by a client or for being idle.",
+                  lambda: sum(1 for session in session_manager.sessions() if session.audio_loop.paused)))
+metrics.add(Gauge("voice_websocket_clients", "Connected /audio-stream WebSocket clients.",
+                  lambda: len(ws_clients)))
+metrics.add(Gauge("voice_queue_depth", "Items waiting in the session queues, summed over sessions.",
+                  _queue_depths, ("queue",)))
+
+
+# ==== Latency Tracing ====
+
+# perf_counter() stamps are monotonic but have no epoch; exporters that
+# want wall-clock times add this offset
+_WALL_CLOCK_OFFSET = time.time() - time.perf_counter()
+
+trace_logger = logging.getLogger(f"{__name__}.trace")
+
+# (span, start stage, end stage) for each kind of trace
+CHUNK_SPANS = (
+    ("ingest", "received", "queued"),
+    ("queue_wait", "queued", "dequeued"),
+    ("upstream_send", "dequeued", "sent"),
+)
+TURN_SPANS = (
+    ("model_first_byte", "speech_end", "first_model_byte"),
+    ("fanout", "first_model_byte", "first_sent"),
+    ("model_stream", "first_model_byte", "last_model_byte"),
+    ("client_stream", "first_sent", "last_sent"),
+)
+
+
+class TurnTrace:
+    """
+    Monotonic stage stamps for one sampled model turn.
+
+    It rides through audio_in_queue as a marker in front of the turn's
+    first chunk, so play_audio picks it up in order with the audio.
+    """
+
+    __slots__ = ("turn", "stamps")
+
+    def __init__(self, speech_end: Optional[float]):
+        self.turn: Optional[int] = None
+        self.stamps: Dict[str, float] = {}
+        if speech_end is not None:
+            self.stamps["speech_end"] = speech_end
+
+    def mark(self, stage: str):
+        self.stamps.setdefault(stage, time.perf_counter())
+
+    def sent(self):
+        """on_sent callback for the turn's audio; only the first send is kept."""
+        self.mark("first_sent")
+
+
+class LatencyTracer:
+    """
+    Samples chunks and turns and exports their stage timings.
+
+    Sampling is decided once per chunk or turn, so unsampled audio only
+    pays for one random() call. Finished traces are written as one JSON
+    line on the ``app.trace`` logger and, when OpenTelemetry is installed
+    and selected, as a parent span with one child span per stage.
+    """
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, exporter: str = TRACE_EXPORTER):
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.log = exporter in ("log", "both")
+        self.otel = exporter in ("otel", "both") and OTEL_AVAILABLE
+        if exporter in ("otel", "both") and not OTEL_AVAILABLE:
+            logger.warning("TRACE_EXPORTER wants OpenTelemetry but it is not installed; logging traces instead")
+            self.log = True
+        self._otel_tracer = otel_trace.get_tracer(__name__) if self.otel else None
+        self.exported = 0
+
+    def sampled(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def stamp_chunk(self, item: Dict[str, Any]):
+        """Start a trace on a sampled inbound chunk; the stamps travel inside the item."""
+        if self.sample_rate > 0 and isinstance(item, dict) and self.sampled():
+            item["_trace"] = {"received": time.perf_counter()}
+
+    def export(self, kind: str, session_id: Optional[str], stamps: Dict[str, float],
+               spans: tuple, **attributes):
+        """Emit a finished trace. Spans whose two stages were not both reached are left out."""
+        if not stamps:
+            return
+        origin = min(stamps.values())
+        durations = {
+            name: round((stamps[end] - stamps[start]) * 1000, 2)
+            for name, start, end in spans if start in stamps and end in stamps
+        }
+        self.exported += 1
+        if self.log:
+            trace_logger.info(json.dumps({
+                "trace": kind,
+                "session_id": session_id,
+                **attributes,
+                "stages_ms": {stage: round((at - origin) * 1000, 2) for stage, at in stamps.items()},
+                "spans_ms": durations,
+            }))
+        if self._otel_tracer is not None:
+            self._export_otel(kind, session_id, stamps, spans, attributes)
+
+    def _export_otel(self, kind, session_id, stamps, spans, attributes):
+        def ns(at: float) -> int:
+            return int((at + _WALL_CLOCK_OFFSET) * 1e9)
+
+        try:
+            attributes = {key: value for key, value in attributes.items() if value is not None}
+            attributes["session_id"] = session_id or ""
+            parent = self._otel_tracer.start_span(f"voice.{kind}", start_time=ns(min(stamps.values())),
+                                                  attributes=attributes)
+            context = otel_trace.set_span_in_context(parent)
+            for name, start, end in spans:
+                if start in stamps and end in stamps:
+                    child = self._otel_tracer.start_span(f"voice.{kind}.{name}", context=context,
+                                                         start_time=ns(stamps[start]))
+                    child.end(end_time=ns(stamps[end]))
+            parent.end(end_time=ns(max(stamps.values())))
+        except Exception as e:
+            logger.error(f"Error exporting trace to OpenTelemetry: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "exporters": [name for name, enabled in (("log", self.log), ("otel", self.otel)) if enabled],
+            "exported": self.exported,
+        }
+
+
+tracer = LatencyTracer()
+
+
+# ==== Audio Processing Class ====
+
+# Queued on audio_in_queue after the last chunk of each model turn
+TURN_COMPLETE = object()
+
+
+def _stamp_queued(item):
+    trace = item.get("_trace") if isinstance(item, dict) else None
+    if trace is not None:
+        trace.setdefault("queued", time.perf_counter())
+
+class AudioLoop:
+    """
+    Handles real-time audio streaming with the Gemini API.
+    
+    This class manages sending audio data to the Gemini API and 
+    receiving responses, handling the two-way communication.
+    """
+    
+    def __init__(self, client, options: Optional[Dict[str, Any]] = None):
+        """Initialize the AudioLoop with a Gemini client and per-session options."""
+        self.client = client
+        self.options = resolve_session_options(options)
+        self.session = None
+        self._session_ctx = None
+        self.is_running = False
+        self.audio_in_queue = AudioQueue(self.options["in_queue_size"], self.options["in_queue_policy"])
+        self.out_queue = AudioQueue(self.options["out_queue_size"], self.options["out_queue_policy"])
+        self.vad = VoiceActivityDetector(
+            mode=self.options["vad_mode"],
+            energy_threshold=self.options["vad_energy_threshold"],
+            preroll_ms=self.options["vad_preroll_ms"],
+            hangover_ms=self.options["vad_hangover_ms"],
+            thin_every=self.options["vad_thin_every"],
+            # Classify even with VAD off when barge-in or turn traces need to
+            # know when the caller is speaking
+            track_speech=self.options["barge_in"] == BARGE_IN_VAD or tracer.sample_rate > 0,
+        )
+        self.session_id: Optional[str] = None
+        self.subscribers = set()
+        self._out_seq = 0
+        self._turn_seq = 0
+        self._turn_open = False
+        self._wav_header = WavHeaderTemplate(RECEIVE_SAMPLE_RATE, CHANNELS, 2)
+        # Streaming codec state for this session, one instance per codec in use
+        self._codecs: Dict[str, PcmCodec] = {}
+        self.normalizer = InputNormalizer()
+        self._processing_task = None
+        self._upstream_pending = None
+        self.upstream_sends = 0
+        self.upstream_chunks = 0
+        self.connect_ms: Optional[float] = None
+        self.prewarmed = False
+        self._started_at = time.perf_counter()
+        self._first_audio_at: Optional[float] = None
+        self.config: Optional[Dict[str, Any]] = None
+        # Transcript turns ({"role", "text"}) replayed into a resumed session
+        self.history = collections.deque(maxlen=RESUME_HISTORY_TURNS)
+        self._resume_handle: Optional[str] = None
+        self._resume_task: Optional[asyncio.Task] = None
+        self.resumes = 0
+        self.resume_failures = 0
+        self._connected = asyncio.Event()
+        self._last_upstream_at: Optional[float] = None
+        self._trace: Optional[TurnTrace] = None
+        self._trace_client = None
+        # Barge-in: whether receive_audio is in the middle of a model turn,
+        # whether play_audio is discarding the rest of one that was cut off,
+        # and the start of the speech run that last triggered a local barge-in
+        self._model_turn_open = False
+        self._discarding = False
+        self._barge_in_speech: Optional[float] = None
+        self.barge_ins = 0
+        # Why the session is paused (None while it runs). _awake is set
+        # while it runs; the idle timer waits on it.
+        self.pause_reason: Optional[str] = None
+        self.pauses = 0
+        self._awake = asyncio.Event()
+        self._awake.set()
+        self._last_activity_at = time.perf_counter()
+        self._stop_event = asyncio.Event()
+        # Shutdown: the task running run() and the pipeline tasks it started,
+        # when they must be done by, and _stopped, set once the session is
+        # closed and the queues released
+        self._run_task: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+        self._shutdown_deadline: Optional[float] = None
+        self._shutdown_started = False
+        self._stopped = asyncio.Event()
+        
+        # Check if we're running in a serverless environment
+        self.is_serverless = os.environ.get('VERCEL') == '1'
+
+    async def connect_with_retry(self, config: Dict[str, Any], max_retries: int = MAX_RETRIES) -> bool:
+        """
+        Attempt to connect to the Gemini API with retries.
+
+        Retries back off exponentially with jitter, and every attempt goes
+        through the process-wide upstream circuit breaker, so an upstream
+        outage fails fast instead of being hammered by every session.
+        """
+        started = time.perf_counter()
+
+        async def connect():
+            logger.info("Connecting to Gemini API")
+            # Use the live.connect approach
+            session_ctx = self.client.aio.live.connect(
+                model=config["model"],
+                config=config["live_connect_config"]
+            )
+            # Enter the context
+            session = await session_ctx.__aenter__()
+            self._session_ctx = session_ctx
+            return session
+
+        try:
+            self.session = await retry_async(
+                connect, attempts=max_retries, base_delay=RETRY_DELAY,
+                max_delay=RETRY_MAX_DELAY, breaker=upstream_circuit,
+                description="Gemini API connection"
+            )
+        except CircuitOpenError as e:
+            ERRORS.inc("connect", type(e).__name__)
+            logger.error(str(e))
+            return False
+        except Exception as e:
+            ERRORS.inc("connect", type(e).__name__)
+            logger.error("Failed to connect to Gemini API after maximum retries")
+            return False
+
+        self.is_running = True
+        self.connect_ms = (time.perf_counter() - started) * 1000
+        CONNECT_SECONDS.observe(self.connect_ms / 1000)
+        logger.info(f"Successfully connected to Gemini API in {self.connect_ms:.0f} ms")
+        return True
+
+    def adopt(self, warm: "WarmConnection"):
+        """Take over an already-open live connection from the pre-warm pool."""
+        self._session_ctx = warm.session_ctx
+        self.session = warm.session
+        self.is_running = True
+        self.connect_ms = 0.0
+        self.prewarmed = True
+    
+    def _time_left(self) -> float:
+        """Seconds until the shutdown deadline, which starts counting on first use."""
+        now = asyncio.get_running_loop().time()
+        if self._shutdown_deadline is None:
+            self._shutdown_deadline = now + SHUTDOWN_TIMEOUT
+        return max(0.0, self._shutdown_deadline - now)
+
+    async def stop(self):
+        """
+        Stop all audio processing and close connections.
+
+        Signals run() to cancel its tasks and close the Gemini session, and
+        waits for that until the shutdown deadline. A run() still making its
+        first connection is cancelled outright. Safe to call more than once,
+        from any task.
+        """
+        if not self._stop_event.is_set():
+            logger.info("Stopping audio processing")
+        self.is_running = False
+        self._stop_event.set()
+        time_left = self._time_left()
+        
+        run_task = self._run_task
+        if run_task is None or run_task.done() or run_task is asyncio.current_task():
+            await self._shutdown()
+            return
+        if not self._tasks:
+            run_task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._stopped.wait()), time_left)
+        except asyncio.TimeoutError:
+            logger.warning(f"Audio loop did not stop within {SHUTDOWN_TIMEOUT}s; cancelling it")
+            run_task.cancel()
+
+    async def _shutdown(self):
+        """Close the Gemini session and release the queues, once, then signal ``_stopped``."""
+        if self._shutdown_started:
+            await self._stopped.wait()
+            return
+        self._shutdown_started = True
+        session_ctx, self._session_ctx = self._session_ctx, None
+        self.session = None
+        try:
+            if session_ctx is not None:
+                logger.info("Closing Gemini API session")
+                # Use the context manager exit method to properly close the session
+                await asyncio.wait_for(session_ctx.__aexit__(None, None, None), max(0.1, self._time_left()))
+                logger.info("Gemini API session closed successfully")
+        except asyncio.TimeoutError:
+            logger.warning("Timed out closing the Gemini API session")
+        except Exception as e:
+            logger.error(f"Error closing session: {str(e)}")
+        finally:
+            self._clear_queues()
+            self._stopped.set()
+            logger.info("Audio processing stopped completely")
+
+    def _clear_queues(self):
+        """Clear any pending items from queues."""
+        for queue in [self.audio_in_queue, self.out_queue]:
+            if queue:
+                queue.clear()
+
+    def _codec(self, name: str) -> PcmCodec:
+        codec = self._codecs.get(name)
+        if codec is None:
+            codec = self._codecs[name] = create_codec(name)
+        return codec
+
+    def _decode_inbound(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Transcode an inbound chunk to PCM and normalize it to what Gemini
+        takes; returns None for audio that is undecodable or still buffered.
+        """
+        mime_type = item.get("mime_type", "")
+        codec = codec_for_mime_type(mime_type)
+        if codec is None or not isinstance(item.get("data"), (bytes, bytearray)):
+            return item
+        CLIENT_AUDIO_BYTES.inc("upstream", codec, amount=len(item["data"]))
+        if codec != CODEC_PCM:
+            try:
+                pcm = self._codec(codec).decode(item["data"])
+            except Exception as e:
+                ERRORS.inc("decode", type(e).__name__)
+                logger.warning(f"Dropping undecodable {codec} audio: {str(e)}")
+                return None
+            # Keep parameters such as rate=, except for Opus, which decodes
+            # at a fixed rate whatever it was encoded at
+            _, separator, params = str(mime_type).partition(";")
+            if codec == CODEC_OPUS:
+                separator = params = ""
+            item = dict(item, data=pcm, mime_type="audio/pcm" + separator + params)
+        try:
+            return self.normalizer.process(item)
+        except ValueError as e:
+            ERRORS.inc("normalize", type(e).__name__)
+            logger.warning(f"Dropping audio in unsupported format {mime_type}: {str(e)}")
+            return None
+
+    def ingest_nowait(self, item: Dict[str, Any]):
+        """Run an inbound chunk through the input stages and queue what survives."""
+        if not self._admit_inbound():
+            return
+        item = self._decode_inbound(item)
+        if item is None:
+            return
+        forwarded_items = self.vad.process(item)
+        self._detect_barge_in()
+        for forwarded in forwarded_items:
+            _stamp_queued(forwarded)
+            self.out_queue.put_nowait(forwarded)
+
+    async def ingest(self, item: Dict[str, Any]):
+        """Like ingest_nowait, but waits for room when the queue policy blocks."""
+        if not self._admit_inbound():
+            return
+        item = self._decode_inbound(item)
+        if item is None:
+            return
+        forwarded_items = self.vad.process(item)
+        self._detect_barge_in()
+        for forwarded in forwarded_items:
+            _stamp_queued(forwarded)
+            await self.out_queue.put(forwarded)
+
+    def _detect_barge_in(self):
+        """Cut the model off once the local detector has heard enough of the caller."""
+        vad = self.vad
+        if (self.options["barge_in"] == BARGE_IN_VAD
+                and vad.speech_ms >= self.options["barge_in_min_speech_ms"]
+                and vad.speech_started_at != self._barge_in_speech):
+            # Once per run of speech
+            self._barge_in_speech = vad.speech_started_at
+            self.barge_in(BARGE_IN_VAD, vad.speech_started_at)
+
+    def barge_in(self, source: str, speech_at: Optional[float] = None) -> bool:
+        """
+        Stop the model's reply because the caller started talking over it.
+
+        Model audio still queued is dropped, as is the rest of the turn if
+        Gemini is still sending it, and every client loses the audio in its
+        buffer and gets a ``flush`` control message so it can stop playback.
+        Returns False, without telling clients anything, when the model
+        wasn't speaking or this turn was already cut off. Must be called on
+        the session's event loop.
+        """
+        detected_at = time.perf_counter()
+        already_discarding = self._discarding
+        turn_open = self._turn_open or self._model_turn_open
+        queued, buffered = self._cut_model_audio()
+        if already_discarding:
+            BARGE_IN_DISCARDED_BYTES.inc("model", amount=queued)
+            return False
+        if not (queued or buffered or turn_open):
+            return False
+
+        started = speech_at if speech_at is not None else detected_at
+        observed = []
+
+        def flushed():
+            if not observed:
+                observed.append(True)
+                BARGE_IN_SECONDS.observe(time.perf_counter() - started)
+
+        message = json.dumps({"type": "control", "command": "flush", "turn": self._turn_seq, "reason": source})
+        # Time the flush to the caller when there is one
+        clients = sorted(self.subscribers, key=lambda client: client.is_monitor)
+        for client in clients:
+            client.enqueue(message, droppable=False, on_sent=flushed if client is clients[0] else None)
+
+        self.barge_ins += 1
+        BARGE_INS.inc(source)
+        BARGE_IN_DISCARDED_BYTES.inc("queue", amount=queued)
+        BARGE_IN_DISCARDED_BYTES.inc("client_buffer", amount=buffered)
+        self._finish_trace()
+        logger.info(f"Barge-in ({source}) on session {self.session_id}: dropped {queued} queued "
+                    f"and {buffered} buffered bytes of model audio")
+        return True
+
+    def _cut_model_audio(self):
+        """
+        Drop the model audio not yet sent to clients, and have play_audio
+        skip the rest of the turn if it is still arriving. Returns the
+        ``(queued, buffered)`` bytes dropped from audio_in_queue and from
+        the clients' buffers.
+        """
+        queued = 0
+        while True:
+            try:
+                item = self.audio_in_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            self.audio_in_queue.task_done()
+            if isinstance(item, (bytes, bytearray)):
+                queued += len(item)
+        # A TURN_COMPLETE drained above closed its turn
+        self._discarding = self._model_turn_open
+        self._turn_open = False
+        for codec in self._codecs.values():
+            codec.reset()
+        buffered = sum(client.discard_audio() for client in list(self.subscribers))
+        return queued, buffered
+
+    @property
+    def paused(self) -> bool:
+        return self.pause_reason is not None
+
+    def _notify(self, command: str, **fields):
+        message = json.dumps({"type": "control", "command": command, **fields})
+        for client in list(self.subscribers):
+            client.enqueue(message, droppable=False)
+
+    def _admit_inbound(self) -> bool:
+        """Note inbound audio, waking an idle session; False while the client has it paused."""
+        if self.pause_reason == PAUSE_CLIENT:
+            return False
+        self._last_activity_at = time.perf_counter()
+        if self.pause_reason is not None:
+            self._wake()
+        return True
+
+    def _suspend(self, reason: str) -> bool:
+        if self.paused:
+            # A client pause outlasts the next audio frame; an idle one doesn't
+            if reason == PAUSE_CLIENT:
+                self.pause_reason = reason
+            return False
+        self.pause_reason = reason
+        self._awake.clear()
+        self.out_queue.clear()
+        self._upstream_pending = None
+        self.vad.clear()
+        self.normalizer.clear()
+        queued, buffered = self._cut_model_audio()
+        self._finish_trace()
+        self._notify("paused", reason=reason)
+        self.pauses += 1
+        SESSION_PAUSES.inc(reason)
+        logger.info(f"Paused voice session {self.session_id} ({reason}), "
+                    f"released {queued + buffered} bytes of model audio")
+        return True
+
+    def _wake(self) -> bool:
+        if not self.paused:
+            return False
+        reason, self.pause_reason = self.pause_reason, None
+        self._last_activity_at = time.perf_counter()
+        self._awake.set()
+        self._notify("resumed")
+        logger.info(f"Resumed voice session {self.session_id} (paused: {reason})")
+        return True
+
+    async def pause(self, reason: str = PAUSE_CLIENT) -> bool:
+        """
+        Park the session without closing the Gemini connection.
+
+        Nothing is sent upstream, queued audio in both directions and the
+        clients' buffered audio are released, and clients get a ``paused``
+        control message. A session paused for being idle wakes on its next
+        audio frame; one paused by the client ignores audio until
+        ``unpause``. Returns False if it was already paused.
+        """
+        return self._suspend(reason)
+
+    async def unpause(self) -> bool:
+        """Wake a paused session on the connection it kept. Returns False if it wasn't paused."""
+        return self._wake()
+
+    async def _suspend_when_idle(self):
+        """Pause the session once no audio has moved either way for ``idle_suspend_s``."""
+        timeout = self.options["idle_suspend_s"]
+        while True:
+            await self._awake.wait()
+            remaining = self._last_activity_at + timeout - time.perf_counter()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            else:
+                self._suspend(PAUSE_IDLE)
+
+    def queue_stats(self) -> Dict[str, Any]:
+        return {
+            "out_queue": self.out_queue.stats(),
+            "audio_in_queue": self.audio_in_queue.stats(),
+        }
+
+    def upstream_stats(self) -> Dict[str, int]:
+        return {
+            "chunks": self.upstream_chunks,
+            "sends": self.upstream_sends,
+            "resumes": self.resumes,
+            "resume_failures": self.resume_failures,
+        }
+
+    # -- Session resumption --
+
+    def _remember(self, role: str, text: Optional[str]):
+        """Append a transcript fragment to the history, merging fragments of the same turn."""
+        if not text:
+            return
+        if self.history and self.history[-1]["role"] == role:
+            self.history[-1]["text"] = (self.history[-1]["text"] + text)[-RESUME_TURN_CHARS:]
+        else:
+            self.history.append({"role": role, "text": text[-RESUME_TURN_CHARS:]})
+
+    def _observe(self, response):
+        """Pick resumption handles and transcripts out of a server message."""
+        update = getattr(response, "session_resumption_update", None)
+        if update is not None and getattr(update, "resumable", False) and update.new_handle:
+            self._resume_handle = update.new_handle
+
+        content = getattr(response, "server_content", None)
+        if content is not None:
+            if content.input_transcription is not None:
+                self._remember("user", content.input_transcription.text)
+            if content.output_transcription is not None:
+                self._remember("model", content.output_transcription.text)
+
+    def _resume_config(self, handle: Optional[str]) -> Dict[str, Any]:
+        """The session config, pointed at a resumption handle when we have one."""
+        if handle is None:
+            return self.config
+        live_config = self.config["live_connect_config"]
+        if isinstance(live_config, dict):
+            live_config = dict(live_config, session_resumption={"handle": handle})
+        else:
+            live_config = live_config.model_copy(
+                update={"session_resumption": types.SessionResumptionConfig(handle=handle)}
+            )
+        return dict(self.config, live_connect_config=live_config)
+
+    async def _replay_history(self):
+        """Give a fresh Gemini session the conversation so far as context."""
+        if not self.history:
+            return
+        turns = [{"role": turn["role"], "parts": [{"text": turn["text"]}]} for turn in self.history]
+        try:
+            await self.session.send_client_content(turns=turns, turn_complete=False)
+            logger.info(f"Replayed {len(turns)} conversation turns into the new session")
+        except Exception as e:
+            logger.error(f"Error replaying conversation history: {str(e)}")
+
+    async def resume(self, failed_session) -> bool:
+        """
+        Reconnect after ``failed_session`` dropped; concurrent callers share one attempt.
+
+        Returns False when the session is stopping or could not be resumed.
+        """
+        if self.session is not None and self.session is not failed_session and self._connected.is_set():
+            return True  # someone else already reconnected
+        if self._resume_task is None or self._resume_task.done():
+            self._connected.clear()
+            self._resume_task = asyncio.create_task(self._reconnect())
+        return await asyncio.shield(self._resume_task)
+
+    async def _reconnect(self) -> bool:
+        if self._stop_event.is_set():
+            return False
+        if not SESSION_RESUME or not self.is_running:
+            # Nothing will bring the pipeline back; let run() shut it down
+            self._stop_event.set()
+            return False
+
+        logger.warning("Gemini connection dropped; resuming the session")
+        old_ctx, self._session_ctx, self.session = self._session_ctx, None, None
+        if old_ctx is not None:
+            try:
+                await old_ctx.__aexit__(None, None, None)
+            except Exception:
+                pass  # the connection is already gone
+
+        for attempt in range(RESUME_MAX_ATTEMPTS):
+            handle = self._resume_handle
+            if await self.connect_with_retry(self._resume_config(handle), max_retries=1):
+                if self._stop_event.is_set():
+                    # Stopped while connecting. _shutdown() closes the new
+                    # connection unless it has already run.
+                    self.is_running = False
+                    if self._shutdown_started:
+                        ctx, self._session_ctx, self.session = self._session_ctx, None, None
+                        with contextlib.suppress(Exception):
+                            await ctx.__aexit__(None, None, None)
+                    return False
+                if handle is None:
+                    await self._replay_history()
+                self.resumes += 1
+                self._connected.set()
+                logger.info(f"Session resumed ({'handle' if handle else 'history replay'})")
+                return True
+            # A stale handle must not keep us from starting a fresh session
+            self._resume_handle = None
+            await asyncio.sleep(backoff_delay(attempt, RETRY_DELAY, RETRY_MAX_DELAY))
+
+        logger.error("Could not resume the Gemini session; ending it")
+        self.resume_failures += 1
+        self._stop_event.set()
+        return False
+
+    async def send_realtime(self):
+        """Send audio data from the out_queue to the Gemini API in real-time."""
+        try:
+            if not self.session or not self.is_running:
+                raise ValueError("Session not initialized or not running")
+            
+            # Block on the queue; run() cancels this task on shutdown
+            while True:
+                if self._upstream_pending is not None:
+                    content, self._upstream_pending = self._upstream_pending, None
+                else:
+                    content = await self.out_queue.get()
+                
+                if content and not self.paused:
+                    content = await self._coalesce_upstream(content)
+                    # Chunk trace stamps must not reach the Gemini API
+                    trace = content.pop("_trace", None) if isinstance(content, dict) else None
+                    if trace is not None:
+                        trace["dequeued"] = time.perf_counter()
+                    
+                    # While a dropped session is being resumed, inbound audio
+                    # keeps collecting in out_queue and is sent afterwards
+                    while True:
+                        await self._connected.wait()
+                        session = self.session
+                        try:
+                            # Send the audio content to the Gemini API using the proper method
+                            await session.send(input=content)
+                            break
+                        except asyncio.CancelledError:
+                            raise
+                        except Exception as e:
+                            ERRORS.inc("send", type(e).__name__)
+                            logger.warning(f"Upstream send failed: {str(e)}")
+                            if not await self.resume(session):
+                                raise
+                    self.upstream_sends += 1
+                    self._last_upstream_at = time.perf_counter()
+                    if trace is not None:
+                        trace["sent"] = self._last_upstream_at
+                        tracer.export("chunk", self.session_id, trace, CHUNK_SPANS)
+                    AUDIO_BYTES.inc("upstream", amount=_item_size(content))
+                    AUDIO_CHUNKS.inc("upstream")
+                
+        except asyncio.CancelledError:
+            logger.info("Send realtime task cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Error in send_realtime: {str(e)}")
+            self.is_running = False
+            self._stop_event.set()
+
+    async def _coalesce_upstream(self, first):
+        """
+        Merge queued PCM chunks into one frame of ``upstream_frame_ms``.
+
+        Chunks already queued are taken immediately; after that we wait for
+        more audio until ``upstream_max_wait_ms`` has passed since the first
+        chunk, so batching never adds more than that much latency. A chunk
+        that can't be merged is held back for the next send.
+        """
+        self.upstream_chunks += 1
+        target_ms = self.options["upstream_frame_ms"]
+        if target_ms <= 0 or not _mergeable(first):
+            return first
+        
+        target_bytes = target_ms * pcm_bytes_per_ms(first.get("mime_type"))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.options["upstream_max_wait_ms"] / 1000
+        parts = [first["data"]]
+        size = len(first["data"])
+        
+        while size < target_bytes:
+            try:
+                item = self.out_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.out_queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            
+            if not _mergeable(item) or item["mime_type"] != first["mime_type"]:
+                self._upstream_pending = item
+                break
+            parts.append(item["data"])
+            size += len(item["data"])
+            self.upstream_chunks += 1
+        
+        if len(parts) == 1:
+            return first
+        return dict(first, data=b"".join(parts))
+
+    async def receive_audio(self):
+        """Receive audio responses from the Gemini API and put them in the audio_in_queue."""
+        try:
+            if not self.session or not self.is_running:
+                raise ValueError("Session not initialized or not running")
+            
+            # Continuously receive responses while the loop is running
+            while self.is_running:
+                session = self.session
+                in_turn = False
+                trace = None
+                try:
+                    # Use the turn-based approach; receive() waits for the next turn
+                    turn = session.receive()
+                    async for response in turn:
+                        self._observe(response)
+                        content = getattr(response, "server_content", None)
+                        if (content is not None and getattr(content, "interrupted", None)
+                                and self.options["barge_in"] != BARGE_IN_OFF):
+                            vad = self.vad
+                            self.barge_in(BARGE_IN_SERVER, vad.speech_started_at if vad.in_speech else None)
+                        if data := response.data:
+                            if not in_turn and tracer.sampled():
+                                trace = TurnTrace(self._speech_end())
+                                trace.mark("first_model_byte")
+                                await self.audio_in_queue.put(trace)
+                            in_turn = True
+                            self._model_turn_open = True
+                            AUDIO_BYTES.inc("downstream", amount=len(data))
+                            AUDIO_CHUNKS.inc("downstream")
+                            await self.audio_in_queue.put(data)
+                    if trace is not None:
+                        trace.mark("last_model_byte")
+                    await self.audio_in_queue.put(TURN_COMPLETE)
+                    self._model_turn_open = False
+                except asyncio.CancelledError:
+                    logger.info("Receive audio operation cancelled")
+                    raise
+                except Exception as e:
+                    ERRORS.inc("receive", type(e).__name__)
+                    logger.error(f"Error receiving audio response: {str(e)}")
+                    if "timeout" in str(e).lower():
+                        await asyncio.sleep(1)  # Brief pause before retry
+                        continue
+                    if in_turn:
+                        # Close out the interrupted turn for the clients
+                        await self.audio_in_queue.put(TURN_COMPLETE)
+                        self._model_turn_open = False
+                    if not await self.resume(session):
+                        break
+            
+            # The upstream is gone for good; let run() shut the session down
+            self._stop_event.set()
+                
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in receive_audio: {str(e)}")
+            self.is_running = False
+            self._stop_event.set()
+
+    def _encode_audio(self, audio_data: bytes, seq: int, binary: bool, framing: str,
+                      codec: str = CODEC_PCM):
+        """Wrap one (already codec-encoded) output chunk for a (protocol, framing, codec) combination."""
+        if binary:
+            if framing == FRAMING_WAV:
+                return pack_frame(FRAME_TYPE_AUDIO, seq,
+                                  self._wav_header.header(len(audio_data)), audio_data)
+            return pack_frame(FRAME_TYPE_AUDIO, seq, audio_data)
+        
+        if framing == FRAMING_WAV:
+            # Legacy format: every chunk is a complete WAV file
+            payload = b"".join((self._wav_header.header(len(audio_data)), audio_data))
+            audio_format = "audio/wav"
+        else:
+            payload = audio_data
+            audio_format = CODEC_MIME_TYPES[codec]
+        
+        return json.dumps({
+            "type": "audio",
+            "format": audio_format,
+            "data": base64.b64encode(payload).decode('utf-8')
+        })
+
+    def _speech_end(self) -> Optional[float]:
+        """
+        When the caller last spoke: the last chunk the VAD classified as
+        speech, or None when nothing has been classified as speech yet.
+        """
+        return self.vad.last_speech_at
+
+    def _finish_trace(self):
+        """Export the turn trace once everything queued for the traced client has been sent."""
+        trace, client = self._trace, self._trace_client
+        self._trace = self._trace_client = None
+        if trace is None:
+            return
+
+        def finish():
+            trace.mark("last_sent")
+            tracer.export("turn", self.session_id, trace.stamps, TURN_SPANS, turn=trace.turn)
+
+        if client is not None and client in self.subscribers:
+            client.enqueue(None, droppable=False, on_sent=finish)
+        else:
+            tracer.export("turn", self.session_id, trace.stamps, TURN_SPANS, turn=trace.turn)
+
+    def _flush_encoders(self):
+        """Send the audio codecs are still holding (e.g. a partial Opus frame) at the end of a turn."""
+        for name, codec in self._codecs.items():
+            payload = codec.flush()
+            if not payload:
+                continue
+            CLIENT_AUDIO_BYTES.inc("downstream", name, amount=len(payload))
+            seq = self._out_seq
+            self._out_seq += 1
+            for client in list(self.subscribers):
+                if client.codec == name:
+                    client.enqueue(self._encode_audio(payload, seq, client.binary, client.framing, name))
+
+    def _send_turn_complete(self):
+        """Tell streaming clients that the current model turn has ended."""
+        message = json.dumps({"type": "control", "command": "turn_complete", "turn": self._turn_seq})
+        for client in list(self.subscribers):
+            if client.framing == FRAMING_STREAM and client.announced_turn == self._turn_seq:
+                client.enqueue(message, droppable=False)
+
+    async def play_audio(self):
+        """Stream audio responses to the WebSocket clients of this session."""
+        try:
+            logger.info("Starting audio playback via WebSockets")
+            
+            # Block on the queue; run() cancels this task on shutdown
+            while True:
+                audio_data = await self.audio_in_queue.get()
+                
+                if self._discarding or self.paused:
+                    # The rest of a turn that was cut off, or audio for a paused session
+                    if audio_data is TURN_COMPLETE:
+                        self._discarding = False
+                    else:
+                        if self._discarding and isinstance(audio_data, (bytes, bytearray)):
+                            BARGE_IN_DISCARDED_BYTES.inc("model", amount=len(audio_data))
+                        continue
+                
+                if audio_data is TURN_COMPLETE:
+                    if self._turn_open:
+                        self._turn_open = False
+                        self._flush_encoders()
+                        self._send_turn_complete()
+                    self._finish_trace()
+                    continue
+                
+                if isinstance(audio_data, TurnTrace):
+                    self._trace = audio_data
+                    continue
+                
+                if audio_data and self.subscribers:
+                    self._last_activity_at = time.perf_counter()
+                    if self._first_audio_at is None:
+                        self._first_audio_at = time.perf_counter()
+                        FIRST_AUDIO_SECONDS.observe(self._first_audio_at - self._started_at)
+                    if not self._turn_open:
+                        self._turn_open = True
+                        self._turn_seq += 1
+                    trace_sent = None
+                    if self._trace is not None:
+                        if self._trace.turn is None:
+                            self._trace.turn = self._turn_seq
+                            self._trace_client = next(
+                                (client for client in self.subscribers if not client.is_monitor), None)
+                        trace_sent = self._trace.sent
+                    
+                    seq = self._out_seq
+                    self._out_seq += 1
+                    
+                    # Each encoding is built at most once per chunk, however
+                    # many clients share it. Codecs keep streaming state, so
+                    # each one must also see every chunk exactly once.
+                    messages = {}
+                    payloads = {}
+                    
+                    # Hand the chunk to every subscriber of this session. Each
+                    # one has its own bounded buffer, so this never blocks.
+                    for client in list(self.subscribers):
+                        try:
+                            if client.framing == FRAMING_STREAM and client.announced_turn != self._turn_seq:
+                                # Streaming clients learn the format once per turn
+                                client.announced_turn = self._turn_seq
+                                client.enqueue(self._format_message(client.codec), droppable=False)
+                            
+                            key = (client.binary, client.framing, client.codec)
+                            if key not in messages:
+                                if client.codec not in payloads:
+                                    payloads[client.codec] = self._encode_payload(audio_data, client.codec)
+                                payload = payloads[client.codec]
+                                messages[key] = self._encode_audio(payload, seq, *key) if payload else None
+                            message = messages[key]
+                            if message is None:
+                                # The codec is still filling a frame
+                                continue
+                            
+                            if trace_sent is not None and client is self._trace_client:
+                                client.enqueue(message, on_sent=trace_sent)
+                            else:
+                                client.enqueue(message)
+                        except Exception as e:
+                            logger.error(f"Error sending audio to client: {str(e)}")
+                
+        except asyncio.CancelledError:
+            logger.info("Play audio task cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Error in play_audio: {str(e)}")
+            logger.error(traceback.format_exc())
+
+    def _encode_payload(self, audio_data: bytes, codec: str) -> bytes:
+        """Run one model chunk through a codec's encoder (PCM passes straight through)."""
+        payload = audio_data if codec == CODEC_PCM else self._codec(codec).encode(audio_data)
+        CLIENT_AUDIO_BYTES.inc("downstream", codec, amount=len(payload))
+        return payload
+
+    def _format_message(self, codec: str = CODEC_PCM) -> str:
+        return json.dumps({"type": "control", "command": "format", **output_audio_format(codec),
+                           "turn": self._turn_seq})
+
+    async def run(self, config):
+        """Start the main audio processing loop."""
+        self.config = config
+        self._started_at = time.perf_counter()
+        self._run_task = asyncio.current_task()
+        # Copies, since _remember() edits the last turn in place
+        self.history.extend(dict(turn) for turn in config.get("history") or [])
+        if self._stop_event.is_set():
+            # Stopped before it started
+            await self._shutdown()
+            return
+        try:
+            if self.session is None:
+                await self.connect_with_retry(config)
+            if not self.session:
+                raise Exception("Failed to establish session")
+            await self._replay_history()
+            self._connected.set()
+
+            # Create tasks
+            self._tasks = [
+                asyncio.create_task(self.send_realtime()),
+                asyncio.create_task(self.receive_audio()),
                 asyncio.create_task(self.play_audio())
             ]
-            
-            # Wait for all tasks to complete or cancel
-            self._stop_event = asyncio.Event()
-            await self._stop_event.wait()
-            
-            # Cancel all tasks when done
-            for task in tasks:
-                if not task.done():
-                    task.cancel()
-            
-            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.options["idle_suspend_s"] > 0:
+                self._last_activity_at = time.perf_counter()
+                self._tasks.append(asyncio.create_task(self._suspend_when_idle()))
+            
+            # Wait until stop() is called
+            await self._stop_event.wait()
+
+        except asyncio.CancelledError:
+            # stop() cancels a run() that is still connecting
+            if not self._stop_event.is_set():
+                raise
+            logger.info("Audio loop cancelled before it was connected")
+        except Exception as e:
+            logger.error(f"Error in run: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            self.is_running = False
+            self._stop_event.set()
+            try:
+                await self._cancel_tasks()
+            finally:
+                await self._shutdown()
+
+    async def _cancel_tasks(self):
+        """Cancel the pipeline and any resume attempt, giving them until the deadline to unwind."""
+        tasks = self._tasks + ([self._resume_task] if self._resume_task is not None else [])
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if not pending:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*pending, return_exceptions=True), self._time_left())
+        except asyncio.TimeoutError:
+            logger.warning(f"Audio tasks did not finish within {SHUTDOWN_TIMEOUT}s of stopping")
+
+
+# ==== Flask Application Setup ====
+
+# Global variables for managing state
+ws_clients = set()
+
+def create_gemini_client(api_key: Optional[str] = API_KEY):
+    """Create and configure the Gemini API client."""
+    return genai.Client(
+        http_options={
+            "api_version": "v1beta",
+            "timeout": CONNECTION_TIMEOUT,
+        },
+        api_key=api_key,
+    )
+
+
+# Looked up on each call so create_gemini_client can be swapped out (benchmarks/fake_live.py)
+gemini_clients = ClientRegistry(API_KEYS, lambda api_key: create_gemini_client(api_key))
+
+def create_audio_loop(options: Optional[Dict[str, Any]] = None,
+                      warm: Optional["WarmConnection"] = None):
+    """Create a new AudioLoop instance, optionally on a pre-warmed connection."""
+    if IN_VERCEL:
+        logger.info("Limited audio functionality in serverless environment")
+        return None
+        
+    if warm is not None:
+        audio_loop = AudioLoop(warm.client, options)
+        audio_loop.adopt(warm)
+        return audio_loop
+
+    return AudioLoop(gemini_clients.get(), options)
+
+
+# ==== Background Event Loops ====
+
+class EventLoopThread:
+    """
+    A long-lived asyncio event loop running in a daemon thread.
+
+    Every AudioLoop pinned to this thread runs as a set of coroutines on
+    the same loop. Synchronous Flask handlers hand work over with
+    ``submit``/``call_soon`` instead of creating event loops of their own.
+    """
+
+    def __init__(self, name: str = "audio-event-loop"):
+        self.name = name
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def start(self) -> "EventLoopThread":
+        """Start the loop thread if it isn't running yet."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.loop = asyncio.new_event_loop()
+                self._thread = Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop and block until it returns."""
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args):
+        """Call a plain function on the loop thread from any thread."""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        """Stop the loop and wait for its thread to exit."""
+        if self.loop and self._thread and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5.0)
+
+
+class RunningEventLoop(EventLoopThread):
+    """
+    An EventLoopThread view of a loop that something else runs.
+
+    Blocking helpers like ``run`` must not be called from that loop's own
+    thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__("attached-event-loop")
+        self.loop = loop
+
+    def start(self) -> "RunningEventLoop":
+        return self
+
+    def stop(self):
+        pass
+
+
+class EventLoopPool:
+    """
+    A small fixed pool of event loop threads.
+
+    Sessions are pinned round-robin to one loop for their whole lifetime,
+    so the number of OS threads stays at ``size`` no matter how many
+    sessions are active.
+    """
+
+    def __init__(self, size: int = EVENT_LOOP_WORKERS):
+        self.loops = [EventLoopThread(f"audio-event-loop-{i}") for i in range(size)]
+        self._next = 0
+        self._lock = Lock()
+
+    def pick(self) -> EventLoopThread:
+        """Return the next loop in rotation, starting it on first use."""
+        with self._lock:
+            loop_thread = self.loops[self._next % len(self.loops)]
+            self._next += 1
+        return loop_thread.start()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Host new sessions on an already-running loop (the ASGI server's) instead of threads."""
+        with self._lock:
+            self.loops = [RunningEventLoop(loop)]
+            self._next = 0
+
+    def stop(self):
+        for loop_thread in self.loops:
+            loop_thread.stop()
+
+
+event_loop_pool = EventLoopPool()
+_send_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_send_executor_lock = Lock()
+
+
+def get_send_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Thread pool for blocking WebSocket sends, created on first use."""
+    global _send_executor
+    with _send_executor_lock:
+        if _send_executor is None:
+            _send_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=SEND_WORKERS, thread_name_prefix="ws-send"
+            )
+        return _send_executor
+
+
+# ==== Connection Pre-warming ====
+
+class WarmConnection:
+    """An open Gemini live connection waiting in the pool for a session."""
+
+    def __init__(self, client, session_ctx, session, event_loop: EventLoopThread):
+        self.client = client
+        self.session_ctx = session_ctx
+        self.session = session
+        self.event_loop = event_loop
+        self.opened_at = time.time()
+        self.watcher: Optional[asyncio.Task] = None
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.time() - self.opened_at
+
+    async def is_healthy(self, timeout: float = 5.0) -> bool:
+        """Ping the underlying WebSocket; connections we can't inspect count as healthy."""
+        ws = getattr(self.session, "_ws", None)
+        if ws is None:
+            return True
+        try:
+            pong_waiter = await ws.ping()
+            await asyncio.wait_for(pong_waiter, timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"Warm connection failed its health check: {str(e)}")
+            return False
+
+    async def close(self):
+        try:
+            await self.session_ctx.__aexit__(None, None, None)
+        except Exception as e:
+            logger.error(f"Error closing warm connection: {str(e)}")
+
+
+class WarmConnectionPool:
+    """
+    Keeps ``size`` Gemini live connections open so sessions skip the handshake.
+
+    Connections are opened with the app's default live config, each on an
+    event loop from ``event_loop_pool``; a session that takes one is pinned
+    to that same loop. Every idle connection is pinged periodically and
+    recycled after ``max_idle`` seconds. Taking a connection immediately
+    starts opening its replacement.
+
+    Warm connections don't count against the session cap, but they do count
+    against the Gemini API's own concurrent-session quota.
+    """
+
+    def __init__(self, size: int = PREWARM_SESSIONS, max_idle: float = PREWARM_MAX_IDLE,
+                 health_interval: float = PREWARM_HEALTH_INTERVAL):
+        self.size = size
+        self.max_idle = max_idle
+        self.health_interval = health_interval
+        self.config: Optional[Dict[str, Any]] = None
+        self._idle: List[WarmConnection] = []
+        self._pending = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failed = 0
+
+    def start(self, config: Dict[str, Any]):
+        """Begin filling the pool with connections for ``config``; does nothing once started."""
+        if self.size <= 0 or IN_VERCEL or self.config is not None:
+            return
+        with self._lock:
+            if self.config is not None:
+                return
+            self.config = config
+        logger.info(f"Pre-warming {self.size} Gemini live connections")
+        self._replenish()
+
+    def acquire(self, config: Dict[str, Any]) -> Optional[WarmConnection]:
+        """Take a warm connection for ``config``, or None if none is ready."""
+        if self.config is None or config is not self.config:
+            return None
+        with self._lock:
+            warm = self._idle.pop() if self._idle else None
+            if warm is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if warm is not None:
+            # Runs before the session's run() on the same loop, so the
+            # watcher can't close the connection after it's handed over
+            warm.event_loop.call_soon(warm.watcher.cancel)
+        self._replenish()
+        return warm
+
+    def _replenish(self):
+        """Start opening connections until idle + pending reaches ``size``."""
+        with self._lock:
+            if self.config is None:
+                return  # not started, or stopped
+            missing = self.size - len(self._idle) - self._pending
+            self._pending += max(0, missing)
+        for _ in range(missing):
+            event_loop = event_loop_pool.pick()
+            event_loop.submit(self._open(event_loop))
+
+    async def _open(self, event_loop: EventLoopThread):
+        try:
+            client = gemini_clients.get()
+            session_ctx = client.aio.live.connect(
+                model=self.config["model"],
+                config=self.config["live_connect_config"]
+            )
+            session = await retry_async(
+                session_ctx.__aenter__, attempts=1, base_delay=RETRY_DELAY,
+                max_delay=RETRY_MAX_DELAY, breaker=upstream_circuit,
+                description="Gemini connection pre-warm"
+            )
+        except Exception as e:
+            logger.error(f"Failed to pre-warm Gemini connection: {str(e)}")
+            with self._lock:
+                self.failed += 1
+            # Don't spin against an unavailable upstream
+            await asyncio.sleep(max(self.health_interval, getattr(e, "retry_after", 0.0)))
+            with self._lock:
+                self._pending -= 1
+            self._replenish()
+            return
+
+        warm = WarmConnection(client, session_ctx, session, event_loop)
+        with self._lock:
+            self._pending -= 1
+            stopped = self.config is None
+            if not stopped:
+                warm.watcher = asyncio.create_task(self._watch(warm))
+                self._idle.append(warm)
+        if stopped:
+            await warm.close()
+
+    async def _watch(self, warm: WarmConnection):
+        """Health-check an idle connection until it's taken, fails or expires."""
+        while True:
+            await asyncio.sleep(min(self.health_interval, max(0.0, self.max_idle - warm.idle_seconds)))
+            expired = warm.idle_seconds >= self.max_idle
+            if expired or not await warm.is_healthy():
+                break
+
+        with self._lock:
+            if warm not in self._idle:
+                return
+            self._idle.remove(warm)
+            self.expired += 1
+        await warm.close()
+        self._replenish()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop refilling the pool and close the idle connections."""
+        with self._lock:
+            self.config = None
+            idle, self._idle = self._idle, []
+        closing = []
+        for warm in idle:
+            warm.event_loop.call_soon(warm.watcher.cancel)
+            closing.append(warm.event_loop.submit(warm.close()))
+        concurrent.futures.wait(closing, timeout=timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "target": self.size,
+                "idle": len(self._idle),
+                "pending": self._pending,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "failed": self.failed,
+            }
+
+
+warm_pool = WarmConnectionPool()
+
+
+# ==== Session Registry ====
+
+class InMemorySessionRegistry:
+    """
+    Records which worker owns each session, and where each worker can be reached.
+
+    This default only sees the sessions of its own process. Multi-worker
+    deployments need a registry that every worker shares, such as
+    SQLiteSessionRegistry on one machine. Anything with the same methods
+    can be plugged in.
+    """
+
+    def __init__(self):
+        self._owners: Dict[str, str] = {}
+        self._workers: Dict[str, str] = {}
+        self._lock = Lock()
+
+    def register_worker(self, worker_id: str, url: Optional[str]):
+        """Record this worker's base URL and forget sessions it owned in a previous life."""
+        with self._lock:
+            if url:
+                self._workers[worker_id] = url
+            for session_id in [s for s, w in self._owners.items() if w == worker_id]:
+                del self._owners[session_id]
+
+    def worker_url(self, worker_id: str) -> Optional[str]:
+        with self._lock:
+            return self._workers.get(worker_id)
+
+    def add(self, session_id: str, worker_id: str):
+        with self._lock:
+            self._owners[session_id] = worker_id
+
+    def owner(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            return self._owners.get(session_id)
+
+    def remove(self, session_id: str):
+        with self._lock:
+            self._owners.pop(session_id, None)
+
+    def counts_by_worker(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(collections.Counter(self._owners.values()))
+
+
+class SQLiteSessionRegistry(InMemorySessionRegistry):
+    """
+    A session registry in an SQLite file that every worker on the host can open.
+
+    Intended for multi-process deployments on one machine and for tests.
+    Lookups only happen when a request reaches a worker that doesn't own
+    the session, so they stay off the audio path.
+    """
+
+    def __init__(self, path: str):
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, url TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, worker_id TEXT, created_at REAL)")
+
+    def _query(self, sql: str, *params):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def register_worker(self, worker_id: str, url: Optional[str]):
+        if url:
+            self._query("INSERT OR REPLACE INTO workers VALUES (?, ?)", worker_id, url)
+        self._query("DELETE FROM sessions WHERE worker_id = ?", worker_id)
+
+    def worker_url(self, worker_id: str) -> Optional[str]:
+        rows = self._query("SELECT url FROM workers WHERE worker_id = ?", worker_id)
+        return rows[0][0] if rows else None
+
+    def add(self, session_id: str, worker_id: str):
+        self._query("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", session_id, worker_id, time.time())
+
+    def owner(self, session_id: str) -> Optional[str]:
+        rows = self._query("SELECT worker_id FROM sessions WHERE session_id = ?", session_id)
+        return rows[0][0] if rows else None
+
+    def remove(self, session_id: str):
+        self._query("DELETE FROM sessions WHERE session_id = ?", session_id)
+
+    def counts_by_worker(self) -> Dict[str, int]:
+        return dict(self._query("SELECT worker_id, COUNT(*) FROM sessions GROUP BY worker_id"))
+
+
+def create_session_registry(spec: str = SESSION_REGISTRY):
+    """Build the registry named by SESSION_REGISTRY: "memory" or "sqlite:///path/to/file.db"."""
+    if spec.startswith("sqlite:///"):
+        return SQLiteSessionRegistry(spec[len("sqlite:///"):])
+    if spec != "memory":
+        raise ValueError(f"Unknown SESSION_REGISTRY: {spec}")
+    return InMemorySessionRegistry()
+
+
+session_registry = create_session_registry()
+
+
+def _token_signature(payload: bytes) -> str:
+    return hmac.new(SESSION_SECRET.encode(), payload, hashlib.sha256).hexdigest()[:32]
+
+
+def make_session_token(session_id: str, worker_id: Optional[str] = None) -> str:
+    """A signed token naming a session and the worker that owns it."""
+    worker_id = worker_id or WORKER_ID
+    payload = base64.urlsafe_b64encode(f"{worker_id}/{session_id}".encode()).rstrip(b"=")
+    return f"{payload.decode()}.{_token_signature(payload)}"
+
+
+def parse_session_token(token: str):
+    """Return ``(worker_id, session_id)`` from a session token, or None if it is invalid."""
+    try:
+        payload, signature = token.rsplit(".", 1)
+        if not hmac.compare_digest(signature, _token_signature(payload.encode())):
+            return None
+        decoded = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)).decode()
+        worker_id, session_id = decoded.rsplit("/", 1)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return worker_id, session_id
+
+
+def owner_location(session_id: str, worker_id: Optional[str] = None) -> Optional[str]:
+    """
+    Base URL of the worker that owns ``session_id``, when that isn't this worker.
+
+    ``worker_id`` comes from a session token; without one the registry is
+    asked who the owner is.
+    """
+    owner = worker_id or session_registry.owner(session_id)
+    if owner is None or owner == WORKER_ID:
+        return None
+    return session_registry.worker_url(owner)
+
+
+# ==== Session Management ====
+
+class SessionLimitError(Exception):
+    """Raised when starting a session would exceed the concurrency cap."""
+
+
+class ServerDrainingError(Exception):
+    """Raised when starting a session on a worker that is shutting down."""
+
+
+class VoiceSession:
+    """A single caller's AudioLoop and the shared event loop that hosts it."""
+
+    def __init__(self, session_id: str, audio_loop: AudioLoop,
+                 event_loop: EventLoopThread):
+        self.session_id = session_id
+        self.audio_loop = audio_loop
+        self.audio_loop.session_id = session_id
+        self.event_loop = event_loop
+        self.task: Optional[concurrent.futures.Future] = None
+        self.created_at = time.time()
+        # time.monotonic() when the session last lost (or never had) a caller
+        self.orphaned_at: Optional[float] = time.monotonic()
+
+    @property
+    def subscribers(self):
+        return self.audio_loop.subscribers
+
+    def has_caller(self) -> bool:
+        """Whether a (non-monitor) client is attached to this session."""
+        return any(not client.is_monitor for client in list(self.subscribers))
+
+    def attach(self, client: "StreamClient"):
+        """Subscribe a client to this session's output."""
+        client.bind(self.event_loop.loop, on_failed=self.detach)
+        self.subscribers.add(client)
+        if not client.is_monitor:
+            self.orphaned_at = None
+        self.event_loop.call_soon(client.start)
+
+    def detach(self, client: "StreamClient"):
+        """Unsubscribe a client from this session's output."""
+        self.subscribers.discard(client)
+        if self.orphaned_at is None and not self.has_caller():
+            self.orphaned_at = time.monotonic()
+        self.event_loop.call_soon(client.stop)
+
+    def is_alive(self) -> bool:
+        """Whether the session's audio loop is still running."""
+        return self.task is not None and not self.task.done()
+
+    def start(self, config: Dict[str, Any]):
+        """Schedule the audio loop on its event loop."""
+        self.task = self.event_loop.submit(self.audio_loop.run(config))
+
+    def feed(self, item: Dict[str, Any]):
+        """
+        Queue an inbound audio chunk from a WebSocket thread.
+
+        With the ``block`` policy the calling thread waits for room, which
+        stops it reading from the socket and pushes back on the client.
+        """
+        tracer.stamp_chunk(item)
+        queue = self.audio_loop.out_queue
+        if queue.policy != QUEUE_POLICY_BLOCK:
+            self.event_loop.call_soon(self.audio_loop.ingest_nowait, item)
+            return
+
+        future = self.event_loop.submit(self.audio_loop.ingest(item))
+        try:
+            future.result(timeout=CONNECTION_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            queue.dropped += 1
+            logger.warning(f"Dropped audio for session {self.session_id}: upstream queue stayed full")
+
+    async def feed_async(self, item: Dict[str, Any]):
+        """Queue an inbound audio chunk from a coroutine, waiting for room like ``feed``."""
+        tracer.stamp_chunk(item)
+        if self.event_loop.loop is asyncio.get_running_loop():
+            await self.audio_loop.ingest(item)
+        else:
+            await asyncio.wrap_future(self.event_loop.submit(self.audio_loop.ingest(item)))
+
+    def pause(self) -> bool:
+        """Park the session from another thread; see AudioLoop.pause."""
+        return self.event_loop.run(self.audio_loop.pause(), timeout=CONNECTION_TIMEOUT)
+
+    def resume(self) -> bool:
+        """Wake a paused session from another thread."""
+        return self.event_loop.run(self.audio_loop.unpause(), timeout=CONNECTION_TIMEOUT)
+
+    def request_stop(self):
+        """Ask the audio loop to stop without waiting for it."""
+        self.event_loop.submit(self.audio_loop.stop())
+
+    def stop(self):
+        """Stop the audio loop and close the attached WebSocket clients."""
+        try:
+            # Bounded by the shutdown deadline; the margin covers the hop to the loop
+            self.event_loop.run(self.audio_loop.stop(), timeout=SHUTDOWN_TIMEOUT + 1.0)
+
+            # run() has unwound by now, or was cancelled
+            if self.task is not None:
+                self.task.result(timeout=1.0)
+        except Exception as e:
+            logger.error(f"Error stopping session {self.session_id}: {str(e)}")
+        finally:
+            for client in list(self.subscribers):
+                client.close()
+                self.detach(client)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "running": self.audio_loop.is_running,
+            "subscribers": [client.to_dict() for client in list(self.subscribers)],
+            "queues": self.audio_loop.queue_stats(),
+            "upstream": self.audio_loop.upstream_stats(),
+            "vad": self.audio_loop.vad.stats(),
+            "input": self.audio_loop.normalizer.stats(),
+            "barge_ins": self.audio_loop.barge_ins,
+            "paused": self.audio_loop.paused,
+            "pause_reason": self.audio_loop.pause_reason,
+            "pauses": self.audio_loop.pauses,
+            "prewarmed": self.audio_loop.prewarmed,
+            "connect_ms": self.audio_loop.connect_ms,
+            "created_at": self.created_at,
+        }
+
+
+class StreamClient:
+    """
+    A WebSocket subscribed to a voice session's output.
+
+    Outgoing messages go into a bounded per-client buffer that a sender
+    task drains on the session's event loop. A slow client only fills its
+    own buffer, and then loses its oldest audio. It never holds up the
+    session's other subscribers, and a client whose socket stalls is
+    dropped after ``SEND_TIMEOUT`` rather than tying up a send thread.
+    """
+
+    def __init__(self, ws, protocol: str = PROTOCOL_JSON, framing: Optional[str] = None,
+                 role: str = ROLE_CALLER, buffer_size: int = SUBSCRIBER_BUFFER_SIZE,
+                 codec: Optional[str] = None, input_format: Optional[str] = None):
+        self.ws = ws
+        self.role = role
+        self.last_seq: Optional[int] = None
+        self.missed_frames = 0
+        self.announced_turn = 0
+        self.dropped = 0
+        self._buffer = collections.deque()
+        self._buffer_size = max(1, buffer_size)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._sender: Optional[asyncio.Task] = None
+        self._on_failed = None
+        self.negotiate(protocol, framing, codec, input_format)
+
+    def negotiate(self, protocol: Optional[str], framing: Optional[str] = None,
+                  codec: Optional[str] = None, input_format: Optional[str] = None):
+        """
+        Set the protocol, framing, codec and input format, falling back to
+        the defaults for unknown values.
+        """
+        self.protocol = protocol if protocol in PROTOCOLS else PROTOCOL_JSON
+        self.codec = codec if codec in CODECS else CODEC_PCM
+        if self.codec != CODEC_PCM:
+            # Compressed audio can't be wrapped in per-chunk WAV files
+            self.framing = FRAMING_STREAM
+        else:
+            self.framing = framing if framing in FRAMINGS else DEFAULT_FRAMING[self.protocol]
+        # What the caller's audio is when it doesn't say: the codec's mime
+        # type plus parameters such as rate= and channels= from input_format
+        self.input_mime_type = CODEC_MIME_TYPES[self.codec]
+        if input_format:
+            params = str(input_format).partition(";")[2] if "/" in str(input_format) else str(input_format)
+            params = params.strip().strip(";")
+            try:
+                parse_pcm_format("audio/pcm;" + params)
+                self.input_mime_type += ";" + params
+            except ValueError as e:
+                logger.warning(f"Ignoring input_format {input_format}: {str(e)}")
+        # Announce the format again on the next chunk
+        self.announced_turn = 0
+
+    @property
+    def binary(self) -> bool:
+        return self.protocol == PROTOCOL_BINARY
+
+    @property
+    def is_monitor(self) -> bool:
+        return self.role == ROLE_MONITOR
+
+    def bind(self, loop: asyncio.AbstractEventLoop, on_failed=None):
+        """
+        Route posted messages through the given event loop from now on.
+
+        ``on_failed(client)`` is called on that loop if a send fails, to
+        unsubscribe the client from its session.
+        """
+        self._loop = loop
+        self._on_failed = on_failed
+
+    def start(self):
+        """Start the sender task. Must be called on the session's event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self._buffer:
+            self._wakeup.set()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def stop(self):
+        """Cancel the sender task. Must be called on the session's event loop."""
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = None
+        self._buffer.clear()
+
+    def enqueue(self, message, droppable: bool = True, on_sent=None):
+        """
+        Buffer a message for sending. Must be called on the session's event loop.
+
+        When the buffer is full the oldest droppable (audio) message is
+        discarded; control messages are never dropped. ``on_sent`` is called
+        once the message has been written; a ``None`` message sends nothing
+        and just runs ``on_sent`` after everything queued before it.
+        """
+        if len(self._buffer) >= self._buffer_size:
+            for i, (_, can_drop, _) in enumerate(self._buffer):
+                if can_drop:
+                    del self._buffer[i]
+                    self.dropped += 1
+                    break
+        self._buffer.append((message, droppable, on_sent))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def discard_audio(self) -> int:
+        """Drop the buffered audio messages, keeping control messages; returns the bytes dropped."""
+        kept = collections.deque(entry for entry in self._buffer if not entry[1])
+        dropped = sum(len(message) for message, droppable, _ in self._buffer if droppable)
+        self._buffer = kept
+        return dropped
+
+    def post(self, message):
+        """Send a control message from any thread, keeping it in order with buffered audio."""
+        if self._loop is None:
+            self.ws.send(message)
+        else:
+            self._loop.call_soon_threadsafe(self.enqueue, message, False)
+
+    async def _transmit(self, message):
+        # The socket is blocking, so keep it off the shared loop. The send
+        # threads are shared by every session, so one that stalls past
+        # SEND_TIMEOUT fails this client and its socket is shut down to give
+        # the thread back.
+        send = asyncio.get_running_loop().run_in_executor(get_send_executor(), self.ws.send, message)
+        try:
+            await asyncio.wait_for(send, SEND_TIMEOUT or None)
+        except asyncio.TimeoutError:
+            self._abort()
+            raise asyncio.TimeoutError(f"send stalled for more than {SEND_TIMEOUT}s") from None
+
+    def _abort(self):
+        """Shut down the socket under a stalled send so the thread blocked in it returns."""
+        sock = getattr(self.ws, "sock", None)
+        if sock is not None:
+            with contextlib.suppress(OSError):
+                sock.shutdown(socket.SHUT_RDWR)
+
+    async def _send_loop(self):
+        try:
+            while True:
+                if not self._buffer:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                message, _, on_sent = self._buffer.popleft()
+                if message is not None:
+                    await self._transmit(message)
+                if on_sent is not None:
+                    on_sent()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ERRORS.inc("client_send", type(e).__name__)
+            logger.error(f"Error sending to client, detaching it: {str(e)}")
+            self._buffer.clear()
+            if self._on_failed is not None:
+                self._on_failed(self)
+
+    def send_hello(self):
+        """Acknowledge the negotiated protocol and describe the output audio."""
+        self.post(json.dumps({
+            "type": "control",
+            "command": "hello",
+            "protocol": self.protocol,
+            "framing": self.framing,
+            "codec": self.codec,
+            "codecs": list(CODECS),
+            "input_format": self.input_mime_type,
+            "role": self.role,
+            "frame_header": {"format": FRAME_HEADER.format, "size": FRAME_HEADER.size},
+            "output": output_audio_format(self.codec),
+        }))
+
+    def track_sequence(self, seq: int):
+        """Count frames lost between consecutive inbound sequence numbers."""
+        if self.last_seq is not None:
+            gap = (seq - self.last_seq - 1) & 0xFFFFFFFF
+            if 0 < gap < 0x80000000:
+                self.missed_frames += gap
+        self.last_seq = seq
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "role": self.role,
+            "protocol": self.protocol,
+            "framing": self.framing,
+            "codec": self.codec,
+            "input_format": self.input_mime_type,
+            "buffered": len(self._buffer),
+            "dropped": self.dropped,
+            "missed_frames": self.missed_frames,
+        }
+
+
+def client_audio_item(session: "VoiceSession", client: StreamClient, message) -> Optional[Dict[str, Any]]:
+    """
+    Interpret one WebSocket message from a client.
+
+    Control messages are handled here. For audio, the queue item to feed
+    into the session is returned instead, so the caller can decide how to
+    wait for room in the queue. A malformed message is logged and dropped;
+    it does not end the call.
+    """
+    try:
+        return _client_audio_item(session, client, message)
+    except (ValueError, KeyError, TypeError) as e:
+        ERRORS.inc("client_message", type(e).__name__)
+        logger.warning(f"Dropping malformed message from client: {type(e).__name__}: {str(e)}")
+        return None
+
+
+def _client_audio_item(session: "VoiceSession", client: StreamClient, message) -> Optional[Dict[str, Any]]:
+    if client.is_monitor:
+        # Listen-in clients may only renegotiate their output format
+        if isinstance(message, str):
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                return None
+            if not isinstance(data, dict):
+                raise TypeError("JSON message is not an object")
+            if data.get("type") == "control" and data.get("command") == "hello":
+                client.negotiate(data.get("protocol"), data.get("framing"), data.get("codec"),
+                                 data.get("input_format"))
+                client.send_hello()
+        return None
+    
+    if isinstance(message, (bytes, bytearray)):
+        if client.binary:
+            frame_type, _, seq, payload = parse_frame(message)
+            if frame_type != FRAME_TYPE_AUDIO:
+                logger.warning(f"Ignoring binary frame of unknown type {frame_type}")
+                return None
+            client.track_sequence(seq)
+            audio_bytes = payload.tobytes()
+        else:
+            # Binary data without negotiation is raw audio in the client's codec
+            # (PCM for older clients)
+            audio_bytes = bytes(message)
+        return {"data": audio_bytes, "mime_type": client.input_mime_type}
+    
+    # Only binary frames carry raw audio; a text frame that isn't JSON is
+    # dropped (json.loads raises a ValueError)
+    data = json.loads(message)
+    if not isinstance(data, dict):
+        raise TypeError("JSON message is not an object")
+    
+    if data.get("type") == "audio":
+        # Decode base64 audio data; AudioLoop transcodes compressed formats
+        return {
+            "data": base64.b64decode(data["data"]),
+            "mime_type": data.get("format", client.input_mime_type)
+        }
+    
+    if data.get("type") == "control":
+        # Handle control messages
+        command = data.get("command")
+        if command == "stop":
+            logger.info(f"Client requested stop of voice session {session.session_id}")
+            session.request_stop()
+        elif command == "hello":
+            client.negotiate(data.get("protocol"), data.get("framing"), data.get("codec"),
+                             data.get("input_format"))
+            client.send_hello()
+    return None
+
+
+def handle_client_message(session: "VoiceSession", client: StreamClient, message):
+    """Route one WebSocket message from a client into its voice session."""
+    item = client_audio_item(session, client, message)
+    if item is not None and session.audio_loop.is_running:
+        session.feed(item)
+
+
+class SessionManager:
+    """
+    Owns every concurrent voice session, keyed by session id.
+
+    Each session runs its own AudioLoop, so callers no longer share (or
+    tear down) a single global session. The number of live sessions is
+    capped by ``max_sessions``. Sessions left without a caller for
+    ``orphan_timeout`` seconds are ended by a reaper thread, so abandoned
+    calls don't hold their slot and Gemini connection forever.
+    """
+
+    def __init__(self, max_sessions: int = MAX_CONCURRENT_SESSIONS,
+                 orphan_timeout: float = ORPHAN_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.orphan_timeout = orphan_timeout
+        self.draining = False
+        self._sessions: Dict[str, VoiceSession] = {}
+        self._lock = Lock()
+        self._reaper: Optional[Thread] = None
+
+    def _prune(self):
+        """Forget sessions whose audio loop has already exited. Caller holds the lock."""
+        for session_id, session in list(self._sessions.items()):
+            if session.task is not None and not session.is_alive():
+                logger.info(f"Removing finished voice session {session_id}")
+                del self._sessions[session_id]
+                session_registry.remove(session_id)
+
+    def create(self, config: Dict[str, Any],
+               options: Optional[Dict[str, Any]] = None) -> Optional[VoiceSession]:
+        """Create and start a new session, enforcing the concurrency cap."""
+        options = resolve_session_options(options)
+        if self.draining:
+            raise ServerDrainingError("This server is restarting, try again shortly")
+        retry_after = upstream_circuit.retry_after()
+        if retry_after > 0:
+            raise CircuitOpenError("Gemini API is unavailable, try again shortly", retry_after)
+        
+        with self._lock:
+            self._prune()
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionLimitError(
+                    f"Maximum of {self.max_sessions} concurrent voice sessions reached"
+                )
+
+            warm = warm_pool.acquire(config)
+            audio_loop = create_audio_loop(options, warm)
+            if audio_loop is None:
+                return None
+
+            event_loop = warm.event_loop if warm is not None else event_loop_pool.pick()
+            session = VoiceSession(uuid.uuid4().hex, audio_loop, event_loop)
+            self._sessions[session.session_id] = session
+            session_registry.add(session.session_id, WORKER_ID)
+
+        session.start(config)
+        logger.info(f"Voice session {session.session_id} started "
+                    f"({len(self._sessions)}/{self.max_sessions} active)")
+        self._start_reaper()
+        return session
+
+    def reap_orphans(self, now: Optional[float] = None) -> List[str]:
+        """End the sessions that have had no caller for ``orphan_timeout``; returns their ids."""
+        if self.orphan_timeout <= 0:
+            return []
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            orphans = [
+                session_id for session_id, session in self._sessions.items()
+                if session.orphaned_at is not None and now - session.orphaned_at >= self.orphan_timeout
+                and not session.has_caller()
+            ]
+        for session_id in orphans:
+            logger.info(f"Ending voice session {session_id}: no caller for {self.orphan_timeout:.0f}s")
+            self.terminate(session_id)
+        return orphans
 
-        except Exception as e:
-            logger.error(f"Error in run: {str(e)}")
-            logger.error(traceback.format_exc())
-        finally:
-            self.is_running = False
-            await self.stop()
+    def _start_reaper(self):
+        """Start the reaper thread on first use, so it runs in the serving process."""
+        if self.orphan_timeout <= 0 or self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = Thread(target=self._reap_forever, name="session-reaper", daemon=True)
+        self._reaper.start()
 
+    def _reap_forever(self):
+        interval = min(5.0, self.orphan_timeout / 2)
+        while True:
+            time.sleep(interval)
+            try:
+                self.reap_orphans()
+            except Exception as e:
+                logger.error(f"Error reaping orphaned sessions: {str(e)}")
 
-# ==== Flask Application Setup ====
+    def get(self, session_id: str) -> Optional[VoiceSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
 
-# Global variables for managing state
-audio_loop = None
-audio_thread = None
-session_lock = Lock()
-ws_clients = set()
+    def claim_unattached(self, client: StreamClient) -> Optional[VoiceSession]:
+        """
+        Attach a client to the newest live session that has no caller yet.
+
+        Used for clients that connect to /audio-stream without a session id,
+        which was the only way to connect before sessions were multiplexed.
+        """
+        with self._lock:
+            self._prune()
+            candidates = [s for s in self._sessions.values() if not s.has_caller()]
+            if not candidates:
+                return None
+            session = max(candidates, key=lambda s: s.created_at)
+            session.attach(client)
+            return session
+
+    def terminate(self, session_id: str) -> bool:
+        """Stop and remove a session. Returns False if it does not exist."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session_registry.remove(session_id)
+
+        session.stop()
+        logger.info(f"Voice session {session_id} terminated")
+        return True
+
+    def sessions(self) -> List[VoiceSession]:
+        with self._lock:
+            self._prune()
+            return list(self._sessions.values())
+
+    def __len__(self):
+        with self._lock:
+            self._prune()
+            return len(self._sessions)
 
-def create_gemini_client():
-    """Create and configure the Gemini API client."""
-    return genai.Client(
-        http_options={
-            "api_version": "v1beta",
-            "timeout": CONNECTION_TIMEOUT,
-        },
-        api_key=API_KEY,
-    )
 
-def create_audio_loop():
-    """Create a new AudioLoop instance."""
+session_manager = SessionManager()
+
+
+# ==== Route Logic ====
+# Framework-neutral handlers shared by the Flask app and the ASGI app.
+# Each returns a JSON payload and an HTTP status code.
+
+def start_voice_result(config: Dict[str, Any], data: Dict[str, Any],
+                       scheme: str, host: str):
+    """Create a session for /start_voice. Returns (payload, status, headers)."""
     if IN_VERCEL:
-        logger.info("Limited audio functionality in serverless environment")
-        return None
+        return {
+            "status": "started",
+            "vercel": True,
+            "info": "Limited functionality in serverless environment."
+        }, 200, {}
+    
+    try:
+        session = session_manager.create(config, data.get("options"))
+    except SessionLimitError as e:
+        logger.warning(str(e))
+        return {"status": "error", "message": str(e)}, 429, {}
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400, {}
+    except CircuitOpenError as e:
+        logger.warning("Rejected /start_voice while the upstream circuit is open")
+        return ({"status": "error", "message": str(e)}, 503,
+                {"Retry-After": str(math.ceil(e.retry_after))})
+    except ServerDrainingError as e:
+        return {"status": "error", "message": str(e)}, 503, {"Retry-After": "1"}
+    except Exception as e:
+        logger.error(f"Error starting voice service: {str(e)}")
+        return {"status": "error", "message": str(e)}, 200, {}
+    
+    # The WebSocket must reach this worker, which owns the session
+    if WORKER_URL:
+        scheme, host = WORKER_URL.replace("http", "ws", 1).rstrip("/").split("://", 1)
+    token = make_session_token(session.session_id)
+    
+    # Return the session id and WebSocket info in the response
+    return {
+        "status": "started",
+        "session_id": session.session_id,
+        "session_token": token,
+        "worker_id": WORKER_ID,
+        "websocket": {
+            "url": f"{scheme}://{host}/audio-stream?session_id={session.session_id}&session_token={token}",
+            "protocol": "audio-stream"
+        }
+    }, 200, {}
+
+
+def resolve_session_reference(session_id: Optional[str], session_token: Optional[str]):
+    """
+    Work out which session a request refers to.
+
+    Returns ``(session_id, redirect_base)``. ``redirect_base`` is the owning
+    worker's URL when the session lives on another worker, and None when it
+    is ours or unknown. Raises ValueError for a bad session token.
+    """
+    worker_id = None
+    if session_token:
+        parsed = parse_session_token(session_token)
+        if parsed is None:
+            raise ValueError("Invalid session_token")
+        worker_id, session_id = parsed
+    if not session_id or session_manager.get(session_id) is not None:
+        return session_id, None
+    return session_id, owner_location(session_id, worker_id)
+
+
+def redirect_result(base_url: str, path: str):
+    """A 307 response sending the client to the worker that owns its session."""
+    location = base_url.rstrip("/") + path
+    return {"status": "redirect", "location": location}, 307, {"Location": location}
+
+
+def terminate_voice_result(session_id: Optional[str], session_token: Optional[str] = None,
+                           path: str = "/terminate_voice"):
+    """Stop a session for /terminate_voice. Blocks until it has shut down."""
+    if IN_VERCEL:
+        return {"status": "terminated", "vercel": True}, 200
+    
+    try:
+        session_id, owner_url = resolve_session_reference(session_id, session_token)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+    if owner_url:
+        return redirect_result(owner_url, path)
+    
+    if not session_id:
+        # Without a session id we can only act on an unambiguous target,
+        # which keeps single-session clients working as before.
+        sessions = session_manager.sessions()
+        if len(sessions) > 1:
+            return {
+                "status": "error",
+                "message": "session_id is required when several sessions are active"
+            }, 400
+        if not sessions:
+            return {"status": "terminated"}, 200
+        session_id = sessions[0].session_id
+    
+    if not session_manager.terminate(session_id):
+        return {
+            "status": "error",
+            "message": f"Unknown session_id: {session_id}"
+        }, 404
         
-    client = create_gemini_client()
-    return AudioLoop(client)
+    return {"status": "terminated", "session_id": session_id}, 200
+
+
+def _session_for_action(session_id: Optional[str], session_token: Optional[str], path: str):
+    """
+    Find the session a /pause_voice or /resume_voice request is about.
+
+    Returns ``(session, None)``, or ``(None, response)`` for an error or a
+    redirect. Without a session id the only active session is used.
+    """
+    try:
+        session_id, owner_url = resolve_session_reference(session_id, session_token)
+    except ValueError as e:
+        return None, ({"status": "error", "message": str(e)}, 400)
+    if owner_url:
+        return None, redirect_result(owner_url, path)
+    
+    if not session_id:
+        sessions = session_manager.sessions()
+        if len(sessions) > 1:
+            return None, ({
+                "status": "error",
+                "message": "session_id is required when several sessions are active"
+            }, 400)
+        if not sessions:
+            return None, ({"status": "not_running"}, 200)
+        return sessions[0], None
+    
+    session = session_manager.get(session_id)
+    if session is None:
+        return None, ({
+            "status": "error",
+            "message": f"Unknown session_id: {session_id}"
+        }, 404)
+    return session, None
+
+
+def pause_voice_result(session_id: Optional[str], session_token: Optional[str] = None,
+                       path: str = "/pause_voice"):
+    """Park a session for /pause_voice (and /stop_voice), keeping its Gemini connection."""
+    if IN_VERCEL:
+        return {"status": "paused", "vercel": True}, 200
+    
+    session, error = _session_for_action(session_id, session_token, path)
+    if error:
+        return error
+    try:
+        session.pause()
+    except Exception as e:
+        logger.error(f"Error pausing voice session {session.session_id}: {str(e)}")
+        return {"status": "error", "message": str(e)}, 500
+    return {"status": "paused", "session_id": session.session_id}, 200
+
+
+def resume_voice_result(session_id: Optional[str], session_token: Optional[str] = None,
+                        path: str = "/resume_voice"):
+    """Wake a paused session for /resume_voice."""
+    if IN_VERCEL:
+        return {"status": "resumed", "vercel": True}, 200
+    
+    session, error = _session_for_action(session_id, session_token, path)
+    if error:
+        return error
+    try:
+        resumed = session.resume()
+    except Exception as e:
+        logger.error(f"Error resuming voice session {session.session_id}: {str(e)}")
+        return {"status": "error", "message": str(e)}, 500
+    # A session that wasn't paused is left as it was
+    return {"status": "resumed" if resumed else "running", "session_id": session.session_id}, 200
+
+
+def status_result(session_id: Optional[str], session_token: Optional[str] = None,
+                  path: str = "/status"):
+    """Build the /status payload, for the whole server or for one session."""
+    try:
+        session_id, owner_url = resolve_session_reference(session_id, session_token)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+    if owner_url:
+        return redirect_result(owner_url, path)
+    if session_id:
+        session = session_manager.get(session_id)
+        if session is None:
+            return {
+                "status": "error",
+                "message": f"Unknown session_id: {session_id}"
+            }, 404
+        return dict(session.to_dict(), status="ok"), 200
+    
+    sessions = session_manager.sessions()
+    queues = {}
+    upstream = {"chunks": 0, "sends": 0}
+    for session in sessions:
+        for name, stats in session.audio_loop.queue_stats().items():
+            totals = queues.setdefault(name, {"depth": 0, "dropped": 0, "coalesced": 0})
+            for key in totals:
+                totals[key] += stats[key]
+        for key, value in session.audio_loop.upstream_stats().items():
+            upstream[key] = upstream.get(key, 0) + value
+    
+    return {
+        "status": "ok",
+        "vercel": IN_VERCEL,
+        "version": "1.0.0",
+        "worker": {
+            "id": WORKER_ID,
+            "pid": os.getpid(),
+            "draining": session_manager.draining
+        },
+        "sessions": {
+            "active": len(sessions),
+            "max": session_manager.max_sessions,
+            "by_worker": session_registry.counts_by_worker()
+        },
+        "queues": queues,
+        "upstream": upstream,
+        "prewarm": warm_pool.stats(),
+        "clients": gemini_clients.stats(),
+        "upstream_circuit": upstream_circuit.stats(),
+        "tracing": tracer.stats()
+    }, 200
+
+
+def metrics_result() -> str:
+    """The /metrics payload in the Prometheus text exposition format."""
+    return metrics.render()
+
+
+def stream_client_options(args) -> Dict[str, Any]:
+    """StreamClient keyword arguments from /audio-stream query parameters."""
+    return {
+        "protocol": args.get("protocol", PROTOCOL_JSON),
+        "framing": args.get("framing"),
+        "codec": args.get("codec"),
+        "input_format": args.get("input_format"),
+        "role": ROLE_MONITOR if args.get("mode") == ROLE_MONITOR else ROLE_CALLER,
+    }
+
+
+def attach_stream_client(client: StreamClient, args, config: Dict[str, Any]):
+    """
+    Find or create the session an /audio-stream client belongs to and attach it.
 
-def run_async_task(coro_func, *args, **kwargs):
-    """Run an async function in a new event loop safely."""
+    Returns ``(session, None)`` on success or ``(None, error)``. The error is
+    a message, or a redirect control message for a session that lives on
+    another worker.
+    """
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(coro_func(*args, **kwargs))
-    finally:
-        loop.close()
+        session_id, owner_url = resolve_session_reference(
+            args.get("session_id"), args.get("session_token")
+        )
+    except ValueError as e:
+        return None, str(e)
+    if owner_url:
+        query = urllib.parse.urlencode(list(args.items()))
+        return None, {
+            "type": "control",
+            "command": "redirect",
+            "url": owner_url.replace("http", "ws", 1).rstrip("/") + "/audio-stream?" + query,
+        }
+    
+    if client.is_monitor and (
+        not MONITOR_TOKEN or not session_id
+        or not hmac.compare_digest(str(args.get("token") or "").encode(), MONITOR_TOKEN.encode())
+    ):
+        logger.warning("Rejected monitor connection")
+        return None, "Monitor mode needs a session_id and a valid token"
+    
+    if session_id:
+        session = session_manager.get(session_id)
+        if session is None:
+            logger.warning(f"Client requested unknown voice session {session_id}")
+            return None, f"Unknown session_id: {session_id}"
+        session.attach(client)
+        return session, None
+    
+    # Older clients don't pass a session id: attach them to the
+    # newest session nobody has claimed yet, or start one.
+    session = session_manager.claim_unattached(client)
+    if session is None:
+        logger.warning("Client connected but no active audio session. Starting one.")
+        try:
+            session = session_manager.create(config)
+        except (SessionLimitError, CircuitOpenError, ServerDrainingError) as e:
+            return None, str(e)
+        if session is None:
+            return None, "Voice sessions are not available in this environment"
+        session.attach(client)
+    return session, None
+
+
+def stream_error_message(error) -> Dict[str, Any]:
+    """The message sent to an /audio-stream client that couldn't be attached."""
+    if isinstance(error, dict):
+        return error
+    return {"type": "error", "message": error}
+
+
+def home_page_context(scheme: str, host: str, headers) -> Dict[str, Any]:
+    """Template variables for the documentation page."""
+    # Get the base URL from the request
+    if headers.get('X-Forwarded-Host'):
+        # For Vercel and other proxy setups
+        proto = headers.get('X-Forwarded-Proto', 'https')
+        base_url = f"{proto}://{headers.get('X-Forwarded-Host')}"
+    else:
+        # For local development
+        base_url = f"{scheme}://{host}"
+    return {"base_url": base_url, "max_sessions": session_manager.max_sessions}
+
 
 def create_app():
     """Create and configure the Flask application."""
@@ -799,217 +4205,515 @@ def create_app():
     
     # Store the Gemini configuration in app config
     app.config['GEMINI_CONFIG'] = get_live_connect_config()
+    session_registry.register_worker(WORKER_ID, WORKER_URL)
+    
+    @app.before_request
+    def start_warm_pool():
+        # Not at import: the connections must open in the process that
+        # serves, after any fork, and on its own event loops
+        warm_pool.start(app.config['GEMINI_CONFIG'])
+    
+    def _json_response(payload, status=200, headers=None):
+        response = jsonify(payload)
+        response.headers.update(headers or {})
+        return response, status
     
     # === Routes ===
     
     @app.route('/')
     def home():
         """Home page with API documentation."""
-        # Get the base URL from the request
-        if request.headers.get('X-Forwarded-Host'):
-            # For Vercel and other proxy setups
-            proto = request.headers.get('X-Forwarded-Proto', 'https')
-            host = request.headers.get('X-Forwarded-Host')
-            base_url = f"{proto}://{host}"
-        else:
-            # For local development
-            base_url = f"{request.scheme}://{request.host}"
-            
         return render_template_string(
             HOME_PAGE_TEMPLATE,
-            base_url=base_url
+            **home_page_context(request.scheme, request.host, request.headers)
         )
     
+    def _session_reference_from_request():
+        """Read the session id and token from the JSON body or the query string."""
+        data = request.get_json(silent=True) or {}
+        return (data.get("session_id") or request.args.get("session_id"),
+                data.get("session_token") or request.args.get("session_token"))
+
     @sock.route('/audio-stream')
     def audio_stream_socket(ws):
         """WebSocket handler for audio streaming."""
-        global audio_loop
-        global ws_clients
-        
         logger.info("New WebSocket client connected for audio streaming")
         
-        # Add the WebSocket to our clients set
-        ws_clients.add(ws)
+        session = None
+        client = None
         
         try:
-            # Check if we have an active audio loop
-            if not audio_loop or not audio_loop.is_running:
-                logger.warning("Client connected but no active audio session. Starting one.")
-                
-                # Start an audio session if none exists
-                if not audio_loop:
-                    audio_loop = create_audio_loop()
-                    
-                    # Start the audio loop in a new thread
-                    global audio_thread
-                    audio_thread = Thread(
-                        target=lambda: run_async_task(audio_loop.run, app.config['GEMINI_CONFIG']),
-                        daemon=True
-                    )
-                    audio_thread.start()
+            client = StreamClient(ws, **stream_client_options(request.args))
+            session, error = attach_stream_client(client, request.args, app.config['GEMINI_CONFIG'])
+            if error:
+                ws.send(json.dumps(stream_error_message(error)))
+                return
+            
+            if client.binary or client.framing == FRAMING_STREAM or client.is_monitor:
+                client.send_hello()
+            ws_clients.add(client)
             
             # Process WebSocket messages
             while True:
                 message = ws.receive()
                 
                 if message:
-                    try:
-                        # Try to parse as JSON
-                        data = json.loads(message)
-                        
-                        if data.get("type") == "audio":
-                            # Decode base64 audio data
-                            audio_bytes = base64.b64decode(data["data"])
-                            
-                            if audio_loop and audio_loop.is_running:
-                                asyncio.run(audio_loop.out_queue.put({
-                                    "data": audio_bytes,
-                                    "mime_type": data.get("format", "audio/pcm")
-                                }))
-                        
-                        elif data.get("type") == "control":
-                            # Handle control messages
-                            if data.get("command") == "stop":
-                                logger.info("Client requested audio session stop")
-                                if audio_loop:
-                                    asyncio.run(audio_loop.stop())
-                    except json.JSONDecodeError:
-                        # If not JSON, treat as raw audio data
-                        if audio_loop and audio_loop.is_running:
-                            asyncio.run(audio_loop.out_queue.put({
-                                "data": message,
-                                "mime_type": "audio/pcm"
-                            }))
+                    handle_client_message(session, client, message)
         except Exception as e:
             logger.error(f"WebSocket error: {str(e)}")
         finally:
-            if ws in ws_clients:
-                ws_clients.remove(ws)
+            if session is not None:
+                session.detach(client)
+            ws_clients.discard(client)
             logger.info("WebSocket client disconnected")
     
     @app.route('/start_voice', methods=['POST', 'OPTIONS'])
     def start_voice():
-        """Start voice interaction with Gemini AI."""
-        global audio_loop
-        global audio_thread
-        
+        """Start a new voice session with Gemini AI."""
         # Handle CORS preflight request
         if request.method == 'OPTIONS':
             response = app.make_default_options_response()
             response.headers['Access-Control-Allow-Methods'] = 'POST'
             return response
-            
-        if IN_VERCEL:
-            return jsonify({
-                "status": "started",
-                "vercel": True,
-                "info": "Limited functionality in serverless environment."
-            })
         
-        with session_lock:
-            # If there's an existing session, terminate it first
-            if audio_loop:
-                try:
-                    run_async_task(audio_loop.stop)
-                    logger.info("Existing voice session terminated before starting new one")
-                    
-                    # Wait for the thread to finish
-                    if audio_thread and audio_thread.is_alive():
-                        audio_thread.join(timeout=2.0)
-                        
-                except Exception as e:
-                    logger.error(f"Error terminating existing voice service: {str(e)}")
-                finally:
-                    # Force cleanup of resources
-                    audio_loop = None
-                    audio_thread = None
-                    # Small delay to ensure clean startup
-                    time.sleep(0.5)
-            
-            try:
-                # Create a new audio loop
-                audio_loop = create_audio_loop()
-                
-                # Start the audio loop in a new thread
-                audio_thread = Thread(
-                    target=lambda: run_async_task(audio_loop.run, app.config['GEMINI_CONFIG']),
-                    daemon=True
-                )
-                audio_thread.start()
-                
-                logger.info("Voice session started")
-                
-                # Return WebSocket info in the response
-                return jsonify({
-                    "status": "started",
-                    "websocket": {
-                        "url": f"wss://{request.host}/audio-stream" if request.is_secure else f"ws://{request.host}/audio-stream",
-                        "protocol": "audio-stream"
-                    }
-                })
-            except Exception as e:
-                logger.error(f"Error starting voice service: {str(e)}")
-                return jsonify({"status": "error", "message": str(e)})
+        scheme = "wss" if request.is_secure else "ws"
+        return _json_response(*start_voice_result(
+            app.config['GEMINI_CONFIG'], request.get_json(silent=True) or {},
+            scheme, request.host
+        ))
 
     @app.route('/terminate_voice', methods=['POST', 'OPTIONS'])
     def terminate_voice():
-        """Completely stop the voice interaction and clean up resources."""
-        global audio_loop
-        global audio_thread
-        global ws_clients
+        """Completely stop a voice session and clean up its resources."""
+        # Handle CORS preflight request
+        if request.method == 'OPTIONS':
+            response = app.make_default_options_response()
+            response.headers['Access-Control-Allow-Methods'] = 'POST'
+            return response
         
+        return _json_response(*terminate_voice_result(
+            *_session_reference_from_request(), path=request.full_path.rstrip("?")
+        ))
+
+    @app.route('/pause_voice', methods=['POST', 'OPTIONS'])
+    @app.route('/stop_voice', methods=['POST', 'OPTIONS'])
+    def pause_voice():
+        """Pause a voice session without closing its Gemini connection."""
         # Handle CORS preflight request
         if request.method == 'OPTIONS':
             response = app.make_default_options_response()
             response.headers['Access-Control-Allow-Methods'] = 'POST'
             return response
-            
-        if IN_VERCEL:
-            return jsonify({"status": "terminated", "vercel": True})
         
-        with session_lock:
-            if audio_loop:
-                try:
-                    # Stop the audio loop
-                    run_async_task(audio_loop.stop)
-                    logger.info("Voice session terminated")
-                    
-                    # Wait for the thread to finish
-                    if audio_thread and audio_thread.is_alive():
-                        audio_thread.join(timeout=2.0)
-                        
-                    # Close any active WebSocket connections
-                    for ws in list(ws_clients):
-                        try:
-                            ws.close()
-                        except:
-                            pass
-                    ws_clients.clear()
-                        
-                except Exception as e:
-                    logger.error(f"Error terminating voice service: {str(e)}")
-                finally:
-                    # Clean up resources
-                    audio_loop = None
-                    audio_thread = None
-            
-        return jsonify({"status": "terminated"})
+        return _json_response(*pause_voice_result(
+            *_session_reference_from_request(), path=request.full_path.rstrip("?")
+        ))
+
+    @app.route('/resume_voice', methods=['POST', 'OPTIONS'])
+    def resume_voice():
+        """Resume a paused voice session on its existing Gemini connection."""
+        # Handle CORS preflight request
+        if request.method == 'OPTIONS':
+            response = app.make_default_options_response()
+            response.headers['Access-Control-Allow-Methods'] = 'POST'
+            return response
+        
+        return _json_response(*resume_voice_result(
+            *_session_reference_from_request(), path=request.full_path.rstrip("?")
+        ))
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus metrics for this worker process."""
+        return Response(metrics_result(), content_type=PROMETHEUS_CONTENT_TYPE)
 
     @app.route('/status')
     def status():
-        """Get the status of the API."""
-        return jsonify({
-            "status": "ok",
-            "vercel": IN_VERCEL,
-            "version": "1.0.0"
-        })
+        """Get the status of the API, or of one session with ?session_id=."""
+        return _json_response(*status_result(
+            request.args.get("session_id"), request.args.get("session_token"),
+            request.full_path.rstrip("?")
+        ))
     
     return app
 
 
+# ==== ASGI Application ====
+
+class AsyncStreamClient(StreamClient):
+    """
+    A StreamClient for an ASGI (Starlette) WebSocket.
+
+    Sends are awaited on the loop that owns the WebSocket instead of being
+    pushed through the blocking send thread pool.
+    """
+
+    def __init__(self, ws, **kwargs):
+        super().__init__(ws, **kwargs)
+        self._ws_loop = asyncio.get_running_loop()
+
+    async def _send_now(self, message):
+        if isinstance(message, bytes):
+            await self.ws.send_bytes(message)
+        else:
+            await self.ws.send_text(message)
+
+    async def _transmit(self, message):
+        if asyncio.get_running_loop() is self._ws_loop:
+            await self._send_now(message)
+        else:
+            # Session pinned to another loop (e.g. a pre-warmed connection)
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self._send_now(message), self._ws_loop)
+            )
+
+    def post(self, message):
+        if self._loop is None:
+            self._ws_loop.call_soon_threadsafe(asyncio.ensure_future, self._send_now(message))
+        else:
+            super().post(message)
+
+    def close(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self.ws.close(), self._ws_loop)
+        except Exception:
+            pass
+
+
+def create_asgi_app():
+    """
+    Create the ASGI (Starlette) application.
+
+    It serves the same routes as ``create_app()``. WebSockets are handled
+    natively on the server's event loop, so an idle caller costs a
+    coroutine instead of a blocked worker thread, and new sessions run
+    their AudioLoop on that same loop. Run it with e.g.
+    ``uvicorn app:create_asgi_app --factory``.
+    """
+    if not STARLETTE_AVAILABLE:
+        raise RuntimeError("The ASGI server mode needs the 'starlette' package")
+    
+    gemini_config = get_live_connect_config()
+    home_template = jinja2.Template(HOME_PAGE_TEMPLATE)
+    
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # Host new sessions on the server's own loop
+        event_loop_pool.attach(asyncio.get_running_loop())
+        session_registry.register_worker(WORKER_ID, WORKER_URL)
+        warm_pool.start(gemini_config)
+        yield
+    
+    def _json_response(payload, status=200, headers=None):
+        return JSONResponse(payload, status_code=status, headers=headers)
+    
+    def _full_path(request) -> str:
+        query = request.url.query
+        return request.url.path + (f"?{query}" if query else "")
+    
+    async def home(request):
+        """Home page with API documentation."""
+        return HTMLResponse(home_template.render(
+            **home_page_context(request.url.scheme, request.url.netloc, request.headers)
+        ))
+    
+    async def start_voice(request):
+        """Start a new voice session with Gemini AI."""
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        scheme = "wss" if request.url.scheme == "https" else "ws"
+        return _json_response(*start_voice_result(
+            gemini_config, data if isinstance(data, dict) else {}, scheme, request.url.netloc
+        ))
+    
+    async def _session_reference(request):
+        """Read the session id and token from the JSON body or the query string."""
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        data = data if isinstance(data, dict) else {}
+        return (data.get("session_id") or request.query_params.get("session_id"),
+                data.get("session_token") or request.query_params.get("session_token"))
+    
+    async def terminate_voice(request):
+        """Completely stop a voice session and clean up its resources."""
+        session_id, session_token = await _session_reference(request)
+        # Stopping waits on the session's loop, which may be this one
+        return _json_response(*await run_in_threadpool(
+            terminate_voice_result, session_id, session_token, _full_path(request)
+        ))
+    
+    async def pause_voice(request):
+        """Pause a voice session without closing its Gemini connection."""
+        session_id, session_token = await _session_reference(request)
+        # Like terminate_voice, this waits on the session's loop
+        return _json_response(*await run_in_threadpool(
+            pause_voice_result, session_id, session_token, _full_path(request)
+        ))
+    
+    async def resume_voice(request):
+        """Resume a paused voice session on its existing Gemini connection."""
+        session_id, session_token = await _session_reference(request)
+        return _json_response(*await run_in_threadpool(
+            resume_voice_result, session_id, session_token, _full_path(request)
+        ))
+    
+    async def metrics_endpoint(request):
+        """Prometheus metrics for this worker process."""
+        return PlainTextResponse(metrics_result(), media_type=PROMETHEUS_CONTENT_TYPE)
+    
+    async def status(request):
+        """Get the status of the API, or of one session with ?session_id=."""
+        return _json_response(*status_result(
+            request.query_params.get("session_id"), request.query_params.get("session_token"),
+            _full_path(request)
+        ))
+    
+    async def audio_stream_socket(websocket):
+        """WebSocket handler for audio streaming."""
+        await websocket.accept()
+        logger.info("New WebSocket client connected for audio streaming")
+        
+        args = websocket.query_params
+        client = AsyncStreamClient(websocket, **stream_client_options(args))
+        session = None
+        
+        try:
+            session, error = attach_stream_client(client, args, gemini_config)
+            if error:
+                await websocket.send_text(json.dumps(stream_error_message(error)))
+                await websocket.close()
+                return
+            
+            if client.binary or client.framing == FRAMING_STREAM or client.is_monitor:
+                client.send_hello()
+            ws_clients.add(client)
+            
+            # Process WebSocket messages
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if data is None:
+                    data = message.get("text")
+                if data:
+                    item = client_audio_item(session, client, data)
+                    if item is not None and session.audio_loop.is_running:
+                        await session.feed_async(item)
+        except Exception as e:
+            logger.error(f"WebSocket error: {str(e)}")
+        finally:
+            if session is not None:
+                session.detach(client)
+            ws_clients.discard(client)
+            logger.info("WebSocket client disconnected")
+    
+    asgi_app = Starlette(
+        routes=[
+            Route('/', home),
+            Route('/start_voice', start_voice, methods=['POST']),
+            Route('/terminate_voice', terminate_voice, methods=['POST']),
+            Route('/pause_voice', pause_voice, methods=['POST']),
+            Route('/stop_voice', pause_voice, methods=['POST']),
+            Route('/resume_voice', resume_voice, methods=['POST']),
+            Route('/status', status),
+            Route('/metrics', metrics_endpoint),
+            WebSocketRoute('/audio-stream', audio_stream_socket),
+        ],
+        middleware=[Middleware(
+            CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
+        )],
+        lifespan=lifespan,
+    )
+    asgi_app.state.gemini_config = gemini_config
+    return asgi_app
+
+
 # Entry point for Vercel deployment
 app = create_app()
 
+# ==== Multi-process Launcher ====
+
+def _listen_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    """A listening TCP socket, optionally shared between processes with SO_REUSEPORT."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(index: int, host: str, port: int, advertise_host: str,
+                shared_sock: Optional[socket.socket], drain_timeout: float):
+    """
+    Body of one forked worker process.
+
+    The worker accepts new connections on the shared port and also listens
+    on a private port, which is registered so requests for its sessions can
+    be redirected back to it. Without ``advertise_host`` the private port
+    only listens on loopback and clients keep the URL they called us on;
+    with it, the port listens on ``host`` and becomes this worker's
+    WORKER_URL. On SIGTERM the worker stops accepting on the shared port
+    and refuses new sessions. It then waits up to ``drain_timeout`` seconds
+    for its calls to end before terminating the rest.
+    """
+    global WORKER_ID, WORKER_URL, session_registry
+    from werkzeug.serving import make_server
+
+    if shared_sock is None:
+        shared_sock = _listen_socket(host, port, reuse_port=True)
+    private_host = host if advertise_host else "127.0.0.1"
+    private_sock = _listen_socket(private_host, 0, reuse_port=False)
+    private_port = private_sock.getsockname()[1]
+    private_url = f"http://{advertise_host or private_host}:{private_port}"
+
+    WORKER_ID = f"{os.getenv('WORKER_ID', socket.gethostname())}-{os.getpid()}"
+    if advertise_host:
+        WORKER_URL = private_url
+    # SQLite handles must not cross a fork
+    session_registry = create_session_registry(SESSION_REGISTRY)
+    session_registry.register_worker(WORKER_ID, private_url)
+    warm_pool.start(app.config['GEMINI_CONFIG'])
+
+    servers = [
+        make_server(host, port, app, threaded=True, fd=shared_sock.fileno()),
+        make_server(private_host, private_port, app, threaded=True, fd=private_sock.fileno()),
+    ]
+    for server in servers:
+        Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Worker {index} ({WORKER_ID}) serving on port {port}, private port {private_port}")
+
+    stopping = concurrent.futures.Future()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.done() or stopping.set_result(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor handles Ctrl+C
+    stopping.result()
+
+    # Drain: leave the shared port to the other workers, keep the private one
+    logger.info(f"Worker {WORKER_ID} draining {len(session_manager)} sessions")
+    session_manager.draining = True
+    servers[0].shutdown()
+    servers[0].server_close()
+    shared_sock.close()
+    deadline = time.monotonic() + drain_timeout
+    while len(session_manager) and time.monotonic() < deadline:
+        time.sleep(0.5)
+    for session in session_manager.sessions():
+        session_manager.terminate(session.session_id)
+    servers[1].shutdown()
+    logger.info(f"Worker {WORKER_ID} stopped")
+
+
+def serve_workers(host: str = "0.0.0.0", port: int = PORT, workers: Optional[int] = None,
+                  advertise_host: Optional[str] = None, drain_timeout: float = DRAIN_TIMEOUT):
+    """
+    Fork ``workers`` server processes that share one listening port.
+
+    Each worker is a separate process, so base64/JSON/WAV work for
+    different sessions runs on different cores. With SO_REUSEPORT every
+    worker binds the port itself and the kernel spreads connections
+    across them. Without it, the workers share a socket this process
+    opened.
+
+    The supervisor handles these signals:
+    - SIGHUP: rolling restart. Each worker is replaced and then drained.
+    - SIGTERM/SIGINT: drain every worker and exit.
+    - A worker that dies unexpectedly is replaced.
+    """
+    global SESSION_REGISTRY
+    workers = workers or os.cpu_count() or 1
+    if SESSION_REGISTRY == "memory" and workers > 1:
+        # Workers must see each other's sessions to redirect between them
+        registry_path = os.path.join(tempfile.gettempdir(), f"voice-sessions-{port}.db")
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(registry_path + suffix)
+        SESSION_REGISTRY = f"sqlite:///{registry_path}"
+    if workers > 1 and not advertise_host:
+        logger.warning("No advertise host set: redirects between workers only reach local clients")
+    reuse_port = hasattr(socket, "SO_REUSEPORT")
+    shared_sock = None if reuse_port else _listen_socket(host, port, reuse_port=False)
+
+    # Forked children must not inherit running event loops or open connections
+    warm_pool.stop()
+    event_loop_pool.stop()
+
+    def spawn(index: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(index, host, port, advertise_host, shared_sock, drain_timeout)
+            except Exception:
+                logger.error(traceback.format_exc())
+                code = 1
+            finally:
+                os._exit(code)
+        return pid
+
+    children = {spawn(index): index for index in range(workers)}
+    retiring = set()
+    state = {"stopping": False, "restart": False}
+
+    def on_stop(*_):
+        state["stopping"] = True
+    
+    def on_restart(*_):
+        state["restart"] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_restart)
+    logger.info(f"Started {workers} workers on port {port} "
+                f"({'SO_REUSEPORT' if reuse_port else 'shared socket'})")
+
+    while children:
+        if state["stopping"]:
+            state["stopping"] = None  # signal the workers only once
+            for pid in list(children):
+                os.kill(pid, signal.SIGTERM)
+        if state["restart"]:
+            state["restart"] = False
+            logger.info("Rolling restart of all workers")
+            for pid, index in list(children.items()):
+                children[spawn(index)] = index
+                retiring.add(pid)
+                os.kill(pid, signal.SIGTERM)
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        index = children.pop(pid, None)
+        if pid in retiring or state["stopping"] is None or index is None:
+            retiring.discard(pid)
+            continue
+        logger.warning(f"Worker {index} (pid {pid}) exited with status {status}; replacing it")
+        children[spawn(index)] = index
+    logger.info("All workers stopped")
+
+
 # Run the app if executed directly
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Dr. Swatantra AI voice server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", 0)),
+                        help="serve from this many worker processes sharing the port "
+                             "(default: the single-process development server)")
+    parser.add_argument("--advertise-host", default=os.getenv("WORKER_HOST"),
+                        help="host clients can reach this machine's workers on directly")
+    args = parser.parse_args()
+    
+    if args.workers and hasattr(os, "fork"):
+        serve_workers(args.host, args.port, args.workers, args.advertise_host)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
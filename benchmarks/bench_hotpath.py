@@ -0,0 +1,216 @@
+"""
+Micro-benchmarks for the per-chunk primitives on the audio path.
+
+Covers what app.py does for every chunk:
+
+* WAV headers (``create_wav_header`` and ``WavHeaderTemplate``)
+* base64 encode/decode at typical chunk sizes
+* building outbound messages as ``play_audio`` does (``_encode_audio``)
+* the compressed client codecs (mu-law, ADPCM, Opus when available)
+* normalizing 20 ms of inbound audio at other rates and layouts to
+  16 kHz mono (``InputNormalizer``)
+* parsing inbound messages as ``audio_stream_socket`` does
+  (``client_audio_item``)
+* AudioQueue put/get round trips, both sync and through the event loop
+
+Each benchmark reports the best per-call time over ``--repeat`` runs. Save
+a run with ``--save`` and measure a change against it with ``--compare``;
+the exit status is 1 when any benchmark is slower than the baseline by
+more than ``--threshold``. ``--history`` appends every run to a JSON-lines
+file so the numbers can be followed over time. Baselines are machine
+specific, so record one on the same host before optimizing:
+
+    python benchmarks/bench_hotpath.py --save /tmp/hotpath-main.json
+    python benchmarks/bench_hotpath.py --compare /tmp/hotpath-main.json
+"""
+import os
+import sys
+import array
+import json
+import math
+import time
+import base64
+import timeit
+import asyncio
+import argparse
+import platform
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from app import (  # noqa: E402
+    FRAME_TYPE_AUDIO, FRAMING_STREAM, FRAMING_WAV, PROTOCOL_BINARY, PROTOCOL_JSON,
+    AudioLoop, AudioQueue, InputNormalizer, StreamClient, WavHeaderTemplate,
+    client_audio_item, create_wav_header, pack_frame,
+)
+
+# 20 ms of 16 kHz input, 40 ms and 200 ms of 24 kHz output
+CHUNK_SIZES = (640, 1920, 9600)
+
+
+def pcm(size: int) -> bytes:
+    return bytes(range(256)) * (size // 256) + bytes(size % 256)
+
+
+def f32(size: int) -> bytes:
+    """``size`` bytes of little-endian float32 samples: a 440 Hz tone at 48 kHz."""
+    samples = array.array("f", (0.5 * math.sin(2 * math.pi * 440 * i / 48000) for i in range(size // 4)))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def sync_benchmarks():
+    """(name, callable) pairs timed with timeit."""
+    benches = []
+    template = WavHeaderTemplate()
+    benches.append(("create_wav_header", lambda: create_wav_header(1920)))
+    benches.append(("WavHeaderTemplate.header", lambda: template.header(1920)))
+
+    for size in CHUNK_SIZES:
+        data = pcm(size)
+        encoded = base64.b64encode(data).decode("utf-8")
+        benches.append((f"b64encode {size} B", lambda data=data: base64.b64encode(data).decode("utf-8")))
+        benches.append((f"b64decode {size} B", lambda encoded=encoded: base64.b64decode(encoded)))
+
+    audio_loop = AudioLoop(None)
+    data = pcm(1920)
+    for binary, framing in ((False, FRAMING_STREAM), (False, FRAMING_WAV),
+                            (True, FRAMING_STREAM), (True, FRAMING_WAV)):
+        label = f"encode {'binary' if binary else 'json'}/{framing} 1920 B"
+        benches.append((label, lambda binary=binary, framing=framing:
+                        audio_loop._encode_audio(data, 7, binary, framing)))
+
+    for codec in app.CODECS:
+        if codec != app.CODEC_PCM:
+            encoder, encoded = app.create_codec(codec), app.create_codec(codec).encode(data)
+            benches.append((f"encode {codec} 1920 B", lambda encoder=encoder: encoder.encode(data)))
+            benches.append((f"decode {codec} 1920 B", lambda encoder=encoder, encoded=encoded:
+                            encoder.decode(encoded)))
+
+    for label, mime_type, size in (("16k passthrough", "audio/pcm", 640),
+                                   ("48k mono", "audio/pcm;rate=48000", 1920),
+                                   ("44.1k stereo", "audio/pcm;rate=44100;channels=2", 3528),
+                                   ("48k stereo f32", "audio/pcm;rate=48000;channels=2;encoding=f32le", 7680)):
+        data = f32(size) if "f32" in mime_type else pcm(size)
+        normalizer, item = InputNormalizer(), {"data": data, "mime_type": mime_type}
+        benches.append((f"normalize {label} 20 ms", lambda normalizer=normalizer, item=item:
+                        normalizer.process(item)))
+
+    data = pcm(640)
+    json_client = StreamClient(None, protocol=PROTOCOL_JSON)
+    binary_client = StreamClient(None, protocol=PROTOCOL_BINARY)
+    json_message = json.dumps({"type": "audio", "format": "audio/pcm",
+                               "data": base64.b64encode(data).decode("utf-8")})
+    frame = pack_frame(FRAME_TYPE_AUDIO, 7, data)
+    benches.append(("parse json audio 640 B", lambda: client_audio_item(None, json_client, json_message)))
+    benches.append(("parse binary frame 640 B", lambda: client_audio_item(None, binary_client, frame)))
+
+    item = {"data": data, "mime_type": "audio/pcm"}
+    queue = AudioQueue(50, app.QUEUE_POLICY_COALESCE)
+
+    def round_trip():
+        queue.put_nowait(item)
+        queue.get_nowait()
+
+    benches.append(("AudioQueue put_nowait/get_nowait", round_trip))
+    return benches
+
+
+async def queue_round_trips(count: int) -> float:
+    """Seconds for ``count`` put/get pairs handed between two tasks through an AudioQueue."""
+    queue = AudioQueue(50, app.QUEUE_POLICY_BLOCK)
+    item = {"data": pcm(640), "mime_type": "audio/pcm"}
+
+    async def consume():
+        for _ in range(count):
+            await queue.get()
+
+    consumer = asyncio.create_task(consume())
+    started = time.perf_counter()
+    for _ in range(count):
+        await queue.put(item)
+    await consumer
+    return time.perf_counter() - started
+
+
+def run(repeat: int):
+    """Return {name: best nanoseconds per call}."""
+    results = {}
+    for name, func in sync_benchmarks():
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat, number)) / number * 1e9
+
+    count = 20000
+    best = min(asyncio.run(queue_round_trips(count)) for _ in range(repeat))
+    results["AudioQueue put/get across tasks"] = best / count * 1e9
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(baseline, results, threshold):
+    """Benchmarks slower than ``baseline`` by more than ``threshold`` (a fraction)."""
+    slower = []
+    for name, ns in results.items():
+        before = baseline.get(name)
+        if before and ns > before * (1 + threshold):
+            slower.append(f"{name}: {before:.0f} -> {ns:.0f} ns (+{(ns / before - 1) * 100:.0f}%)")
+    return slower
+
+
+def main(args):
+    results = run(args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print(f"{'benchmark':<40} {'ns/call':>10}" + (f" {'baseline':>10} {'change':>8}" if baseline else ""))
+    for name, ns in results.items():
+        line = f"{name:<40} {ns:10.0f}"
+        if baseline and baseline.get(name):
+            line += f" {baseline[name]:10.0f} {(ns / baseline[name] - 1) * 100:+7.1f}%"
+        print(line)
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy": app.NUMPY_AVAILABLE,
+        "results": {name: round(ns, 1) for name, ns in results.items()},
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(record, f, indent=2)
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    if baseline:
+        slower = compare(baseline, results, args.threshold)
+        for line in slower:
+            print(f"REGRESSION {line}")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark; the best is kept")
+    parser.add_argument("--save", help="Write this run's results to a JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file written by --save")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Allowed slowdown against --compare, as a fraction")
+    parser.add_argument("--history", help="Append this run to a JSON-lines file")
+    app.logger.setLevel("WARNING")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,184 @@
+"""
+Micro-benchmark for the AudioLoop queue pipeline.
+
+Compares the previous sleep-polling implementation of ``send_realtime`` /
+``receive_audio`` / ``play_audio`` (reproduced below as ``PollingAudioLoop``)
+with the event-driven one in app.py. Two things are measured:
+
+* per-chunk end-to-end latency: client chunk queued -> sent upstream ->
+  echoed back by a stub Gemini session -> handed to the WebSocket client
+* idle CPU per session: process CPU time burnt by sessions that have no
+  traffic at all
+
+Run from the repository root:
+
+    python benchmarks/bench_queue_latency.py --chunks 200 --sessions 50
+"""
+import os
+import sys
+import time
+import json
+import base64
+import asyncio
+import argparse
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from app import AudioLoop, StreamClient, RECEIVE_SAMPLE_RATE, create_wav_header  # noqa: E402
+
+CHUNK = b"\x00\x01" * 320  # 20 ms of 16 kHz mono PCM
+
+
+class StubSession:
+    """Stands in for a Gemini live session: every chunk sent is echoed back as one turn."""
+
+    def __init__(self):
+        self.responses = asyncio.Queue()
+
+    async def send(self, input=None, **kwargs):
+        await self.responses.put(input["data"])
+
+    async def receive(self):
+        data = await self.responses.get()
+        yield SimpleNamespace(data=data)
+
+
+class StubWebSocket:
+    """Records the time each message reaches the client."""
+
+    def __init__(self):
+        self.received_at = []
+
+    def send(self, message):
+        self.received_at.append(time.perf_counter())
+
+
+class PollingAudioLoop(AudioLoop):
+    """The pre-change pipeline: poll queue.empty() and sleep 10 ms between checks."""
+
+    async def send_realtime(self):
+        while self.is_running:
+            if not self.out_queue.empty():
+                content = await self.out_queue.get()
+                if content:
+                    await self.session.send(input=content)
+            await asyncio.sleep(0.01)
+
+    async def receive_audio(self):
+        while self.is_running:
+            turn = self.session.receive()
+            async for response in turn:
+                if data := response.data:
+                    await self.audio_in_queue.put(data)
+            await asyncio.sleep(0.01)
+
+    async def listen_audio(self):
+        while self.is_running:
+            await asyncio.sleep(0.5)
+
+    async def play_audio(self):
+        while self.is_running:
+            if not self.audio_in_queue.empty():
+                audio_data = await self.audio_in_queue.get()
+                if audio_data and self.subscribers:
+                    wav_data = create_wav_header(len(audio_data), sample_rate=RECEIVE_SAMPLE_RATE) + audio_data
+                    message = json.dumps({
+                        "type": "audio",
+                        "format": "audio/wav",
+                        "data": base64.b64encode(wav_data).decode("utf-8"),
+                    })
+                    for client in list(self.subscribers):
+                        await asyncio.to_thread(client.ws.send, message)
+            await asyncio.sleep(0.01)
+
+
+def start_pipeline(loop_cls):
+    """Create an AudioLoop wired to stubs and start its pipeline tasks."""
+    # Upstream batching would add its own deliberate delay; measure the queues alone
+    audio_loop = loop_cls(client=None, options={"upstream_frame_ms": 0})
+    audio_loop.session = StubSession()
+    audio_loop.is_running = True
+    audio_loop._connected.set()  # normally set by run() once Gemini is connected
+    ws = StubWebSocket()
+    client = StreamClient(ws)
+    audio_loop.subscribers.add(client)
+    client.start()
+
+    coros = [audio_loop.send_realtime(), audio_loop.receive_audio(), audio_loop.play_audio()]
+    if hasattr(loop_cls, "listen_audio"):
+        coros.append(audio_loop.listen_audio())
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    return audio_loop, ws, tasks
+
+
+async def stop_pipeline(audio_loop, tasks):
+    audio_loop.is_running = False
+    for client in list(audio_loop.subscribers):
+        client.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def measure_latency(loop_cls, chunks, interval):
+    """Feed ``chunks`` chunks one at a time and return per-chunk latencies in ms."""
+    audio_loop, ws, tasks = start_pipeline(loop_cls)
+    latencies = []
+    try:
+        for _ in range(chunks):
+            expected = len(ws.received_at) + 1
+            sent_at = time.perf_counter()
+            audio_loop.out_queue.put_nowait({"data": CHUNK, "mime_type": "audio/pcm"})
+            while len(ws.received_at) < expected:
+                await asyncio.sleep(0.0005)
+            latencies.append((ws.received_at[-1] - sent_at) * 1000)
+            await asyncio.sleep(interval)
+    finally:
+        await stop_pipeline(audio_loop, tasks)
+    return latencies
+
+
+async def measure_idle_cpu(loop_cls, sessions, seconds):
+    """Return CPU milliseconds per idle session per second."""
+    pipelines = [start_pipeline(loop_cls) for _ in range(sessions)]
+    await asyncio.sleep(0.2)  # let the tasks settle
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu_used = time.process_time() - cpu_start
+
+    for audio_loop, _, tasks in pipelines:
+        await stop_pipeline(audio_loop, tasks)
+    return cpu_used * 1000 / sessions / seconds
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def main(args):
+    results = {}
+    for name, loop_cls in (("polling (before)", PollingAudioLoop), ("event-driven (after)", AudioLoop)):
+        latencies = await measure_latency(loop_cls, args.chunks, args.interval)
+        idle_cpu = await measure_idle_cpu(loop_cls, args.sessions, args.idle_seconds)
+        results[name] = (latencies, idle_cpu)
+
+    print(f"{'pipeline':<22} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'idle CPU ms/s/session':>22}")
+    for name, (latencies, idle_cpu) in results.items():
+        print(f"{name:<22} {percentile(latencies, 50):8.2f} {percentile(latencies, 95):8.2f} "
+              f"{statistics.mean(latencies):8.2f} {idle_cpu:22.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--chunks", type=int, default=200, help="Chunks to time per pipeline")
+    parser.add_argument("--interval", type=float, default=0.02, help="Seconds between chunks")
+    parser.add_argument("--sessions", type=int, default=50, help="Idle sessions for the CPU test")
+    parser.add_argument("--idle-seconds", type=float, default=3.0, help="Length of the idle CPU test")
+    app.logger.setLevel("WARNING")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+"""
+A local stand-in for ``client.aio.live.connect``.
+
+``FakeLiveClient`` has the shape AudioLoop expects from a genai client, so
+the server can run with no network and no API key. Each session plays a
+model that listens for the end of the caller's speech and then answers:
+
+* speech is any non-zero PCM; a frame ending in at least 10 ms of
+  digital silence after speech ends the caller's turn (the load
+  generator pads every utterance with zeros for this). Only the tail is
+  checked because the server may merge speech and silence into one frame
+* the reply starts after ``latency_ms`` plus uniform +/-``jitter_ms``
+* the reply echoes the caller's audio or is a synthesized tone, and is
+  streamed in ``chunk_ms`` pieces ``speed`` times faster than real time
+* speech arriving while a reply streams cuts it off with an
+  ``interrupted`` server message, as Gemini does on barge-in
+
+Install it in a server process before any session starts:
+
+    import app
+    app.create_gemini_client = lambda api_key=None: FakeLiveClient(FakeProfile())
+"""
+import math
+import array
+import random
+import asyncio
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+REPLY_SAMPLE_RATE = 24000  # what Gemini sends back
+SILENCE_TAIL_BYTES = 320  # 10 ms of 16 kHz PCM
+
+
+@dataclass
+class FakeProfile:
+    connect_ms: float = 50.0
+    latency_ms: float = 300.0
+    jitter_ms: float = 100.0
+    reply_ms: float = 1500.0
+    chunk_ms: float = 40.0
+    speed: float = 4.0
+    mode: str = "tone"  # "tone" or "echo"
+
+    def delay(self, ms: float, jitter_ms: float = 0.0) -> float:
+        """Seconds to wait for ``ms`` +/- ``jitter_ms``, never negative."""
+        return max(0.0, ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+
+
+def synthesize_tone(ms: float, sample_rate: int = REPLY_SAMPLE_RATE, frequency: float = 440.0) -> bytes:
+    """16-bit mono sine wave of ``ms`` milliseconds."""
+    count = int(sample_rate * ms / 1000)
+    step = 2 * math.pi * frequency / sample_rate
+    return array.array("h", (int(8000 * math.sin(i * step)) for i in range(count))).tobytes()
+
+
+class FakeLiveSession:
+    """One fake live connection; mirrors the session methods AudioLoop calls."""
+
+    def __init__(self, profile: FakeProfile, tone: bytes):
+        self.profile = profile
+        self._tone = tone
+        self._speech = []
+        self._replies = asyncio.Queue()
+        self._replying = False
+        self._interrupted = False
+        self.turns = 0
+        self.interruptions = 0
+
+    async def send(self, input=None, end_of_turn=False, **kwargs):
+        data = input.get("data") if isinstance(input, dict) else input
+        if not isinstance(data, (bytes, bytearray)) or not data:
+            return
+        if data.strip(b"\x00"):
+            self._speech.append(bytes(data))
+            if self._replying:
+                self._interrupted = True
+        if self._speech and not data[-SILENCE_TAIL_BYTES:].strip(b"\x00"):
+            utterance, self._speech = b"".join(self._speech), []
+            self._replies.put_nowait(self._reply_for(utterance))
+
+    async def send_client_content(self, turns=None, turn_complete=True, **kwargs):
+        """Accepts replayed history after a resume; the fake has no memory."""
+
+    def _reply_for(self, utterance: bytes) -> bytes:
+        size = int(REPLY_SAMPLE_RATE * 2 * self.profile.reply_ms / 1000)
+        if self.profile.mode == "echo":
+            return (utterance * (size // max(1, len(utterance)) + 1))[:size]
+        return self._tone[:size]
+
+    async def receive(self):
+        """Yield one model turn: the reply to the next utterance, in paced chunks."""
+        reply = await self._replies.get()
+        profile = self.profile
+        await asyncio.sleep(profile.delay(profile.latency_ms, profile.jitter_ms))
+
+        chunk_bytes = max(2, int(REPLY_SAMPLE_RATE * 2 * profile.chunk_ms / 1000) & ~1)
+        interval = profile.chunk_ms / 1000 / profile.speed if profile.speed > 0 else 0
+        self._replying, self._interrupted = True, False
+        try:
+            for offset in range(0, len(reply), chunk_bytes):
+                if offset:
+                    await asyncio.sleep(interval)
+                if self._interrupted:
+                    self.interruptions += 1
+                    content = SimpleNamespace(interrupted=True, input_transcription=None,
+                                              output_transcription=None)
+                    yield SimpleNamespace(data=None, server_content=content, session_resumption_update=None)
+                    break
+                yield SimpleNamespace(data=reply[offset:offset + chunk_bytes],
+                                      server_content=None, session_resumption_update=None)
+        finally:
+            self._replying = False
+        self.turns += 1
+
+
+class _FakeConnection:
+    def __init__(self, profile: FakeProfile, tone: bytes):
+        self.profile = profile
+        self.tone = tone
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.profile.delay(self.profile.connect_ms))
+        return FakeLiveSession(self.profile, self.tone)
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeLiveClient:
+    """Drop-in for a genai.Client as far as ``client.aio.live.connect`` is concerned."""
+
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+        tone = synthesize_tone(profile.reply_ms) if profile.mode == "tone" else b""
+
+        def connect(model=None, config=None):
+            return _FakeConnection(profile, tone)
+
+        self.aio = SimpleNamespace(live=SimpleNamespace(connect=connect))
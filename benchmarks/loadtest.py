@@ -0,0 +1,460 @@
+"""
+Load generator for the /audio-stream WebSocket API.
+
+Opens ``--clients`` concurrent sessions. Each one calls /start_voice,
+connects to /audio-stream, and for every turn streams an utterance of
+16 kHz PCM followed by digital silence. It then waits for the model's
+reply to finish. PCM is paced at ``--speed`` times real time, and
+``--speed 0`` sends as fast as the socket allows. At the end it reports:
+
+* time to first audio (TTFA), from the end of the utterance to the first
+  reply chunk, as p50/p95/p99
+* upstream/downstream throughput
+* server CPU and RSS, read from /proc
+
+By default the server runs in a child process with the fake live client
+from fake_live.py in place of Gemini, so the numbers cover only this
+server and the run works offline. Run from the repository root:
+
+    python benchmarks/loadtest.py --clients 50 --turns 3
+    python benchmarks/loadtest.py --clients 100 --speed 0 --protocol binary --asgi
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --server-pid 4242
+
+``--json results.json`` also writes the results. Pass a saved file as
+``--baseline`` to get a non-zero exit status when p95 TTFA or average
+server CPU is more than ``--threshold`` worse, e.g. before a deploy.
+"""
+import os
+import sys
+import json
+import time
+import wave
+import logging
+import base64
+import socket
+import asyncio
+import argparse
+import subprocess
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import websockets  # noqa: E402
+
+import app  # noqa: E402
+from app import FRAME_TYPE_AUDIO, pack_frame, parse_frame  # noqa: E402
+from fake_live import FakeLiveClient, FakeProfile, synthesize_tone  # noqa: E402
+
+SEND_SAMPLE_RATE = 16000
+
+
+# ==== Input audio ====
+
+def load_audio(path) -> bytes:
+    """
+    16 kHz mono 16-bit PCM from a .wav or raw .pcm file, or a synthesized tone.
+
+    The fake model treats 10 ms of zeros as the end of speech, so
+    recordings should not contain stretches of digital silence.
+    """
+    if path is None:
+        return synthesize_tone(1500, SEND_SAMPLE_RATE, 220.0)
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as wav:
+            if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (SEND_SAMPLE_RATE, 1, 2):
+                raise SystemExit(f"{path}: expected 16 kHz mono 16-bit PCM")
+            return wav.readframes(wav.getnframes())
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def encode_chunks(pcm: bytes, chunk_ms: int, protocol: str):
+    """
+    Split PCM into (payload, PCM bytes) pairs, shared by every client.
+
+    JSON messages are encoded here once; binary frames are built per send
+    because they carry the client's sequence number.
+    """
+    size = int(SEND_SAMPLE_RATE * 2 * chunk_ms / 1000)
+    chunks = [pcm[i:i + size] for i in range(0, len(pcm), size)]
+    if protocol == "binary":
+        return [(chunk, len(chunk)) for chunk in chunks]
+    return [(json.dumps({"type": "audio", "format": "audio/pcm",
+                         "data": base64.b64encode(chunk).decode("utf-8")}), len(chunk)) for chunk in chunks]
+
+
+# ==== Server process ====
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def profile_from(args) -> FakeProfile:
+    return FakeProfile(connect_ms=args.connect_ms, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                       reply_ms=args.reply_ms, speed=args.reply_speed, mode=args.reply_mode)
+
+
+def serve(args):
+    """Run app.py in this process with the fake live client (the child side of a run)."""
+    client = FakeLiveClient(profile_from(args))
+    app.create_gemini_client = lambda api_key=None: client
+    if not args.verbose:
+        app.logger.setLevel("WARNING")
+        logging.getLogger("werkzeug").setLevel("WARNING")
+    if args.asgi:
+        import uvicorn
+        uvicorn.run(app.create_asgi_app(), host="127.0.0.1", port=args.port, log_level="warning")
+    else:
+        from werkzeug.serving import make_server
+        make_server("127.0.0.1", args.port, app.app, threaded=True).serve_forever()
+
+
+def start_server(args):
+    """Start ``serve`` in a child process; returns (process, base_url)."""
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--connect-ms", str(args.connect_ms), "--latency-ms", str(args.latency_ms),
+               "--jitter-ms", str(args.jitter_ms), "--reply-ms", str(args.reply_ms),
+               "--reply-speed", str(args.reply_speed), "--reply-mode", args.reply_mode]
+    if args.asgi:
+        command.append("--asgi")
+    if args.verbose:
+        command.append("--verbose")
+    env = dict(os.environ)
+    env.setdefault("MAX_CONCURRENT_SESSIONS", str(args.clients))
+    process = subprocess.Popen(command, env=env)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(f"{base_url}/status", timeout=1).read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Server did not come up within 30 s")
+
+
+class ProcessSampler:
+    """Samples a process's CPU and RSS from /proc while the load runs."""
+
+    def __init__(self, pid, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss_mb = []
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self._ticks  # utime + stime
+        with open(f"/proc/{self.pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return cpu, rss_kb / 1024
+
+    async def run(self):
+        if self.pid is None or not os.path.exists(f"/proc/{self.pid}"):
+            return
+        last_cpu, _ = self._read()
+        last_at = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                cpu, rss = self._read()
+            except (OSError, StopIteration):
+                return
+            now = time.perf_counter()
+            self.cpu_percent.append((cpu - last_cpu) / (now - last_at) * 100)
+            self.rss_mb.append(rss)
+            last_cpu, last_at = cpu, now
+
+    def summary(self):
+        if not self.cpu_percent:
+            return None
+        return {
+            "cpu_avg_percent": round(sum(self.cpu_percent) / len(self.cpu_percent), 1),
+            "cpu_peak_percent": round(max(self.cpu_percent), 1),
+            "rss_peak_mb": round(max(self.rss_mb), 1),
+        }
+
+
+# ==== Clients ====
+
+class Totals:
+    def __init__(self):
+        self.sessions = 0
+        self.failures = []
+        self.turns = 0
+        self.timeouts = 0
+        self.ttfa_ms = []
+        self.turn_ms = []
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.messages_up = 0
+        self.messages_down = 0
+
+
+def post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.loads(response.read())
+
+
+async def wait_until_running(base_url, started, timeout: float):
+    """
+    Poll /status until the session's Gemini connection is up.
+
+    Audio that arrives before then is discarded by the server, which would
+    swallow a whole utterance when sending faster than real time.
+    """
+    query = urllib.parse.urlencode({"session_id": started["session_id"],
+                                    "session_token": started.get("session_token", "")})
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (await asyncio.to_thread(get_json, f"{base_url}/status?{query}")).get("running"):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def receive_loop(ws, totals, first_audio: asyncio.Event, turn_done: asyncio.Event,
+                       arrived: dict):
+    """
+    Count downstream traffic and signal the turn's first audio and its end.
+
+    ``arrived`` gets the perf_counter() time of each, taken as the message
+    comes in, so audio that arrives while the client is still sending is
+    timed correctly.
+    """
+    async for message in ws:
+        now = time.perf_counter()
+        totals.messages_down += 1
+        if isinstance(message, bytes):
+            frame_type, _, _, payload = parse_frame(message)
+            if frame_type == FRAME_TYPE_AUDIO:
+                totals.bytes_down += len(payload)
+                arrived.setdefault("first_audio", now)
+                first_audio.set()
+            continue
+        data = json.loads(message)
+        if data.get("type") == "audio":
+            totals.bytes_down += len(data["data"]) * 3 // 4
+            arrived.setdefault("first_audio", now)
+            first_audio.set()
+        elif data.get("type") == "control" and data.get("command") == "turn_complete":
+            arrived.setdefault("turn_done", now)
+            turn_done.set()
+
+
+async def run_client(index, args, base_url, speech, silence, totals):
+    await asyncio.sleep(index * args.ramp / max(1, args.clients))
+    try:
+        started = await asyncio.to_thread(post_json, f"{base_url}/start_voice", {})
+    except OSError as e:
+        totals.failures.append(f"start_voice: {e}")
+        return
+    if started.get("status") != "started":
+        totals.failures.append(f"start_voice: {started.get('message')}")
+        return
+
+    url = f"{started['websocket']['url']}&framing=stream&protocol={args.protocol}"
+    interval = args.chunk_ms / 1000 / args.speed if args.speed > 0 else 0
+    seq = 0
+
+    async def send(payload, pcm_bytes):
+        nonlocal seq
+        message = pack_frame(FRAME_TYPE_AUDIO, seq, payload) if args.protocol == "binary" else payload
+        seq += 1
+        await ws.send(message)
+        totals.messages_up += 1
+        totals.bytes_up += pcm_bytes
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            totals.sessions += 1
+            first_audio, turn_done = asyncio.Event(), asyncio.Event()
+            arrived = {}
+            receiver = asyncio.create_task(receive_loop(ws, totals, first_audio, turn_done, arrived))
+            if not await wait_until_running(base_url, started, args.turn_timeout):
+                totals.failures.append("session did not start running")
+                receiver.cancel()
+                return
+            for _ in range(args.turns):
+                first_audio.clear()
+                turn_done.clear()
+                arrived.clear()
+                next_at = time.perf_counter()
+                for i, chunk in enumerate(speech + silence):
+                    await send(*chunk)
+                    if i == len(speech) - 1:
+                        speech_end = time.perf_counter()
+                    next_at += interval
+                    await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                try:
+                    await asyncio.wait_for(first_audio.wait(), args.turn_timeout)
+                    totals.ttfa_ms.append((arrived["first_audio"] - speech_end) * 1000)
+                    await asyncio.wait_for(turn_done.wait(), args.turn_timeout)
+                    totals.turn_ms.append((arrived["turn_done"] - speech_end) * 1000)
+                    totals.turns += 1
+                except asyncio.TimeoutError:
+                    totals.timeouts += 1
+            receiver.cancel()
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        totals.failures.append(f"audio-stream: {e}")
+    finally:
+        try:
+            await asyncio.to_thread(post_json, f"{base_url}/terminate_voice", {
+                "session_id": started["session_id"], "session_token": started.get("session_token")
+            })
+        except OSError:
+            pass
+
+
+# ==== Report ====
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def distribution(values):
+    if not values:
+        return None
+    return {f"p{pct}": round(percentile(values, pct), 1) for pct in (50, 95, 99)} | {
+        "max": round(max(values), 1)}
+
+
+async def main(args):
+    process = None
+    base_url, pid = args.url, args.server_pid
+    if base_url is None:
+        process, base_url = start_server(args)
+        pid = process.pid
+    base_url = base_url.rstrip("/")
+
+    speech = encode_chunks(load_audio(args.audio), args.chunk_ms, args.protocol)
+    silence = encode_chunks(b"\x00" * int(SEND_SAMPLE_RATE * 2 * args.silence_ms / 1000),
+                            args.chunk_ms, args.protocol)
+
+    totals = Totals()
+    sampler = ProcessSampler(pid)
+    sampling = asyncio.create_task(sampler.run())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_client(i, args, base_url, speech, silence, totals)
+                               for i in range(args.clients)))
+    finally:
+        wall = time.perf_counter() - started
+        sampling.cancel()
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    results = {
+        "clients": args.clients,
+        "sessions": totals.sessions,
+        "failures": len(totals.failures),
+        "turns": totals.turns,
+        "timeouts": totals.timeouts,
+        "wall_seconds": round(wall, 2),
+        "ttfa_ms": distribution(totals.ttfa_ms),
+        "turn_ms": distribution(totals.turn_ms),
+        # Audio bytes are counted as PCM, whatever the wire encoding
+        "throughput": {
+            "up_kb_per_s": round(totals.bytes_up / 1024 / wall, 1),
+            "down_kb_per_s": round(totals.bytes_down / 1024 / wall, 1),
+            "up_messages_per_s": round(totals.messages_up / wall, 1),
+            "down_messages_per_s": round(totals.messages_down / wall, 1),
+        },
+        "server": sampler.summary(),
+    }
+
+    print(f"clients {args.clients}: {totals.sessions} connected, {len(totals.failures)} failed; "
+          f"turns {totals.turns} ok, {totals.timeouts} timed out; {wall:.1f} s")
+    for error in sorted(set(totals.failures))[:5]:
+        print(f"  failure: {error}")
+    for label, key in (("time to first audio", "ttfa_ms"), ("turn duration", "turn_ms")):
+        if results[key]:
+            print(f"{label:<20} " + "  ".join(f"{name} {value:8.1f} ms" for name, value in results[key].items()))
+    t = results["throughput"]
+    print(f"{'throughput':<20} up {t['up_kb_per_s']:.1f} KB/s ({t['up_messages_per_s']:.0f} msg/s)  "
+          f"down {t['down_kb_per_s']:.1f} KB/s ({t['down_messages_per_s']:.0f} msg/s)")
+    if results["server"]:
+        s = results["server"]
+        print(f"{'server':<20} CPU avg {s['cpu_avg_percent']:.1f} %  peak {s['cpu_peak_percent']:.1f} %  "
+              f"RSS peak {s['rss_peak_mb']:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            return regressions(json.load(f), results, args.threshold)
+    return []
+
+
+def regressions(baseline, results, threshold):
+    """Metrics that got worse than ``baseline`` by more than ``threshold`` (a fraction)."""
+    checks = (("p95 time to first audio", ("ttfa_ms", "p95")),
+              ("average server CPU", ("server", "cpu_avg_percent")))
+    found = []
+    for label, (section, key) in checks:
+        before = (baseline.get(section) or {}).get(key)
+        after = (results.get(section) or {}).get(key)
+        if before and after is not None and after > before * (1 + threshold):
+            found.append(f"{label}: {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+    for line in found:
+        print(f"REGRESSION {line}")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Utterances per session")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which clients connect")
+    parser.add_argument("--audio", help="16 kHz mono PCM (.wav or raw) to send; a tone by default")
+    parser.add_argument("--chunk-ms", type=int, default=20, help="Milliseconds of audio per message")
+    parser.add_argument("--silence-ms", type=int, default=200, help="Silence sent after each utterance")
+    parser.add_argument("--speed", type=float, default=1.0, help="Send rate as a multiple of real time; 0 = unpaced")
+    parser.add_argument("--protocol", choices=("json", "binary"), default="json")
+    parser.add_argument("--turn-timeout", type=float, default=30.0, help="Seconds to wait for each reply")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown against --baseline, as a fraction")
+    parser.add_argument("--url", help="Load an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID to sample CPU/RSS from when using --url")
+    parser.add_argument("--asgi", action="store_true", help="Run the local server in ASGI mode (uvicorn)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the server's INFO logs")
+    fake = parser.add_argument_group("fake Gemini live server")
+    fake.add_argument("--connect-ms", type=float, default=50.0, help="Time to open a live connection")
+    fake.add_argument("--latency-ms", type=float, default=300.0, help="Delay before a reply starts")
+    fake.add_argument("--jitter-ms", type=float, default=100.0, help="Uniform +/- jitter on the delay")
+    fake.add_argument("--reply-ms", type=float, default=1500.0, help="Length of each reply")
+    fake.add_argument("--reply-speed", type=float, default=4.0, help="Reply streaming rate as a multiple of real time")
+    fake.add_argument("--reply-mode", choices=("tone", "echo"), default="tone")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+    else:
+        app.logger.setLevel("WARNING")
+        sys.exit(1 if asyncio.run(main(args)) else 0)
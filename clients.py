@@ -0,0 +1,44 @@
+"""
+Gemini client registry shared by the voice servers.
+
+Both entry points spread their live sessions over one or more API keys.
+``ClientRegistry`` keeps one client per key and hands them out
+round-robin; the caller supplies the factory that builds a client, so
+each server keeps its own HTTP settings.
+"""
+
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ClientRegistry:
+    """
+    Process-wide Gemini clients, one per API key, built on first use.
+
+    Sessions share these clients (and their HTTP settings) instead of
+    constructing a new one each time. Each live session still opens its
+    own WebSocket. With several keys, ``get`` hands them out round-robin
+    so the sessions spread over the keys' quotas.
+    """
+
+    def __init__(self, api_keys: Optional[List[Optional[str]]],
+                 factory: Callable[[Optional[str]], Any]):
+        self.api_keys = list(api_keys or [None])
+        self._factory = factory
+        self._clients: Dict[int, Any] = {}
+        self._next = 0
+        self._lock = Lock()
+
+    def get(self):
+        """Return the next client in rotation, creating it if needed."""
+        with self._lock:
+            index = self._next % len(self.api_keys)
+            self._next += 1
+            client = self._clients.get(index)
+            if client is None:
+                client = self._clients[index] = self._factory(self.api_keys[index])
+            return client
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"keys": len(self.api_keys), "clients": len(self._clients)}
@@ -15,6 +15,8 @@ from flask_cors import CORS
 from queue import Queue
 from threading import Thread
 import logging
+from resilience import CircuitBreaker, retry_async
+from clients import ClientRegistry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,7 +28,8 @@ SEND_SAMPLE_RATE = 16000
 RECEIVE_SAMPLE_RATE = 24000
 CHUNK_SIZE = 1024
 MAX_RETRIES = 3
-RETRY_DELAY = 2
+RETRY_DELAY = 2  # base delay; doubles per attempt, with full jitter
+RETRY_MAX_DELAY = 20
 CONNECTION_TIMEOUT = 30
 DEFAULT_MODE = "none"  # Options: "camera", "screen", "none"
 
@@ -34,13 +37,23 @@ MODEL = "models/gemini-2.0-flash-live-001"
 app = Flask(__name__)
 CORS(app)
 
-client = genai.Client(
-    http_options={
-        "api_version": "v1beta",
-        "timeout": CONNECTION_TIMEOUT,
-    },
-    api_key=os.environ.get("GEMINI_API_KEY"),
-)
+# GEMINI_API_KEYS takes a comma-separated list of keys; connections rotate
+# through them. Falls back to GEMINI_API_KEY.
+API_KEYS = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
+if not API_KEYS:
+    API_KEYS = [os.environ.get("GEMINI_API_KEY")]
+
+def create_gemini_client(api_key):
+    """Create a Gemini client for one API key."""
+    return genai.Client(
+        http_options={
+            "api_version": "v1beta",
+            "timeout": CONNECTION_TIMEOUT,
+        },
+        api_key=api_key,
+    )
+
+gemini_clients = ClientRegistry(API_KEYS, create_gemini_client)
 
 CONFIG = types.LiveConnectConfig(
     response_modalities=["audio"],
@@ -57,6 +70,9 @@ CONFIG = types.LiveConnectConfig(
 
 pya = pyaudio.PyAudio()
 
+# Shared by every AudioLoop in the process: fails fast while Gemini is down
+upstream_circuit = CircuitBreaker("gemini-live")
+
 class AudioLoop:
     def __init__(self, video_mode=DEFAULT_MODE):
         self.video_mode = video_mode
@@ -70,25 +86,26 @@ class AudioLoop:
         self._stop_event = asyncio.Event()
         self._pause_event = asyncio.Event()
         self._loop = None
-        self.retry_count = 0
 
     async def connect_with_retry(self):
-        while self.retry_count < MAX_RETRIES:
-            try:
-                # Store the context manager
-                self._session_ctx = client.aio.live.connect(model=MODEL, config=CONFIG)
-                # Enter the context
-                self.session = await self._session_ctx.__aenter__()
-                logger.info("Successfully created Gemini API session")
-                return
-            except Exception as e:
-                self.retry_count += 1
-                logger.error(f"Connection attempt {self.retry_count} failed: {str(e)}")
-                if self.retry_count < MAX_RETRIES:
-                    await asyncio.sleep(RETRY_DELAY)
-                else:
-                    logger.error("Max retries reached, giving up")
-                    raise
+        async def connect():
+            # Store the context manager
+            session_ctx = gemini_clients.get().aio.live.connect(model=MODEL, config=CONFIG)
+            # Enter the context
+            session = await session_ctx.__aenter__()
+            self._session_ctx = session_ctx
+            return session
+
+        try:
+            self.session = await retry_async(
+                connect, attempts=MAX_RETRIES, base_delay=RETRY_DELAY,
+                max_delay=RETRY_MAX_DELAY, breaker=upstream_circuit,
+                description="Gemini API connection"
+            )
+        except Exception:
+            logger.error("Max retries reached, giving up")
+            raise
+        logger.info("Successfully created Gemini API session")
 
     async def stop(self):
         self.running = False
@@ -0,0 +1,165 @@
+"""
+Retry and circuit-breaker helpers shared by the Gemini voice servers.
+
+``retry_async`` retries a connect coroutine with capped exponential
+backoff and full jitter, so sessions that fail together don't all retry
+at the same instant. A process-wide ``CircuitBreaker`` fails calls fast
+while the upstream is unhealthy, then lets a single half-open probe
+through to test whether it has recovered.
+"""
+
+import time
+import random
+import asyncio
+import logging
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit is open."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter delay for a zero-based retry attempt: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures.
+
+    While open, ``allow`` refuses calls. After ``reset_timeout`` seconds
+    the breaker goes half-open and admits one probe. A successful probe
+    closes the circuit; a failed probe opens it again for another
+    ``reset_timeout``. The breaker is shared between threads and event
+    loops, so its state is guarded by a lock. ``clock`` is the monotonic
+    time source, replaceable in tests.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = Lock()
+        self.opened_count = 0
+        self.rejected = 0
+
+    def _refresh(self):
+        """Move from open to half-open once the reset timeout has passed. Caller holds the lock."""
+        if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit will admit a probe (0 when not open)."""
+        with self._lock:
+            self._refresh()
+            if self._state != STATE_OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now. In half-open state only one probe is admitted."""
+        with self._lock:
+            self._refresh()
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Give back a half-open probe slot when the probe was abandoned rather than failed."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != STATE_OPEN:
+                    logger.warning(f"Circuit {self.name} opened after {self._failures} failures")
+                    self.opened_count += 1
+                self._state = STATE_OPEN
+                self._opened_at = self._clock()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened_count,
+                "rejected": self.rejected,
+            }
+
+
+async def retry_async(operation: Callable[[], Awaitable[Any]], *, attempts: int,
+                      base_delay: float, max_delay: float,
+                      breaker: Optional[CircuitBreaker] = None,
+                      description: str = "operation",
+                      sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep) -> Any:
+    """
+    Await ``operation()`` up to ``attempts`` times, sleeping with jittered backoff between tries.
+
+    Raises CircuitOpenError without calling the operation when ``breaker``
+    refuses the attempt. Otherwise the last exception is re-raised once
+    the attempts run out.
+    """
+    for attempt in range(attempts):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(
+                f"Circuit {breaker.name} is open; not attempting {description}",
+                retry_after=breaker.retry_after(),
+            )
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release_probe()
+            raise
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure()
+            logger.error(f"{description} attempt {attempt + 1}/{attempts} failed: {str(e)}")
+            if attempt + 1 >= attempts:
+                raise
+            await sleep(backoff_delay(attempt, base_delay, max_delay))
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
@@ -0,0 +1,32 @@
+"""
+Shared fixtures. The tests run offline: Gemini is replaced by the fake
+live client from benchmarks/fake_live.py.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import app  # noqa: E402
+from fake_live import FakeLiveClient, FakeProfile  # noqa: E402
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """Route new sessions to a fake live client with no connect delay."""
+    client = FakeLiveClient(FakeProfile(connect_ms=0, latency_ms=20, jitter_ms=0, reply_ms=200))
+    monkeypatch.setattr(app.gemini_clients, "get", lambda *args, **kwargs: client)
+    return client
+
+
+@pytest.fixture
+def manager(fake_gemini):
+    """A SessionManager of its own, whose sessions are ended after the test."""
+    manager = app.SessionManager(max_sessions=2, orphan_timeout=30.0)
+    yield manager
+    for session in manager.sessions():
+        manager.terminate(session.session_id)
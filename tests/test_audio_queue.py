@@ -0,0 +1,150 @@
+"""AudioQueue overflow policies, and the batching of queued audio into upstream frames."""
+import asyncio
+
+import pytest
+
+from app import (
+    QUEUE_POLICY_BLOCK, QUEUE_POLICY_COALESCE, QUEUE_POLICY_DROP_OLDEST, TURN_COMPLETE,
+    AudioLoop, AudioQueue, TurnTrace,
+)
+
+PCM = "audio/pcm;rate=16000"
+
+
+def chunk(data, mime_type=PCM):
+    return {"data": data, "mime_type": mime_type}
+
+
+def contents(queue):
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def test_block_raises_queue_full_from_put_nowait():
+    queue = AudioQueue(2, QUEUE_POLICY_BLOCK)
+    queue.put_nowait(chunk(b"a"))
+    queue.put_nowait(chunk(b"b"))
+
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(chunk(b"c"))
+    assert queue.stats()["dropped"] == 0
+    assert [item["data"] for item in contents(queue)] == [b"a", b"b"]
+
+
+def test_drop_oldest_evicts_the_oldest_audio():
+    queue = AudioQueue(2, QUEUE_POLICY_DROP_OLDEST)
+    for data in (b"a", b"b", b"c", b"d"):
+        queue.put_nowait(chunk(data))
+
+    assert [item["data"] for item in contents(queue)] == [b"c", b"d"]
+    assert queue.stats()["dropped"] == 2
+    assert queue.stats()["high_water"] == 2
+
+
+def test_drop_oldest_keeps_markers():
+    queue = AudioQueue(2, QUEUE_POLICY_DROP_OLDEST)
+    queue.put_nowait(TURN_COMPLETE)
+    queue.put_nowait(chunk(b"a"))
+    queue.put_nowait(chunk(b"b"))
+
+    assert contents(queue) == [TURN_COMPLETE, chunk(b"b")]
+
+
+def test_coalesce_merges_adjacent_pcm_with_the_same_mime():
+    queue = AudioQueue(2, QUEUE_POLICY_COALESCE)
+    for data in (b"a", b"b", b"c", b"d"):
+        queue.put_nowait(chunk(data))
+
+    assert contents(queue) == [chunk(b"a"), chunk(b"bcd")]
+    assert queue.stats()["coalesced"] == 2
+    assert queue.stats()["dropped"] == 0
+
+
+def test_coalesce_keeps_different_formats_apart():
+    queue = AudioQueue(2, QUEUE_POLICY_COALESCE)
+    queue.put_nowait(chunk(b"a"))
+    queue.put_nowait(chunk(b"b", "audio/pcm;rate=48000"))
+    queue.put_nowait(chunk(b"c"))
+
+    # Nothing to merge with, so the oldest chunk makes room instead
+    assert contents(queue) == [chunk(b"b", "audio/pcm;rate=48000"), chunk(b"c")]
+    assert queue.stats()["dropped"] == 1
+
+
+@pytest.mark.parametrize("tail", [TURN_COMPLETE, TurnTrace(None), chunk(b"x", "image/jpeg")])
+def test_coalesce_falls_back_to_drop_behind_a_non_mergeable_tail(tail):
+    queue = AudioQueue(2, QUEUE_POLICY_COALESCE)
+    queue.put_nowait(chunk(b"a"))
+    queue.put_nowait(tail)
+    queue.put_nowait(chunk(b"b"))
+
+    assert contents(queue) == [tail, chunk(b"b")]
+    assert queue.stats()["dropped"] == 1
+    assert queue.stats()["coalesced"] == 0
+
+
+def test_coalesce_respects_its_size_cap():
+    queue = AudioQueue(1, QUEUE_POLICY_COALESCE, coalesce_max_bytes=4)
+    queue.put_nowait(chunk(b"ab"))
+    queue.put_nowait(chunk(b"cd"))
+    queue.put_nowait(chunk(b"ef"))
+
+    assert contents(queue) == [chunk(b"ef")]
+    assert queue.stats()["coalesced"] == 1
+    assert queue.stats()["dropped"] == 1
+
+
+def test_clear_wakes_a_blocked_producer():
+    async def scenario():
+        queue = AudioQueue(1, QUEUE_POLICY_BLOCK)
+        await queue.put(chunk(b"a"))
+        producer = asyncio.ensure_future(queue.put(chunk(b"b")))
+        await asyncio.sleep(0)
+        assert not producer.done()
+
+        queue.clear()
+        await asyncio.wait_for(producer, 1)
+        return contents(queue)
+
+    assert asyncio.run(scenario()) == [chunk(b"b")]
+
+
+def coalesce_upstream(items, **options):
+    """Run AudioLoop._coalesce_upstream on the first item with the rest queued behind it."""
+    async def scenario():
+        audio_loop = AudioLoop(None, dict({"upstream_frame_ms": 40, "upstream_max_wait_ms": 0}, **options))
+        for item in items[1:]:
+            audio_loop.out_queue.put_nowait(item)
+        sent = await audio_loop._coalesce_upstream(items[0])
+        return sent, audio_loop._upstream_pending, audio_loop.out_queue.qsize()
+
+    return asyncio.run(scenario())
+
+
+def test_upstream_frames_merge_queued_pcm_up_to_the_frame_size():
+    # 20 ms chunks at 16 kHz; a 40 ms frame takes two of them
+    items = [chunk(bytes([i]) * 640) for i in range(3)]
+
+    sent, pending, left = coalesce_upstream(items)
+
+    assert sent == chunk(bytes([0]) * 640 + bytes([1]) * 640)
+    assert pending is None
+    assert left == 1
+
+
+@pytest.mark.parametrize("other", [chunk(b"\x00" * 640, "audio/pcm;rate=48000"), chunk(b"jpeg", "image/jpeg")])
+def test_upstream_frames_hold_back_an_item_that_cannot_merge(other):
+    sent, pending, left = coalesce_upstream([chunk(b"\x00" * 640), other])
+
+    assert sent == chunk(b"\x00" * 640)
+    assert pending is other
+    assert left == 0
+
+
+def test_non_pcm_goes_upstream_unbatched():
+    image = chunk(b"jpeg", "image/jpeg")
+
+    sent, pending, left = coalesce_upstream([image, chunk(b"\x00" * 640)])
+
+    assert sent is image
+    assert pending is None
+    assert left == 1
@@ -0,0 +1,111 @@
+"""Barge-in discards the model audio that the caller would otherwise still hear."""
+import asyncio
+import json
+
+import pytest
+
+import app
+from app import BARGE_IN_SERVER, FRAMING_STREAM, TURN_COMPLETE, AudioLoop, StreamClient
+
+CHUNK = b"\x01\x00" * 480
+
+
+class StubWebSocket:
+    def send(self, message):
+        pass
+
+
+def buffered(client):
+    """(droppable, decoded message) for everything in a client's buffer."""
+    return [(droppable, json.loads(message)) for message, droppable, _ in client._buffer]
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def pipeline():
+    """An AudioLoop running play_audio to one subscriber whose sender never runs."""
+    async def start():
+        audio_loop = AudioLoop(None, {"barge_in": BARGE_IN_SERVER})
+        client = StreamClient(StubWebSocket(), framing=FRAMING_STREAM)
+        audio_loop.subscribers.add(client)
+        player = asyncio.create_task(audio_loop.play_audio())
+        return audio_loop, client, player
+
+    return start
+
+
+def test_barge_in_discards_queued_and_buffered_model_audio(pipeline):
+    async def scenario():
+        audio_loop, client, player = await pipeline()
+        try:
+            # Gemini is mid-turn: some audio reached the client's buffer...
+            audio_loop._model_turn_open = True
+            for _ in range(3):
+                await audio_loop.audio_in_queue.put(CHUNK)
+            await settle()
+            assert [droppable for droppable, _ in buffered(client)] == [False, True, True, True]
+
+            # ...and more is still queued when the caller starts talking
+            for _ in range(2):
+                audio_loop.audio_in_queue.put_nowait(CHUNK)
+            discarded = app.BARGE_IN_DISCARDED_BYTES._values.copy()
+
+            assert audio_loop.barge_in(BARGE_IN_SERVER)
+            assert audio_loop.audio_in_queue.empty()
+            messages = buffered(client)
+            assert all(not droppable for droppable, _ in messages)
+            assert messages[-1][1] == {"type": "control", "command": "flush", "turn": 1, "reason": "server"}
+            counted = app.BARGE_IN_DISCARDED_BYTES._values
+            assert counted[("queue",)] - discarded.get(("queue",), 0) == 2 * len(CHUNK)
+            assert counted[("client_buffer",)] - discarded.get(("client_buffer",), 0) > 0
+
+            # The rest of the interrupted turn is skipped; the next turn plays
+            audio_loop.audio_in_queue.put_nowait(CHUNK)
+            audio_loop.audio_in_queue.put_nowait(TURN_COMPLETE)
+            audio_loop._model_turn_open = False
+            audio_loop.audio_in_queue.put_nowait(CHUNK)
+            await settle()
+
+            audio = [message for droppable, message in buffered(client) if droppable]
+            assert len(audio) == 1
+            assert audio_loop._turn_seq == 2
+            assert audio_loop.barge_ins == 1
+        finally:
+            player.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_barge_in_without_model_audio_does_nothing(pipeline):
+    async def scenario():
+        audio_loop, client, player = await pipeline()
+        try:
+            assert not audio_loop.barge_in(BARGE_IN_SERVER)
+            assert buffered(client) == []
+            assert audio_loop.barge_ins == 0
+        finally:
+            player.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_second_barge_in_on_the_same_turn_is_ignored(pipeline):
+    async def scenario():
+        audio_loop, client, player = await pipeline()
+        try:
+            audio_loop._model_turn_open = True
+            audio_loop.audio_in_queue.put_nowait(CHUNK)
+            await settle()
+
+            assert audio_loop.barge_in(BARGE_IN_SERVER)
+            assert not audio_loop.barge_in(BARGE_IN_SERVER)
+            flushes = [message for _, message in buffered(client) if message.get("command") == "flush"]
+            assert len(flushes) == 1
+        finally:
+            player.cancel()
+
+    asyncio.run(scenario())
@@ -0,0 +1,107 @@
+"""
+Malformed /audio-stream messages are dropped one at a time instead of
+ending the call.
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import json
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import (
+    ERRORS, FRAME_HEADER, FRAME_TYPE_AUDIO, PROTOCOL_BINARY, StreamClient,
+    client_audio_item, handle_client_message, pack_frame,
+)
+
+
+class StubWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+class StubSession:
+    """Just enough of a VoiceSession for handle_client_message."""
+
+    def __init__(self):
+        self.session_id = "test-session"
+        self.audio_loop = SimpleNamespace(is_running=True)
+        self.fed = []
+        self.stop_requested = False
+
+    def feed(self, item):
+        self.fed.append(item)
+
+    def request_stop(self):
+        self.stop_requested = True
+
+
+def errors_for(error_type):
+    return ERRORS._values.get(("client_message", error_type), 0)
+
+
+@pytest.fixture
+def session():
+    return StubSession()
+
+
+@pytest.mark.parametrize("protocol, message, error_type", [
+    (PROTOCOL_BINARY, b"\x01\x00", "ValueError"),
+    (None, json.dumps({"type": "audio", "data": "AAA"}), "Error"),
+    (None, json.dumps({"type": "audio"}), "KeyError"),
+    (None, json.dumps({"type": "audio", "data": 12}), "TypeError"),
+    (None, json.dumps(["audio"]), "TypeError"),
+    (None, "not json at all", "JSONDecodeError"),
+])
+def test_malformed_message_is_dropped(session, protocol, message, error_type):
+    client = StreamClient(StubWebSocket(), protocol=protocol)
+    before = errors_for(error_type)
+
+    assert client_audio_item(session, client, message) is None
+    assert errors_for(error_type) == before + 1
+
+
+def test_call_continues_after_malformed_message(session):
+    client = StreamClient(StubWebSocket(), protocol=PROTOCOL_BINARY)
+    audio = b"\x00\x01" * 160
+
+    handle_client_message(session, client, b"\x01")
+    handle_client_message(session, client, pack_frame(FRAME_TYPE_AUDIO, 1, audio))
+
+    assert [item["data"] for item in session.fed] == [audio]
+
+
+def test_json_call_continues_after_malformed_message(session):
+    client = StreamClient(StubWebSocket())
+    audio = b"\x00\x01" * 160
+
+    handle_client_message(session, client, json.dumps({"type": "audio"}))
+    handle_client_message(session, client, '{"type": "audio", "data": "%%%"')
+    handle_client_message(session, client, json.dumps({
+        "type": "audio", "data": base64.b64encode(audio).decode("ascii"),
+    }))
+
+    assert len(session.fed) == 1
+    assert session.fed[0]["data"] == audio
+    assert not session.stop_requested
+
+
+def test_header_only_frame_is_empty_audio(session):
+    client = StreamClient(StubWebSocket(), protocol=PROTOCOL_BINARY)
+    frame = pack_frame(FRAME_TYPE_AUDIO, 7, b"")
+
+    assert len(frame) == FRAME_HEADER.size
+    assert client_audio_item(session, client, frame)["data"] == b""
+
+
+def test_monitor_ignores_non_object_json(session):
+    client = StreamClient(StubWebSocket(), role=app.ROLE_MONITOR)
+
+    assert client_audio_item(session, client, "[1, 2]") is None
@@ -0,0 +1,32 @@
+"""ClientRegistry: one client per key, handed out round-robin."""
+import app
+from clients import ClientRegistry
+
+
+def test_clients_rotate_over_keys_and_are_reused():
+    built = []
+
+    def factory(api_key):
+        built.append(api_key)
+        return f"client-{api_key}"
+
+    registry = ClientRegistry(["a", "b"], factory)
+
+    assert [registry.get() for _ in range(5)] == ["client-a", "client-b"] * 2 + ["client-a"]
+    assert built == ["a", "b"]
+    assert registry.stats() == {"keys": 2, "clients": 2}
+
+
+def test_no_keys_means_one_default_client():
+    registry = ClientRegistry([], lambda api_key: object())
+
+    assert registry.get() is registry.get()
+    assert registry.api_keys == [None]
+
+
+def test_app_registry_uses_the_current_client_factory(monkeypatch):
+    fake = object()
+    monkeypatch.setattr(app, "create_gemini_client", lambda api_key=None: fake)
+    monkeypatch.setattr(app.gemini_clients, "_clients", {})
+
+    assert app.gemini_clients.get() is fake
@@ -0,0 +1,140 @@
+"""Round trips through the negotiated /audio-stream codecs."""
+import array
+import math
+
+import pytest
+
+import app
+from app import ADPCM_HEADER, AdpcmCodec, MulawCodec, adpcm_decode, create_codec
+
+
+def tone(count, rate=app.RECEIVE_SAMPLE_RATE, frequency=440.0, amplitude=0.5):
+    return array.array("h", (int(amplitude * 32767 * math.sin(2 * math.pi * frequency * i / rate))
+                             for i in range(count)))
+
+
+def chunks(samples, size):
+    return [samples[i:i + size].tobytes() for i in range(0, len(samples), size)]
+
+
+ALL_SAMPLES = array.array("h", range(-32768, 32768)).tobytes()
+
+# G.711 reference points: silence, the smallest step and both clip limits
+MULAW_REFERENCE = [(0, 0xFF), (-1, 0x7E), (1, 0xFF), (32767, 0x80), (-32768, 0x00), (32124, 0x80)]
+MULAW_DECODED = [(0xFF, 0), (0x7F, 0), (0x80, 32124), (0x00, -32124), (0xF0, 120)]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def mulaw_tables(request, monkeypatch):
+    """Run μ-law tests against both the numpy and the pure-Python tables."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(app, "NUMPY_AVAILABLE", request.param == "numpy")
+    monkeypatch.setattr(app, "_mulaw_tables", None)
+
+
+def test_mulaw_matches_g711_reference(mulaw_tables):
+    codec = MulawCodec()
+    samples, encoded = zip(*MULAW_REFERENCE)
+    assert codec.encode(array.array("h", samples).tobytes()) == bytes(encoded)
+
+    encoded, samples = zip(*MULAW_DECODED)
+    assert array.array("h", codec.decode(bytes(encoded))).tolist() == list(samples)
+
+
+def test_mulaw_round_trip_is_stable(mulaw_tables):
+    codec = MulawCodec()
+    # 0x7F is negative zero, which encodes back as 0xFF
+    words = bytes(word for word in range(256) if word != 0x7F)
+
+    # Every other code word decodes to a level that encodes back to itself
+    assert codec.encode(codec.decode(words)) == words
+    assert len(codec.encode(ALL_SAMPLES)) == len(ALL_SAMPLES) // 2
+
+
+def test_mulaw_matches_audioop_for_every_sample():
+    audioop = pytest.importorskip("audioop")
+    codec = MulawCodec()
+
+    assert codec.encode(ALL_SAMPLES) == audioop.lin2ulaw(ALL_SAMPLES, 2)
+    assert codec.decode(bytes(range(256))) == audioop.ulaw2lin(bytes(range(256)), 2)
+
+
+def test_adpcm_round_trip_error_is_bounded():
+    samples = tone(app.RECEIVE_SAMPLE_RATE)
+    codec = AdpcmCodec()
+    decoded = array.array("h", b"".join(adpcm_decode(codec.encode(chunk))
+                                        for chunk in chunks(samples, 961)))
+
+    assert len(decoded) == len(samples)
+    # The step size adapts within the first 20 ms; after that the error
+    # stays within 2% of full scale
+    settled = app.RECEIVE_SAMPLE_RATE // 50
+    assert max(abs(a - b) for a, b in zip(decoded[settled:], samples[settled:])) < 0.02 * 32768
+
+
+def test_adpcm_header_carries_encoder_state_per_chunk():
+    samples = tone(4000)
+    parts = chunks(samples, 961)
+    codec = AdpcmCodec()
+    encoded = []
+    for part in parts:
+        state = (codec.predictor, codec.index)
+        encoded.append(codec.encode(part))
+        predictor, index, padded = ADPCM_HEADER.unpack_from(encoded[-1])
+        assert (predictor, index) == state
+        assert padded == (len(part) // 2) & 1
+        assert len(encoded[-1]) == ADPCM_HEADER.size + (len(part) // 2 + 1) // 2
+
+    streamed = [adpcm_decode(chunk) for chunk in encoded]
+    assert [len(chunk) for chunk in streamed] == [len(part) for part in parts]
+
+
+def test_adpcm_chunks_decode_like_one_continuous_stream():
+    codec = AdpcmCodec()
+    encoded = [codec.encode(part) for part in chunks(tone(4800), 960)]
+    continuous = adpcm_decode(encoded[0][:ADPCM_HEADER.size]
+                              + b"".join(chunk[ADPCM_HEADER.size:] for chunk in encoded))
+
+    # Each header restarts the decoder where the last chunk left it, so a
+    # chunk decodes on its own and a lost chunk doesn't corrupt the rest
+    assert b"".join(adpcm_decode(chunk) for chunk in encoded) == continuous
+
+
+def test_adpcm_rejects_a_chunk_shorter_than_its_header():
+    with pytest.raises(ValueError):
+        adpcm_decode(b"\x00\x00")
+
+
+def test_opus_round_trip():
+    pytest.importorskip("opuslib")
+    if app.CODEC_OPUS not in app.CODECS:
+        pytest.skip("libopus is not available")
+    rate = app.SEND_SAMPLE_RATE
+    codec = app.OpusCodec(encode_rate=rate, decode_rate=rate)
+    samples = tone(rate, rate=rate)
+    # Not a whole number of 20 ms frames: flush pads the tail with silence
+    samples = samples[:len(samples) - 100]
+
+    encoded = b"".join(codec.encode(chunk) for chunk in chunks(samples, 1000)) + codec.flush()
+    decoded = array.array("h", codec.decode(encoded))
+
+    frame = rate * app.OPUS_FRAME_MS // 1000
+    assert len(decoded) == -(-len(samples) // frame) * frame
+    # Lossy, so compare levels rather than samples
+    level = max(abs(s) for s in decoded[frame * 5:len(samples)])
+    assert level == pytest.approx(max(samples), rel=0.2)
+
+    with pytest.raises(ValueError):
+        codec.decode(encoded[:3])
+
+
+@pytest.mark.parametrize("name", ["pcm", "mulaw", "adpcm"])
+def test_create_codec_gives_fresh_state(name):
+    assert create_codec(name) is not create_codec(name)
+    assert create_codec(name).name == name
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        create_codec("mp3")
@@ -0,0 +1,93 @@
+"""InputNormalizer: streaming conversion to 16 kHz mono int16."""
+import array
+import math
+import warnings
+
+import pytest
+
+import app
+from app import InputNormalizer
+
+np = pytest.importorskip("numpy")
+
+F32_STEREO_48K = "audio/pcm;rate=48000;channels=2;encoding=f32le"
+
+
+def tone(count, rate=48000, frequency=440.0, amplitude=0.5):
+    return [amplitude * math.sin(2 * math.pi * frequency * i / rate) for i in range(count)]
+
+
+def s16(samples):
+    return array.array("h", (int(s * 32767) for s in samples)).tobytes()
+
+
+def f32_stereo(samples):
+    return np.repeat(np.asarray(samples, dtype="<f4"), 2).tobytes()
+
+
+def normalize(data, mime_type, sizes):
+    """Feed ``data`` in chunks of the given sizes (cycled) and join the output."""
+    normalizer, out, offset, i = InputNormalizer(), [], 0, 0
+    while offset < len(data):
+        size = sizes[i % len(sizes)]
+        item = normalizer.process({"data": data[offset:offset + size], "mime_type": mime_type})
+        if item is not None:
+            out.append(item["data"])
+        offset += size
+        i += 1
+    return b"".join(out)
+
+
+def test_16k_mono_passes_through_untouched():
+    item = {"data": s16(tone(320, rate=16000)), "mime_type": "audio/pcm"}
+    assert InputNormalizer().process(item) is item
+
+
+@pytest.mark.parametrize("mime_type, data", [
+    ("audio/pcm;rate=48000", s16(tone(4800))),
+    ("audio/pcm;rate=44100;channels=2", s16([s for s in tone(4410, rate=44100) for _ in (0, 1)])),
+    (F32_STEREO_48K, f32_stereo(tone(4800))),
+])
+def test_streaming_matches_one_shot(mime_type, data):
+    one_shot = normalize(data, mime_type, [len(data)])
+    # Odd sizes split sample frames and land on every resampler phase
+    streamed = normalize(data, mime_type, [7, 1001, 333, 1920])
+
+    assert one_shot
+    assert streamed == one_shot
+
+
+def test_resampled_length_and_level():
+    out = np.frombuffer(normalize(s16(tone(48000)), "audio/pcm;rate=48000", [1920]), dtype="<i2")
+
+    assert abs(len(out) - 16000) <= 1
+    # A 440 Hz tone keeps its level through the low-pass filter
+    assert np.abs(out[1000:]).max() == pytest.approx(0.5 * 32767, rel=0.02)
+
+
+@pytest.mark.parametrize("bad, clean", [
+    (float("nan"), 0.0),
+    (float("inf"), 1.0),
+    (float("-inf"), -1.0),
+    (3.5, 1.0),
+])
+def test_non_finite_float_input_is_sanitized(bad, clean):
+    samples = tone(4800)
+    poisoned, expected = list(samples), list(samples)
+    poisoned[100:110] = [bad] * 10
+    expected[100:110] = [clean] * 10
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        out = normalize(f32_stereo(poisoned), F32_STEREO_48K, [1920])
+
+    # Later chunks are unaffected: the filter history holds clean samples
+    assert out == normalize(f32_stereo(expected), F32_STEREO_48K, [1920])
+
+
+def test_python_fallback_sanitizes_float_input():
+    data = array.array("f", [float("nan"), float("inf"), float("-inf"), 0.5, 2.0, -2.0]).tobytes()
+    out = array.array("h")
+    out.frombytes(InputNormalizer._convert_python(memoryview(data), 1, app.INPUT_ENCODING_F32))
+
+    assert list(out) == [0, 32767, -32767, 16384, 32767, -32767]
@@ -0,0 +1,176 @@
+"""CircuitBreaker state transitions and retry_async, on an injected clock."""
+import asyncio
+
+import pytest
+
+from resilience import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError,
+    backoff_delay, retry_async,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=10.0, clock=clock)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert breaker.state == STATE_CLOSED
+
+
+def test_retry_after_counts_down_while_open(breaker, clock):
+    assert breaker.retry_after() == 0.0
+    trip(breaker)
+    assert breaker.retry_after() == pytest.approx(10.0)
+
+    clock.advance(4)
+    assert breaker.retry_after() == pytest.approx(6.0)
+
+    clock.advance(6)
+    assert breaker.retry_after() == 0.0
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_half_open_admits_a_single_probe(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes_the_circuit(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_timeout(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert breaker.retry_after() == pytest.approx(10.0)
+    assert breaker.stats()["opened"] == 2
+
+
+def test_abandoned_probe_is_released(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    assert breaker.allow()
+
+    breaker.release_probe()
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
+
+
+def test_backoff_delay_is_capped_full_jitter(monkeypatch):
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    assert [backoff_delay(attempt, 0.5, 3.0) for attempt in range(5)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+    monkeypatch.setattr("random.uniform", lambda low, high: low)
+    assert backoff_delay(4, 0.5, 3.0) == 0.0
+
+
+class Flaky:
+    """An operation that fails ``failures`` times, then returns "ok"."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError(f"failure {self.calls}")
+        return "ok"
+
+
+def run_retry(operation, sleeps, **kwargs):
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    kwargs = {"attempts": 4, "base_delay": 0.5, "max_delay": 1.5, "sleep": sleep, **kwargs}
+    return asyncio.run(retry_async(operation, **kwargs))
+
+
+def test_retry_succeeds_after_transient_failures():
+    operation, sleeps = Flaky(2), []
+
+    assert run_retry(operation, sleeps) == "ok"
+    assert operation.calls == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+
+
+def test_retry_gives_up_after_its_attempts():
+    operation, sleeps = Flaky(10), []
+
+    with pytest.raises(ConnectionError, match="failure 4"):
+        run_retry(operation, sleeps)
+    assert operation.calls == 4
+    # No sleep after the last attempt, and every delay respects the cap
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= bound for delay, bound in zip(sleeps, (0.5, 1.0, 1.5)))
+
+
+def test_retry_stops_when_the_breaker_opens(breaker):
+    operation, sleeps = Flaky(10), []
+
+    with pytest.raises(CircuitOpenError) as raised:
+        run_retry(operation, sleeps, attempts=5, breaker=breaker)
+    assert operation.calls == breaker.failure_threshold
+    assert raised.value.retry_after == pytest.approx(10.0)
+
+
+def test_retry_records_success_on_the_breaker(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+
+    assert run_retry(Flaky(0), [], breaker=breaker) == "ok"
+    assert breaker.state == STATE_CLOSED
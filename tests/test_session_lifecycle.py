@@ -0,0 +1,190 @@
+"""Pausing, idle suspend and bounded shutdown of an AudioLoop."""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import app
+from app import FRAMING_STREAM, PAUSE_CLIENT, PAUSE_IDLE, AudioLoop, StreamClient
+from fake_live import FakeLiveClient, FakeProfile
+
+SPEECH = {"data": b"\x00\x10" * 320, "mime_type": "audio/pcm"}
+MODEL_AUDIO = b"\x01\x00" * 480
+
+
+class StubWebSocket:
+    def send(self, message):
+        pass
+
+
+class CountingClient(FakeLiveClient):
+    """The fake live client, counting the connections it opens."""
+
+    def __init__(self):
+        super().__init__(FakeProfile(connect_ms=0, latency_ms=20, jitter_ms=0, reply_ms=200))
+        self.connects = 0
+        connect = self.aio.live.connect
+
+        def counting_connect(**kwargs):
+            self.connects += 1
+            return connect(**kwargs)
+
+        self.aio = SimpleNamespace(live=SimpleNamespace(connect=counting_connect))
+
+
+def controls(client):
+    messages = [json.loads(message) for message, droppable, _ in client._buffer if not droppable]
+    return [message["command"] for message in messages if message.get("type") == "control"]
+
+
+def buffered_audio(client):
+    return [message for message, droppable, _ in client._buffer if droppable]
+
+
+async def settle(seconds=0.05):
+    await asyncio.sleep(seconds)
+
+
+async def start(client, **options):
+    audio_loop = AudioLoop(client, dict({"vad_mode": "off"}, **options))
+    subscriber = StreamClient(StubWebSocket(), framing=FRAMING_STREAM)
+    audio_loop.subscribers.add(subscriber)
+    run = asyncio.create_task(audio_loop.run(app.get_live_connect_config()))
+    await asyncio.wait_for(audio_loop._connected.wait(), 2)
+    return audio_loop, subscriber, run
+
+
+async def finish(audio_loop, run):
+    await audio_loop.stop()
+    await asyncio.wait_for(run, 2)
+
+
+def test_idle_session_is_suspended_and_revived_without_reconnecting():
+    async def scenario():
+        client = CountingClient()
+        audio_loop, subscriber, run = await start(client, idle_suspend_s=0.2)
+        try:
+            await audio_loop.ingest(SPEECH)
+            audio_loop.audio_in_queue.put_nowait(MODEL_AUDIO)
+            await settle()
+            assert audio_loop.upstream_sends == 1
+            assert buffered_audio(subscriber)
+
+            await settle(0.3)
+            assert audio_loop.pause_reason == PAUSE_IDLE
+            # Model audio nobody heard is released, and the client is told
+            assert buffered_audio(subscriber) == []
+            assert controls(subscriber)[-1] == "paused"
+            assert audio_loop.out_queue.empty() and audio_loop.audio_in_queue.empty()
+
+            # Nothing already queued goes upstream while suspended
+            audio_loop.out_queue.put_nowait(dict(SPEECH))
+            await settle()
+            assert audio_loop.upstream_sends == 1
+
+            # The next frame wakes it on the connection it kept
+            await audio_loop.ingest(SPEECH)
+            await settle()
+            assert not audio_loop.paused
+            assert controls(subscriber)[-1] == "resumed"
+            assert audio_loop.upstream_sends == 2
+            assert client.connects == 1
+        finally:
+            await finish(audio_loop, run)
+
+    asyncio.run(scenario())
+
+
+def test_client_pause_ignores_audio_until_unpaused():
+    async def scenario():
+        client = CountingClient()
+        audio_loop, subscriber, run = await start(client)
+        try:
+            assert await audio_loop.pause(PAUSE_CLIENT)
+            assert not await audio_loop.pause(PAUSE_CLIENT)
+
+            await audio_loop.ingest(SPEECH)
+            await settle()
+            assert audio_loop.pause_reason == PAUSE_CLIENT
+            assert audio_loop.upstream_sends == 0
+
+            assert await audio_loop.unpause()
+            await audio_loop.ingest(SPEECH)
+            await settle()
+            assert audio_loop.upstream_sends == 1
+            assert client.connects == 1
+        finally:
+            await finish(audio_loop, run)
+
+    asyncio.run(scenario())
+
+
+class HangingSession:
+    """A live session whose sends and receives never complete."""
+
+    def __init__(self, forever):
+        self.forever = forever
+
+    async def send(self, **kwargs):
+        await self.forever.wait()
+
+    async def receive(self):
+        await self.forever.wait()
+        yield
+
+
+class HangingConnection:
+    def __init__(self, forever):
+        self.forever = forever
+
+    async def __aenter__(self):
+        return HangingSession(self.forever)
+
+    async def __aexit__(self, *exc_info):
+        await self.forever.wait()
+
+
+def test_stop_returns_within_its_bound_when_upstream_hangs(monkeypatch):
+    monkeypatch.setattr(app, "SHUTDOWN_TIMEOUT", 0.3)
+
+    async def scenario():
+        forever = asyncio.Event()
+        client = SimpleNamespace(aio=SimpleNamespace(live=SimpleNamespace(
+            connect=lambda **kwargs: HangingConnection(forever))))
+        audio_loop, _, run = await start(client)
+        await audio_loop.ingest(SPEECH)
+        await settle()
+
+        started = time.perf_counter()
+        await audio_loop.stop()
+        elapsed = time.perf_counter() - started
+
+        # stop() cancels a run() still closing the session at the deadline
+        await asyncio.wait([run], timeout=1)
+        assert run.done()
+        assert audio_loop.session is None
+        # Nothing is left running
+        assert [task for task in asyncio.all_tasks() if task is not asyncio.current_task()] == []
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.3 + 0.2
+
+
+def test_stop_during_connect_cancels_it(monkeypatch):
+    monkeypatch.setattr(app, "SHUTDOWN_TIMEOUT", 0.3)
+
+    async def scenario():
+        client = CountingClient()
+        client.profile.connect_ms = 10_000
+        audio_loop = AudioLoop(client)
+        run = asyncio.create_task(audio_loop.run(app.get_live_connect_config()))
+        await settle()
+
+        started = time.perf_counter()
+        await audio_loop.stop()
+        await asyncio.wait_for(run, 1)
+        return time.perf_counter() - started, audio_loop.session
+
+    elapsed, session = asyncio.run(scenario())
+    assert elapsed < 0.3 + 0.2
+    assert session is None
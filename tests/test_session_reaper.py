@@ -0,0 +1,66 @@
+"""Sessions left without a caller are ended so they don't hold a slot forever."""
+import time
+
+import pytest
+
+import app
+from app import SessionLimitError, StreamClient
+
+
+class StubWebSocket:
+    def send(self, message):
+        pass
+
+    def close(self):
+        pass
+
+
+def later(seconds):
+    return time.monotonic() + seconds
+
+
+def test_session_that_is_never_attached_is_reaped(manager):
+    session = manager.create(app.get_live_connect_config())
+
+    assert manager.reap_orphans(now=later(10)) == []
+    assert manager.reap_orphans(now=later(31)) == [session.session_id]
+    assert manager.get(session.session_id) is None
+    assert not session.is_alive()
+
+
+def test_session_is_reaped_after_its_caller_drops(manager):
+    session = manager.create(app.get_live_connect_config())
+    client = StreamClient(StubWebSocket())
+    session.attach(client)
+
+    assert manager.reap_orphans(now=later(3600)) == []
+
+    session.detach(client)
+    assert manager.reap_orphans(now=later(10)) == []
+    assert manager.reap_orphans(now=later(31)) == [session.session_id]
+
+
+def test_monitor_does_not_keep_a_session_alive(manager):
+    session = manager.create(app.get_live_connect_config())
+    session.attach(StreamClient(StubWebSocket(), role=app.ROLE_MONITOR))
+
+    assert manager.reap_orphans(now=later(31)) == [session.session_id]
+
+
+def test_reaping_frees_the_slot(manager):
+    for _ in range(manager.max_sessions):
+        manager.create(app.get_live_connect_config())
+    with pytest.raises(SessionLimitError):
+        manager.create(app.get_live_connect_config())
+
+    assert len(manager.reap_orphans(now=later(31))) == manager.max_sessions
+    assert manager.create(app.get_live_connect_config()) is not None
+
+
+def test_zero_timeout_disables_reaping(fake_gemini):
+    manager = app.SessionManager(max_sessions=1, orphan_timeout=0)
+    session = manager.create(app.get_live_connect_config())
+    try:
+        assert manager.reap_orphans(now=later(3600)) == []
+    finally:
+        manager.terminate(session.session_id)
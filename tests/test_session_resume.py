@@ -0,0 +1,134 @@
+"""Reconnecting a dropped Gemini session by resumption handle or history replay."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import AudioLoop
+from fake_live import FakeLiveClient, FakeProfile
+
+SEED = [{"role": "user", "text": "Hello"}, {"role": "model", "text": "Hi there"}]
+
+
+class RecordingClient(FakeLiveClient):
+    """The fake live client, recording each connect's config and replayed history."""
+
+    def __init__(self):
+        super().__init__(FakeProfile(connect_ms=0, latency_ms=20, jitter_ms=0, reply_ms=200))
+        self.configs = []
+        self.replays = []
+        connect = self.aio.live.connect
+
+        def recording_connect(model=None, config=None):
+            self.configs.append(config)
+            return RecordingConnection(connect(model=model, config=config), len(self.configs), self.replays)
+
+        self.aio = SimpleNamespace(live=SimpleNamespace(connect=recording_connect))
+
+
+class RecordingConnection:
+    def __init__(self, connection, number, replays):
+        self.connection = connection
+        self.number = number
+        self.replays = replays
+
+    async def __aenter__(self):
+        session = await self.connection.__aenter__()
+
+        async def send_client_content(turns=None, turn_complete=True, **kwargs):
+            self.replays.append((self.number, turns))
+
+        session.send_client_content = send_client_content
+        return session
+
+    async def __aexit__(self, *exc_info):
+        return await self.connection.__aexit__(*exc_info)
+
+
+def transcript(role, text):
+    field = "input_transcription" if role == "user" else "output_transcription"
+    content = dict(input_transcription=None, output_transcription=None, interrupted=None)
+    content[field] = SimpleNamespace(text=text)
+    return SimpleNamespace(server_content=SimpleNamespace(**content), session_resumption_update=None)
+
+
+def resumption_handle(handle):
+    return SimpleNamespace(server_content=None,
+                           session_resumption_update=SimpleNamespace(resumable=True, new_handle=handle))
+
+
+def run_resume(responses, history=SEED):
+    """Start a session, feed it server messages, drop its connection and resume."""
+    async def scenario():
+        client = RecordingClient()
+        audio_loop = AudioLoop(client, {"vad_mode": "off"})
+        config = dict(app.get_live_connect_config(), history=history)
+        run = asyncio.create_task(audio_loop.run(config))
+        try:
+            await asyncio.wait_for(audio_loop._connected.wait(), 2)
+            for response in responses:
+                audio_loop._observe(response)
+            resumed = await asyncio.wait_for(audio_loop.resume(audio_loop.session), 2)
+            return resumed, audio_loop, client
+        finally:
+            await audio_loop.stop()
+            await asyncio.wait_for(run, 2)
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def session_resume(monkeypatch):
+    monkeypatch.setattr(app, "SESSION_RESUME", True)
+
+
+def test_resume_reconnects_with_the_latest_handle(session_resume):
+    resumed, audio_loop, client = run_resume([resumption_handle("h1"), resumption_handle("h2")])
+
+    assert resumed
+    assert audio_loop.resumes == 1
+    assert len(client.configs) == 2
+    assert client.configs[0].session_resumption.handle is None
+    assert client.configs[1].session_resumption.handle == "h2"
+    # Gemini keeps the conversation; only the first connection got the seed
+    assert [number for number, _ in client.replays] == [1]
+
+
+def test_resume_without_a_handle_replays_the_history(session_resume):
+    resumed, audio_loop, client = run_resume([
+        transcript("model", "!"), transcript("user", "How are "), transcript("user", "you?"),
+        transcript("model", "Well."),
+    ])
+
+    assert resumed
+    assert client.configs[1].session_resumption.handle is None
+    assert [number for number, _ in client.replays] == [1, 2]
+    _, turns = client.replays[1]
+    assert turns == [
+        {"role": "user", "parts": [{"text": "Hello"}]},
+        {"role": "model", "parts": [{"text": "Hi there!"}]},
+        {"role": "user", "parts": [{"text": "How are you?"}]},
+        {"role": "model", "parts": [{"text": "Well."}]},
+    ]
+    # Fragments merged into the last seeded turn leave the caller's copy alone
+    assert SEED[-1] == {"role": "model", "text": "Hi there"}
+
+
+def test_without_resumption_a_dropped_session_ends(monkeypatch):
+    monkeypatch.setattr(app, "SESSION_RESUME", False)
+    assert app.get_live_connect_config()["live_connect_config"].input_audio_transcription is None
+
+    resumed, audio_loop, client = run_resume([resumption_handle("h1")])
+
+    assert not resumed
+    assert audio_loop._stop_event.is_set()
+    assert len(client.configs) == 1
+
+
+def test_resume_enables_transcription(session_resume):
+    live_config = app.get_live_connect_config()["live_connect_config"]
+
+    assert live_config.session_resumption is not None
+    assert live_config.input_audio_transcription is not None
+    assert live_config.output_audio_transcription is not None
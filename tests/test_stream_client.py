@@ -0,0 +1,94 @@
+"""StreamClient sends, and who may attach to a session's output."""
+import asyncio
+import threading
+
+import pytest
+
+import app
+from app import ROLE_MONITOR, StreamClient, attach_stream_client
+
+
+class StubSocket:
+    def __init__(self):
+        self.shut_down = threading.Event()
+
+    def shutdown(self, how):
+        self.shut_down.set()
+
+
+class StalledWebSocket:
+    """A blocking WebSocket whose peer stopped reading: send blocks until the socket is shut down."""
+
+    def __init__(self):
+        self.sock = StubSocket()
+        self.returned = threading.Event()
+
+    def send(self, message):
+        try:
+            if not self.sock.shut_down.wait(5):
+                return
+            raise OSError("socket shut down")
+        finally:
+            self.returned.set()
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def test_stalled_send_drops_the_client_and_frees_its_thread(monkeypatch):
+    monkeypatch.setattr(app, "SEND_TIMEOUT", 0.1)
+
+    async def scenario():
+        stalled, healthy = StalledWebSocket(), RecordingWebSocket()
+        failed = []
+        clients = [StreamClient(stalled), StreamClient(healthy)]
+        for client in clients:
+            client.bind(asyncio.get_running_loop(), on_failed=failed.append)
+            client.start()
+            client.enqueue("audio")
+        await asyncio.sleep(0.3)
+        for client in clients:
+            client.stop()
+        return stalled, healthy, failed, clients
+
+    stalled, healthy, failed, clients = asyncio.run(scenario())
+
+    assert failed == [clients[0]]
+    assert stalled.sock.shut_down.is_set()
+    assert stalled.returned.wait(1)
+    assert healthy.sent == ["audio"]
+
+
+@pytest.fixture
+def monitored(manager, monkeypatch):
+    monkeypatch.setattr(app, "MONITOR_TOKEN", "s3cret")
+    monkeypatch.setattr(app, "session_manager", manager)
+    return manager.create(app.get_live_connect_config())
+
+
+@pytest.mark.parametrize("token", [None, "", "s3cre", "s3cret!", "sécret"])
+def test_monitor_needs_the_token(monitored, token):
+    client = StreamClient(RecordingWebSocket(), role=ROLE_MONITOR)
+    args = {"session_id": monitored.session_id, "mode": ROLE_MONITOR}
+    if token is not None:
+        args["token"] = token
+
+    session, error = attach_stream_client(client, args, app.get_live_connect_config())
+
+    assert session is None
+    assert "token" in error
+
+
+def test_monitor_with_the_token_is_attached(monitored):
+    client = StreamClient(RecordingWebSocket(), role=ROLE_MONITOR)
+    args = {"session_id": monitored.session_id, "mode": ROLE_MONITOR, "token": "s3cret"}
+
+    session, error = attach_stream_client(client, args, app.get_live_connect_config())
+
+    assert error is None
+    assert session is monitored
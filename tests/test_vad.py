@@ -0,0 +1,120 @@
+"""VoiceActivityDetector on synthetic silence, tone and hiss."""
+import array
+import math
+import random
+
+import pytest
+
+from app import VAD_DROP, VAD_OFF, VAD_THIN, VoiceActivityDetector
+
+RATE = 16000
+CHUNK_MS = 20
+CHUNK_SAMPLES = RATE * CHUNK_MS // 1000
+PCM = "audio/pcm;rate=16000"
+
+
+def pcm(samples):
+    return {"data": array.array("h", samples).tobytes(), "mime_type": PCM}
+
+
+def silence():
+    return pcm([0] * CHUNK_SAMPLES)
+
+
+def tone(frequency=220.0, amplitude=0.3):
+    return pcm(int(amplitude * 32767 * math.sin(2 * math.pi * frequency * i / RATE))
+               for i in range(CHUNK_SAMPLES))
+
+
+def hiss(amplitude=0.3, seed=1):
+    rng = random.Random(seed)
+    return pcm(int(amplitude * 32767 * rng.uniform(-1, 1)) for _ in range(CHUNK_SAMPLES))
+
+
+def feed(vad, items):
+    return [out for item in items for out in vad.process(item)]
+
+
+def test_silence_is_dropped_in_drop_mode():
+    vad = VoiceActivityDetector(VAD_DROP)
+
+    assert feed(vad, [silence() for _ in range(50)]) == []
+    assert vad.stats()["chunks_in"] == 50
+    assert vad.stats()["chunks_out"] == 0
+
+
+def test_speech_flushes_the_preroll_ahead_of_it():
+    vad = VoiceActivityDetector(VAD_DROP, preroll_ms=300)
+    quiet = [silence() for _ in range(30)]
+    speech = tone()
+
+    assert feed(vad, quiet) == []
+    forwarded = vad.process(speech)
+
+    # Only the last 300 ms of silence is kept, oldest first
+    assert len(forwarded) == 300 // CHUNK_MS + 1
+    assert all(a is b for a, b in zip(forwarded, quiet[-300 // CHUNK_MS:] + [speech]))
+    assert vad.in_speech
+    # The preroll goes out once; the silence after speech is hangover
+    after = silence()
+    assert vad.process(after) == [after]
+
+
+def test_hangover_forwards_silence_after_speech_then_drops():
+    vad = VoiceActivityDetector(VAD_DROP, hangover_ms=200)
+    feed(vad, [tone() for _ in range(5)])
+
+    forwarded = [len(vad.process(silence())) for _ in range(15)]
+
+    assert forwarded == [1] * (200 // CHUNK_MS) + [0] * 5
+    assert not vad.in_speech
+
+
+def test_thin_mode_sends_one_in_every_n_silent_chunks():
+    vad = VoiceActivityDetector(VAD_THIN, thin_every=10)
+
+    forwarded = [len(vad.process(silence())) for _ in range(30)]
+
+    assert forwarded == ([0] * 9 + [1]) * 3
+
+
+def test_hiss_is_not_speech():
+    vad = VoiceActivityDetector(VAD_DROP)
+
+    assert feed(vad, [hiss(seed=i) for i in range(10)]) == []
+    # A tone at the same level passes the zero-crossing check
+    assert VoiceActivityDetector(VAD_DROP).is_speech(tone()["data"])
+
+
+def test_noise_floor_raises_the_threshold():
+    vad = VoiceActivityDetector(VAD_DROP, energy_threshold=300.0)
+    quiet_tone = tone(amplitude=0.02)  # about 460 RMS
+    assert vad.is_speech(quiet_tone["data"])
+
+    # A steady low hum that is itself below the threshold
+    for _ in range(200):
+        vad.process(tone(frequency=100.0, amplitude=0.01))
+
+    assert vad.noise_floor == pytest.approx(0.01 * 32767 / math.sqrt(2), rel=0.05)
+    assert not vad.is_speech(quiet_tone["data"])
+
+
+def test_off_mode_forwards_everything_but_tracks_speech():
+    vad = VoiceActivityDetector(VAD_OFF, track_speech=True)
+    items = [silence(), tone(), tone(), silence()]
+
+    assert feed(vad, items[:3]) == items[:3]
+    assert vad.speech_ms == 2 * CHUNK_MS
+    assert vad.last_speech_at is not None
+
+    assert vad.process(items[3]) == [items[3]]
+    assert vad.speech_ms == 0.0
+
+
+def test_clear_forgets_the_preroll():
+    vad = VoiceActivityDetector(VAD_DROP)
+    feed(vad, [silence() for _ in range(10)])
+    vad.clear()
+
+    speech = tone()
+    assert vad.process(speech) == [speech]